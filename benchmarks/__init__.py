@@ -0,0 +1,7 @@
+"""
+Benchmarks offline da coleta e da verificação diária
+Sobe servidores locais no lugar da NextFit e da mundodosbots (latência, limite de
+página, 429 e erros configuráveis), gera clientes e contas sintéticos e executa
+collect_all_users e check_accounts_and_birthdays de ponta a ponta.
+Uso: python -m benchmarks.run --help
+"""
@@ -0,0 +1,81 @@
+"""
+Dados sintéticos e determinísticos para os benchmarks
+Clientes e contas são calculados a partir do índice (sem guardar a base em
+memória), então 500 mil clientes custam o mesmo que mil para o servidor local.
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+_MULTIPLIER = 2654435761
+_MASK = 0xFFFFFFFF
+
+
+def _hash(*values: int) -> int:
+    h = 0x9E3779B9
+    for value in values:
+        h = ((h ^ value) * _MULTIPLIER) & _MASK
+        h ^= h >> 15
+    return h
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """
+    Base sintética da academia
+
+    clients: clientes na listagem (GetClientes)
+    receivables_per_day: contas a receber por data de vencimento
+    unknown_clients: clientes que aparecem nas contas mas não na listagem (busca por Id)
+    paid_ratio: fração de contas com status fora de VALID_ACCOUNT_STATUSES
+    shared_phone_ratio: fração de contas do mesmo cliente no dia (agrupamento de mensagens)
+    """
+    clients: int
+    receivables_per_day: int
+    unknown_clients: int = 0
+    paid_ratio: float = 0.1
+    shared_phone_ratio: float = 0.05
+    seed: int = 1
+
+    def client(self, client_id: int) -> Optional[Dict]:
+        if not 1 <= client_id <= self.clients + self.unknown_clients:
+            return None
+        h = _hash(self.seed, client_id)
+        birth = date(1950 + h % 55, 1, 1) + timedelta(days=(h >> 8) % 365)
+        return {
+            "id": client_id,
+            "nome": f"Cliente {client_id}",
+            "dddFone": "11",
+            "fone": f"9{client_id:08d}",
+            # ~2% das datas inválidas, como na base real
+            "dataNascimento": "00/00/0000" if h % 50 == 0 else f"{birth.isoformat()}T00:00:00",
+        }
+
+    def clients_page(self, skip: int, take: int) -> Tuple[List[Dict], bool]:
+        end = min(skip + take, self.clients)
+        return [self.client(i + 1) for i in range(skip, end)], end < self.clients
+
+    def receivable(self, due: date, index: int) -> Dict:
+        h = _hash(self.seed, due.toordinal(), index)
+        population = self.clients + self.unknown_clients
+        # Parte das contas repete o cliente da conta anterior (vários planos no mesmo dia)
+        if index and (h % 1000) < self.shared_phone_ratio * 1000:
+            h_client = _hash(self.seed, due.toordinal(), index - 1)
+        else:
+            h_client = h
+        if self.unknown_clients and (h_client >> 4) % population >= self.clients:
+            client_id = self.clients + 1 + (h_client >> 4) % self.unknown_clients
+        else:
+            client_id = 1 + (h_client >> 4) % self.clients
+        return {
+            "codigo": due.toordinal() * 1_000_000 + index,
+            "codigoCliente": client_id,
+            "valor": 50 + (h >> 12) % 400,
+            "dataVencimento": f"{due.isoformat()}T00:00:00",
+            "status": "Pago" if ((h >> 20) % 1000) < self.paid_ratio * 1000 else "Aberto",
+            "descricao": f"Plano {(h >> 24) % 5}",
+        }
+
+    def receivables_page(self, due: date, skip: int, take: int) -> Tuple[List[Dict], bool]:
+        end = min(skip + take, self.receivables_per_day)
+        return [self.receivable(due, i) for i in range(skip, end)], end < self.receivables_per_day
@@ -0,0 +1,155 @@
+"""
+Servidores HTTP locais no lugar da NextFit e da mundodosbots
+Cada servidor roda em uma thread, com latência, limite de itens por página,
+taxa de respostas 429 e de erros 503 configuráveis, e conta as requisições
+por endpoint e status.
+"""
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.dataset import Dataset
+
+
+@dataclass
+class Behavior:
+    """Comportamento simulado de uma API"""
+    latency: float = 0.02          # segundos por requisição
+    jitter: float = 0.0            # variação aleatória somada à latência
+    max_page_size: int = 30        # Take acima disso é truncado
+    throttle_rate: float = 0.0     # fração de respostas 429
+    retry_after: float = 0.5       # header Retry-After dos 429
+    error_rate: float = 0.0        # fração de respostas 503
+
+
+class FakeAPI:
+    """Base dos servidores: contadores, injeção de falhas e ciclo de vida"""
+
+    def __init__(self, behavior: Behavior, seed: int = 1):
+        self.behavior = behavior
+        self.requests: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAPI":
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                api._handle(self, "GET")
+
+            def do_POST(self):
+                api._handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset_counters(self) -> Dict[str, int]:
+        with self._lock:
+            counters, self.requests = self.requests, {}
+        return counters
+
+    def _count(self, endpoint: str, status: int):
+        key = f"{endpoint} {status}"
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def _roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _reply(self, handler: BaseHTTPRequestHandler, endpoint: str, status: int, body=None, headers=None):
+        payload = json.dumps(body if body is not None else {}).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+        self._count(endpoint, status)
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        behavior = self.behavior
+        time.sleep(behavior.latency + (self._roll() * behavior.jitter if behavior.jitter else 0))
+        if behavior.throttle_rate and self._roll() < behavior.throttle_rate:
+            self._reply(handler, parsed.path, 429, {"message": "Too Many Requests"},
+                        {"Retry-After": str(behavior.retry_after)})
+            return
+        if behavior.error_rate and self._roll() < behavior.error_rate:
+            self._reply(handler, parsed.path, 503, {"message": "Service Unavailable"})
+            return
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        status, response = self.route(method, parsed.path, query, body)
+        self._reply(handler, parsed.path, status, response)
+
+    def route(self, method: str, path: str, query: Dict[str, str], body: bytes):
+        raise NotImplementedError
+
+
+class FakeNextFit(FakeAPI):
+    """/Pessoa/GetClientes (listagem e busca por Id) e /ContaReceber"""
+
+    def __init__(self, dataset: Dataset, behavior: Behavior, seed: int = 1):
+        super().__init__(behavior, seed)
+        self.dataset = dataset
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/api/v1"
+
+    def route(self, method, path, query, body):
+        skip = int(query.get("Skip", 0))
+        take = min(int(query.get("Take", 30)), self.behavior.max_page_size)
+        if path.endswith("/Pessoa/GetClientes"):
+            if "Id" in query:
+                client = self.dataset.client(int(query["Id"]))
+                return 200, {"items": [client] if client else [], "temProximaPagina": False}
+            items, has_next = self.dataset.clients_page(skip, take)
+            return 200, {"items": items, "temProximaPagina": has_next}
+        if path.endswith("/ContaReceber"):
+            due = date.fromisoformat(query["DataVencimentoInicio"][:10])
+            items, has_next = self.dataset.receivables_page(due, skip, take)
+            return 200, {"items": items, "temProximaPagina": has_next}
+        return 404, {"message": "Not Found"}
+
+
+class FakeMessages(FakeAPI):
+    """Endpoint de contatos da mundodosbots (POST com phone e flow)"""
+
+    def route(self, method, path, query, body):
+        if method != "POST":
+            return 405, {"message": "Method Not Allowed"}
+        try:
+            json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"message": "Invalid JSON"}
+        return 200, {"success": True}
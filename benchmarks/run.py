@@ -0,0 +1,284 @@
+"""
+Executa os cenários de benchmark e compara com os limites de referência
+
+Cada job (coleta, verificação) roda em um subprocesso próprio, apontado para os
+servidores locais por variáveis de ambiente, para que o pico de memória (RSS) e
+o tempo medidos sejam só do job. Os servidores rodam neste processo e contam as
+requisições recebidas.
+
+Exemplos:
+    python -m benchmarks.run --scenario smoke
+    python -m benchmarks.run --scenario medium --env ACCOUNTS_PREFETCH_PAGES=4
+    python -m benchmarks.run --scenario smoke --scenario medium --baseline benchmarks/baseline.json
+    python -m benchmarks.run --scenario smoke --write-baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_apis import FakeMessages, FakeNextFit
+from benchmarks.scenarios import SCENARIOS, Scenario
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+# Configuração comum dos jobs: flows e campos preenchidos para que as mensagens sejam montadas
+BASE_ENV = {
+    "NEXTFIT_API_KEY": "benchmark",
+    "MESSAGE_API_TOKEN": "benchmark",
+    "SEND_MESSAGES": "true",
+    "FLOW_ID_VENCENDO_HOJE": "101",
+    "FLOW_ID_VENCENDO_3_DIAS": "102",
+    "FLOW_ID_VENCIDO_3_DIAS": "103",
+    "FLOW_ID_VENCIDO_5_DIAS": "104",
+    "FLOW_ID_VENCIDO_30_DIAS": "105",
+    "FLOW_ID_ANIVERSARIANTE": "106",
+    "MESSAGE_FIELD_1": "nome",
+    "MESSAGE_FIELD_2": "valor",
+    "MESSAGE_FIELD_3": "vencimento",
+    "MESSAGE_FIELD_4": "plano",
+    # O stand-in da NextFit aplica o filtro por id da busca pontual de clientes
+    "CLIENT_LOOKUP_ENABLED": "true",
+    "METRICS_PORT": "0",
+    "METRICS_FILE": "",
+    "TRACE_LOG_PATH": "",
+}
+
+
+def _peak_rss_bytes() -> int:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_child(job: str) -> Dict:
+    """Executa um job neste processo (chamado pelo subprocesso) e devolve as medições"""
+    import logging
+    logging.basicConfig(level=os.getenv("BENCHMARK_LOG_LEVEL", "WARNING"), stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import config.config as config
+    from scripts import collect_users, check_accounts, http_client, metrics
+
+    started = time.perf_counter()
+    if job == "collect":
+        ok = bool(collect_users.collect_all_users())
+        wall = time.perf_counter() - started
+        items = int(metrics.SNAPSHOT_CLIENTS.get(tenant=config.TENANT_ID))
+        measures = {"clients": items, "pages": int(metrics.PAGES_FETCHED.get(tenant=config.TENANT_ID, source="clientes"))}
+    elif job == "check":
+        result = check_accounts.check_accounts_and_birthdays()
+        wall = time.perf_counter() - started
+        ok = result is not None
+        result = result or {}
+        accounts = result.get("accounts", {})
+        items = sum(window["total"] for window in accounts.values())
+        measures = {
+            "accounts": items,
+            "with_user_info": sum(window["with_user_info"] for window in accounts.values()),
+            "birthdays": result.get("birthdays", {}).get("total", 0),
+            "messages_sent": sum(result.get("messages_sent", {}).values()),
+            "messages_failed": sum(result.get("messages_failed", {}).values()),
+            "client_lookup": result.get("client_lookup", {}),
+            "stages": {child["name"]: child["duration"] for child in result.get("trace", {}).get("children", [])},
+        }
+    else:
+        raise ValueError(f"Job desconhecido: {job}")
+
+    client_http = http_client.endpoint_stats.snapshot()
+    return {
+        "ok": ok,
+        "wall_seconds": round(wall, 3),
+        "throughput": round(items / wall, 1) if wall > 0 else 0.0,
+        "peak_rss_mb": round(_peak_rss_bytes() / (1024 * 1024), 1),
+        "retries": sum(stats["retries"] for stats in client_http.values()),
+        "throttled": sum(stats["throttled"] for stats in client_http.values()),
+        **measures,
+    }
+
+
+def run_job(scenario: Scenario, job: str, data_dir: str, nextfit: FakeNextFit, messages: FakeMessages,
+            extra_env: Dict[str, str], verbose: bool) -> Dict:
+    env = dict(os.environ)
+    env.update(BASE_ENV)
+    env.update(scenario.env)
+    env.update(extra_env)
+    env.update({
+        "DATA_DIR": data_dir,
+        "NEXTFIT_BASE_URL": nextfit.base_url,
+        "MESSAGE_API_URL": f"{messages.url}/api/contacts",
+        "PYTHONPATH": str(ROOT),
+    })
+    nextfit.reset_counters()
+    messages.reset_counters()
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--child", job],
+        cwd=str(ROOT), env=env, stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.PIPE, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not lines:
+        if proc.stderr:
+            sys.stderr.write(proc.stderr[-4000:])
+        return {"ok": False, "error": f"processo terminou com código {proc.returncode}",
+                "process_seconds": round(elapsed, 3)}
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    result["process_seconds"] = round(elapsed, 3)
+    result["requests"] = {"nextfit": nextfit.reset_counters(), "mundodosbots": messages.reset_counters()}
+    result["nextfit_requests"] = sum(result["requests"]["nextfit"].values())
+    result["message_requests"] = sum(result["requests"]["mundodosbots"].values())
+    return result
+
+
+def run_scenario(scenario: Scenario, extra_env: Dict[str, str], verbose: bool) -> Dict[str, Dict]:
+    nextfit = FakeNextFit(scenario.dataset, scenario.nextfit).start()
+    messages = FakeMessages(scenario.messages).start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{scenario.name}-") as data_dir:
+            for job in scenario.jobs:
+                results[job] = run_job(scenario, job, data_dir, nextfit, messages, extra_env, verbose)
+                if not results[job].get("ok"):
+                    break
+    finally:
+        nextfit.stop()
+        messages.stop()
+    return results
+
+
+def check_baseline(results: Dict[str, Dict[str, Dict]], baseline: Dict) -> List[str]:
+    """Compara os resultados com os limites; retorna a lista de violações"""
+    violations = []
+    for scenario_name, jobs in results.items():
+        for job, result in jobs.items():
+            prefix = f"{scenario_name}/{job}"
+            if not result.get("ok"):
+                violations.append(f"{prefix}: execução falhou ({result.get('error', 'resultado vazio')})")
+                continue
+            limits = baseline.get(scenario_name, {}).get(job, {})
+            for key, limit in limits.items():
+                metric = key[4:]
+                value = result.get(metric)
+                if value is None:
+                    continue
+                if key.startswith("max_") and value > limit:
+                    violations.append(f"{prefix}: {metric}={value} acima do limite {limit}")
+                elif key.startswith("min_") and value < limit:
+                    violations.append(f"{prefix}: {metric}={value} abaixo do limite {limit}")
+    return violations
+
+
+def build_baseline(results: Dict[str, Dict[str, Dict]], margin: float) -> Dict:
+    """Limites a partir de uma execução de referência, com folga `margin` (0.5 = 50%)"""
+    baseline = {}
+    for scenario_name, jobs in results.items():
+        for job, result in jobs.items():
+            if not result.get("ok"):
+                continue
+            request_slack = 1 + margin if result["retries"] or result["throttled"] else 1.1
+            baseline.setdefault(scenario_name, {})[job] = {
+                "max_wall_seconds": round(result["wall_seconds"] * (1 + margin), 2),
+                "max_peak_rss_mb": round(result["peak_rss_mb"] * (1 + margin), 1),
+                "min_throughput": round(result["throughput"] / (1 + margin), 1),
+                # Sem falhas injetadas a contagem de requisições é determinística: folga pequena
+                "max_nextfit_requests": math.ceil(result["nextfit_requests"] * request_slack) + 2,
+            }
+    return baseline
+
+
+def print_report(results: Dict[str, Dict[str, Dict]]):
+    header = f"{'cenário':<10} {'job':<8} {'tempo (s)':>10} {'itens/s':>10} {'RSS (MB)':>9} " \
+             f"{'req NextFit':>12} {'req msgs':>9} {'retries':>8} {'429':>6}"
+    print(header)
+    print("-" * len(header))
+    for scenario_name, jobs in results.items():
+        for job, result in jobs.items():
+            if not result.get("ok"):
+                print(f"{scenario_name:<10} {job:<8} FALHOU: {result.get('error', '')}")
+                continue
+            print(f"{scenario_name:<10} {job:<8} {result['wall_seconds']:>10.2f} {result['throughput']:>10.1f} "
+                  f"{result['peak_rss_mb']:>9.1f} {result['nextfit_requests']:>12} {result['message_requests']:>9} "
+                  f"{result['retries']:>8} {result['throttled']:>6}")
+            if result.get("stages"):
+                stages = ", ".join(f"{name}={duration:.2f}s" for name, duration in result["stages"].items())
+                print(f"{'':<20}etapas: {stages}")
+
+
+def parse_env(values: List[str]) -> Dict[str, str]:
+    env = {}
+    for value in values or []:
+        key, sep, val = value.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"--env espera CHAVE=VALOR, recebido {value!r}")
+        env[key] = val
+    return env
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline da coleta e da verificação diária")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS) + ["all"],
+                        help="Cenário a executar (pode repetir; padrão: smoke)")
+    parser.add_argument("--env", action="append", metavar="CHAVE=VALOR",
+                        help="Variável de ambiente extra para os jobs (ex: ACCOUNTS_PREFETCH_PAGES=4)")
+    parser.add_argument("--output", help="Grava os resultados completos em JSON")
+    parser.add_argument("--baseline", help="Arquivo de limites; sai com código 1 se algum for violado")
+    parser.add_argument("--write-baseline", help="Grava um arquivo de limites a partir desta execução")
+    parser.add_argument("--margin", type=float, default=1.0,
+                        help="Folga dos limites gravados com --write-baseline (padrão 1.0 = 100%%)")
+    parser.add_argument("--list", action="store_true", help="Lista os cenários disponíveis")
+    parser.add_argument("--verbose", action="store_true", help="Mostra o log dos jobs")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(run_child(args.child)), flush=True)
+        return 0
+
+    if args.list:
+        for scenario in SCENARIOS.values():
+            print(f"{scenario.name:<10} {scenario.description}")
+        return 0
+
+    names = args.scenario or ["smoke"]
+    if "all" in names:
+        names = list(SCENARIOS)
+    extra_env = parse_env(args.env)
+
+    results = {}
+    for name in names:
+        print(f"Executando cenário {name}: {SCENARIOS[name].description}", file=sys.stderr)
+        results[name] = run_scenario(SCENARIOS[name], extra_env, args.verbose)
+
+    print_report(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.write_baseline:
+        baseline_path = Path(args.write_baseline)
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+        baseline.update(build_baseline(results, args.margin))
+        baseline_path.write_text(json.dumps(baseline, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Limites gravados em {baseline_path}", file=sys.stderr)
+
+    failed = [f"{name}/{job}" for name, jobs in results.items() for job, r in jobs.items() if not r.get("ok")]
+    if args.baseline:
+        violations = check_baseline(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+        for violation in violations:
+            print(f"REGRESSÃO: {violation}", file=sys.stderr)
+        return 1 if violations else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Cenários dos benchmarks: tamanho da base, comportamento das APIs e ajustes de config
+Cada cenário roda a coleta completa e, em seguida, a verificação diária.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from benchmarks.dataset import Dataset
+from benchmarks.fake_apis import Behavior
+
+# Rate limits altos: mede o pipeline, não o limite configurado para a API real
+FAST_RATE_LIMITS = {
+    "NEXTFIT_RATE_LIMIT": "200",
+    "NEXTFIT_RATE_LIMIT_MAX": "400",
+    "NEXTFIT_RATE_BURST": "50",
+    "MESSAGE_RATE_LIMIT": "200",
+    "MESSAGE_RATE_LIMIT_MAX": "400",
+    "MESSAGE_RATE_BURST": "50",
+}
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    description: str
+    dataset: Dataset
+    nextfit: Behavior = field(default_factory=Behavior)
+    messages: Behavior = field(default_factory=Behavior)
+    env: Dict[str, str] = field(default_factory=dict)
+    jobs: Tuple[str, ...] = ("collect", "check")
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario(
+            name="smoke",
+            description="1 mil clientes, 100 contas por dia; APIs rápidas",
+            dataset=Dataset(clients=1_000, receivables_per_day=100, unknown_clients=5),
+            nextfit=Behavior(latency=0.01),
+            messages=Behavior(latency=0.01),
+            env=FAST_RATE_LIMITS,
+        ),
+        Scenario(
+            name="medium",
+            description="20 mil clientes, 1 mil contas por dia",
+            dataset=Dataset(clients=20_000, receivables_per_day=1_000, unknown_clients=50),
+            nextfit=Behavior(latency=0.02, jitter=0.02),
+            messages=Behavior(latency=0.02, jitter=0.02),
+            env=FAST_RATE_LIMITS,
+        ),
+        Scenario(
+            name="large",
+            description="500 mil clientes, 5 mil contas por dia",
+            dataset=Dataset(clients=500_000, receivables_per_day=5_000, unknown_clients=200),
+            nextfit=Behavior(latency=0.02, jitter=0.02),
+            messages=Behavior(latency=0.02, jitter=0.02),
+            env=FAST_RATE_LIMITS,
+        ),
+        Scenario(
+            name="throttled",
+            description="2 mil clientes com 5% de 429 e 2% de 503, rate limits de produção",
+            dataset=Dataset(clients=2_000, receivables_per_day=60, unknown_clients=10),
+            nextfit=Behavior(latency=0.05, throttle_rate=0.05, retry_after=0.5, error_rate=0.02),
+            messages=Behavior(latency=0.05, throttle_rate=0.05, retry_after=0.5, error_rate=0.02),
+        ),
+    )
+}
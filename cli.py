@@ -0,0 +1,275 @@
+"""
+Execução avulsa dos jobs, sem o scheduler
+Roda um único job (collect, check, send-outbox) e sai; --profile e
+--trace-memory gravam em LOG_DIR o perfil (cProfile) e as maiores alocações
+(tracemalloc) da execução, para analisar a carga real de produção.
+
+Exemplos:
+    python cli.py collect --concurrency 8
+    python cli.py check --date 2024-03-10 --dry-run
+    python cli.py check --profile --trace-memory
+    python cli.py send-outbox --date 2024-03-10
+    python cli.py backfill --start 2024-03-01 --end 2024-03-10
+    python cli.py check --tenant academia_centro --dry-run
+"""
+import os
+import sys
+import argparse
+import logging
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+
+# Adicionar o diretório raiz ao path para importar config e scripts
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from scripts import collect_users, check_accounts, outbox, metrics, backfill, tenants
+import config.config as config
+
+logger = logging.getLogger("cli")
+
+# Linhas dos relatórios de perfil e memória
+PROFILE_TOP = 40
+MEMORY_TOP = 30
+# tracemalloc: frames guardados por alocação e intervalo de amostragem do pico (segundos)
+MEMORY_FRAMES = 10
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+
+def parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida {value!r} (use AAAA-MM-DD)")
+
+
+def report_path(log_dir: Path, job: str, kind: str, suffix: str) -> Path:
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return log_dir / f"{kind}-{job}-{stamp}.{suffix}"
+
+
+@contextmanager
+def profiled(job: str, log_dir: Path, enabled: bool):
+    """
+    cProfile da execução: .prof (para snakeviz/pstats) e resumo em texto
+
+    O cProfile mede só a thread em que foi ativado; threads criadas durante o job
+    (janelas, prefetch de páginas, envios) recebem um perfil próprio, somado ao final.
+    Todos os perfis são desativados antes da soma, depois que o job (e os pools que
+    ele criou) terminou: chamadas ainda abertas são encerradas pelo disable().
+    """
+    if not enabled:
+        yield
+        return
+    profilers = [cProfile.Profile()]
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(profile_thread)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        # Nenhuma thread nova recebe perfil a partir daqui; depois disso a lista não muda
+        threading.setprofile(None)
+        with lock:
+            collected = list(profilers)
+        for profiler in collected:
+            profiler.disable()
+        stats = pstats.Stats(collected[0])
+        for profiler in collected[1:]:
+            stats.add(profiler)
+        prof_path = report_path(log_dir, job, "profile", "prof")
+        stats.dump_stats(str(prof_path))
+        txt_path = prof_path.with_suffix(".txt")
+        with open(txt_path, "w", encoding="utf-8") as f:
+            stats.stream = f
+            f.write(f"Perfil de {job}: {len(collected)} threads\n")
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+            stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+        logger.info(f"Perfil gravado em {prof_path} (resumo em {txt_path})")
+
+
+class _PeakSampler:
+    """Guarda o snapshot do tracemalloc tirado no momento de maior memória rastreada (amostragem)"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.snapshot = None
+        self.size = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tracemalloc-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        current, _ = tracemalloc.get_traced_memory()
+        # Novo snapshot só quando o uso cresce 10%: tirar um snapshot custa proporcional ao número de blocos
+        if current > self.size * 1.1:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.size = current
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+@contextmanager
+def memory_traced(job: str, log_dir: Path, enabled: bool):
+    """
+    tracemalloc da execução: pico de memória e maiores alocações por linha e por pilha,
+    no snapshot amostrado mais próximo do pico
+    """
+    if not enabled:
+        yield
+        return
+    tracemalloc.start(MEMORY_FRAMES)
+    sampler = _PeakSampler(MEMORY_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = sampler.snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        path = report_path(log_dir, job, "memory", "txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Memória rastreada: pico {peak / 1024 / 1024:.1f} MB; "
+                    f"snapshot amostrado com {sampler.size / 1024 / 1024:.1f} MB\n\n")
+            f.write(f"Maiores alocações por linha (top {MEMORY_TOP}):\n")
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP]:
+                f.write(f"{stat}\n")
+            f.write("\nMaiores alocações por pilha (top 5):\n")
+            for stat in snapshot.statistics("traceback")[:5]:
+                f.write(f"\n{stat.count} blocos, {stat.size / 1024:.1f} KiB\n")
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+        logger.info(f"Relatório de memória gravado em {path} (pico {peak / 1024 / 1024:.1f} MB)")
+
+
+def run_collect(args) -> int:
+    return 0 if collect_users.collect_all_users(prefetch=args.concurrency) else 1
+
+
+def run_check(args) -> int:
+    result = check_accounts.check_accounts_and_birthdays(
+        target_date=args.date,
+        dry_run=True if args.dry_run else None,
+        window_workers=args.concurrency,
+        send_workers=args.concurrency,
+        output_path=args.output,
+    )
+    return 0 if result is not None else 1
+
+
+def run_send_outbox(args) -> int:
+    run_date = (args.date or date.today()).isoformat()
+    if args.dry_run:
+        with outbox.Outbox() as box:
+            counts = box.counts(run_date)
+            pending = sum(1 for _ in box.pending(run_date))
+        logger.info(f"[MODO TESTE] Outbox {run_date}: {pending} mensagens seriam enviadas ({counts})")
+        return 0
+    stats = outbox.drain_outbox(run_date, max_workers=args.concurrency)
+    logger.info(f"Outbox {run_date}: {stats['sent']} enviadas, {stats['failed']} falharam")
+    return 0 if not stats["failed"] else 1
+
+
+def run_backfill(args) -> int:
+    report = backfill.backfill(args.start, args.end, workers=args.concurrency, dry_run=not args.send,
+                               output_dir=args.output_dir, tenant_id=config.TENANT_ID)
+    return 1 if report["failed"] else 0
+
+
+JOBS = {
+    "collect": ("collect_users", run_collect),
+    "check": ("check_accounts", run_check),
+    "send-outbox": ("send_outbox", run_send_outbox),
+    "backfill": ("backfill", run_backfill),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Executa um job do NextFit uma única vez")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--concurrency", type=int, metavar="N",
+                        help="Requisições simultâneas: páginas em voo (collect), janelas e envios (check, send-outbox); "
+                             "processos (backfill)")
+    common.add_argument("--tenant", metavar="ID",
+                        help="Academia de TENANTS_FILE em que o job roda (obrigatório com mais de um tenant)")
+    common.add_argument("--profile", action="store_true", help="Grava o perfil cProfile em LOG_DIR")
+    common.add_argument("--trace-memory", action="store_true", help="Grava as maiores alocações (tracemalloc) em LOG_DIR")
+    common.add_argument("-v", "--verbose", action="store_true", help="Log em nível DEBUG")
+
+    subparsers = parser.add_subparsers(dest="job", required=True)
+    subparsers.add_parser("collect", parents=[common], help="Coleta de clientes (snapshot)")
+
+    check = subparsers.add_parser("check", parents=[common], help="Verificação de contas e aniversariantes")
+    check.add_argument("--date", type=parse_date, help="Data de referência AAAA-MM-DD (padrão: hoje)")
+    check.add_argument("--dry-run", action="store_true", help="Prepara as mensagens sem enviar")
+    check.add_argument("--output", help="Arquivo de resultado (padrão: ACCOUNTS_JSON_PATH)")
+
+    send = subparsers.add_parser("send-outbox", parents=[common], help="Envia as mensagens pendentes da outbox")
+    send.add_argument("--date", type=parse_date, help="Data da outbox AAAA-MM-DD (padrão: hoje)")
+    send.add_argument("--dry-run", action="store_true", help="Apenas conta as mensagens pendentes")
+
+    replay = subparsers.add_parser("backfill", parents=[common],
+                                   help="Verificação de um intervalo de datas em paralelo (dry-run por padrão)")
+    replay.add_argument("--start", type=parse_date, required=True, help="Data inicial AAAA-MM-DD")
+    replay.add_argument("--end", type=parse_date, required=True, help="Data final AAAA-MM-DD (inclusive)")
+    replay.add_argument("--send", action="store_true",
+                        help="Envia as mensagens pela outbox de cada data (padrão: apenas prepara)")
+    replay.add_argument("--output-dir", help="Diretório dos resultados (padrão: BACKFILL_DIR)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    log_dir = Path(os.getenv("LOG_DIR", "logs"))
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+        force=True,
+    )
+
+    job_name, run = JOBS[args.job]
+    try:
+        tenant = tenants.get_tenant(args.tenant)
+    except (OSError, ValueError) as e:
+        logger.error(f"Tenant inválido: {e}")
+        return 2
+    try:
+        with tenant.activate(), \
+                metrics.track_job(job_name), \
+                memory_traced(args.job, log_dir, args.trace_memory), \
+                profiled(args.job, log_dir, args.profile):
+            return run(args)
+    except Exception as e:
+        logger.error(f"Falha na execução de {args.job}: {e}", exc_info=True)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,11 @@
 Configurações da aplicação NextFit API
 """
 import os
+import sys
+import socket
+import types
+import contextvars
+from contextlib import contextmanager
 from pathlib import Path
 
 # Carregar variáveis do arquivo .env se existir
@@ -17,18 +22,52 @@ except ImportError:
 
 # API Configuration
 API_KEY = os.getenv("NEXTFIT_API_KEY", "N5dTS6i7mSu9pQ4PUeN_zuvIDiT4qmGv")
-BASE_URL = "https://integracao.nextfit.com.br/api/v1"
+BASE_URL = os.getenv("NEXTFIT_BASE_URL", "https://integracao.nextfit.com.br/api/v1")
 API_VERSION = "1"
 
 # Endpoints
 ENDPOINT_CLIENTES = f"/Pessoa/GetClientes"
 ENDPOINT_CONTAS_RECEBER = f"/ContaReceber"
+# Busca pontual de um cliente (clientes novos que ainda não estão no snapshot semanal)
+ENDPOINT_CLIENTE = os.getenv("NEXTFIT_ENDPOINT_CLIENTE", ENDPOINT_CLIENTES)
+CLIENTE_ID_PARAM = os.getenv("NEXTFIT_CLIENTE_ID_PARAM", "Id")
 
 # Pagination
 ITEMS_PER_PAGE = 30
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # segundos
-REQUEST_DELAY = 1.0  # segundos de espera entre requisições para não sobrecarregar a API
+
+# Coleta de clientes: número de páginas buscadas em paralelo (prefetch)
+COLLECT_PREFETCH_PAGES = int(os.getenv("COLLECT_PREFETCH_PAGES", "4"))
+
+# Contas a receber: janelas de vencimento buscadas em paralelo e páginas em voo por janela
+ACCOUNTS_WINDOW_WORKERS = int(os.getenv("ACCOUNTS_WINDOW_WORKERS", "5"))
+ACCOUNTS_PREFETCH_PAGES = int(os.getenv("ACCOUNTS_PREFETCH_PAGES", "2"))
+
+# Rate limit por provedor (token bucket com ajuste AIMD, compartilhado por todos os workers)
+# rate: taxa inicial (req/s), max_rate: teto atingido aos poucos sem 429,
+# min_rate: piso após reduções por 429, burst: requisições permitidas em rajada
+RATE_LIMITS = {
+    "nextfit": {
+        "rate": float(os.getenv("NEXTFIT_RATE_LIMIT", "2")),
+        "max_rate": float(os.getenv("NEXTFIT_RATE_LIMIT_MAX", "10")),
+        "min_rate": float(os.getenv("NEXTFIT_RATE_LIMIT_MIN", "0.2")),
+        "burst": int(os.getenv("NEXTFIT_RATE_BURST", "5")),
+    },
+    "mundodosbots": {
+        "rate": float(os.getenv("MESSAGE_RATE_LIMIT", "5")),
+        "max_rate": float(os.getenv("MESSAGE_RATE_LIMIT_MAX", "20")),
+        "min_rate": float(os.getenv("MESSAGE_RATE_LIMIT_MIN", "0.5")),
+        "burst": int(os.getenv("MESSAGE_RATE_BURST", "10")),
+    },
+}
+
+# Transporte HTTP (scripts/http_client.py): timeouts separados de conexão e leitura (segundos)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Orçamento global de retries: cada requisição libera RATIO retries, acumulando no máximo MAX
+HTTP_RETRY_BUDGET_RATIO = float(os.getenv("HTTP_RETRY_BUDGET_RATIO", "0.2"))
+HTTP_RETRY_BUDGET_MAX = float(os.getenv("HTTP_RETRY_BUDGET_MAX", "20"))
 
 # File paths
 # Se rodando localmente (fora do Docker), usar ./data
@@ -39,8 +78,104 @@ else:
     DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")  # Local
 
 DATA_DIR = os.getenv("DATA_DIR", DEFAULT_DATA_DIR)
-USERS_JSON_PATH = os.path.join(DATA_DIR, "users.json")
-ACCOUNTS_JSON_PATH = os.path.join(DATA_DIR, "accounts_today.json")
+
+
+def data_paths(data_dir: str) -> dict:
+    """Arquivos de dados dentro de um DATA_DIR (o de cada tenant usa o mesmo layout)"""
+    return {
+        "DATA_DIR": data_dir,
+        "USERS_JSON_PATH": os.path.join(data_dir, "users.json"),
+        "USERS_DB_PATH": os.path.join(data_dir, "clients.db"),
+        "USERS_BIN_PATH": os.path.join(data_dir, "users.bin"),
+        "COLLECT_CHECKPOINT_PATH": os.path.join(data_dir, "collect_checkpoint.json"),
+        "ACCOUNTS_JSON_PATH": os.path.join(data_dir, "accounts_today.json"),
+        "CLIENT_CACHE_PATH": os.path.join(data_dir, "client_cache.json"),
+        "OUTBOX_DB_PATH": os.path.join(data_dir, "outbox.db"),
+        "BACKFILL_DIR": os.path.join(data_dir, "backfill"),
+    }
+
+
+_paths = data_paths(DATA_DIR)
+USERS_JSON_PATH = _paths["USERS_JSON_PATH"]
+USERS_DB_PATH = _paths["USERS_DB_PATH"]
+USERS_BIN_PATH = _paths["USERS_BIN_PATH"]
+COLLECT_CHECKPOINT_PATH = _paths["COLLECT_CHECKPOINT_PATH"]
+ACCOUNTS_JSON_PATH = _paths["ACCOUNTS_JSON_PATH"]
+CLIENT_CACHE_PATH = _paths["CLIENT_CACHE_PATH"]
+OUTBOX_DB_PATH = _paths["OUTBOX_DB_PATH"]
+BACKFILL_DIR = _paths["BACKFILL_DIR"]
+
+# Modo da coleta de clientes: "incremental" (grava apenas novos/alterados/removidos) ou "full" (recria tudo)
+COLLECT_MODE = os.getenv("COLLECT_MODE", "incremental").lower()
+# Checkpoint da coleta: uma coleta interrompida é retomada do último Skip confirmado
+COLLECT_CHECKPOINT_MAX_AGE_HOURS = float(os.getenv("COLLECT_CHECKPOINT_MAX_AGE_HOURS", "48"))
+# Agendamento da coleta (com o modo incremental é barato rodar mais de uma vez por semana, ex: "mon-sun")
+COLLECT_USERS_DAY_OF_WEEK = os.getenv("COLLECT_USERS_DAY_OF_WEEK", "sun")
+COLLECT_USERS_HOUR = int(os.getenv("COLLECT_USERS_HOUR", "2"))
+
+# Ao iniciar o scheduler, a coleta só roda (em segundo plano) se o snapshot tiver mais que este
+# número de horas, estiver vazio ou com coleta interrompida; 0 coleta a cada início
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("SNAPSHOT_MAX_AGE_HOURS", "24"))
+
+# Fonte de clientes da verificação diária: "sqlite" (clients.db) ou "binary" (users.bin via mmap)
+USERS_BACKEND = os.getenv("USERS_BACKEND", "sqlite").lower()
+# Gravar o snapshot binário ao final de cada coleta (obrigatório com USERS_BACKEND=binary)
+WRITE_BINARY_SNAPSHOT = os.getenv("WRITE_BINARY_SNAPSHOT", "true" if USERS_BACKEND == "binary" else "false").lower() in ("true", "1", "yes")
+
+# Clientes ausentes do snapshot: busca sob demanda na NextFit com cache LRU persistido entre execuções.
+# Desativada por padrão: o filtro por id em ENDPOINT_CLIENTE (CLIENTE_ID_PARAM) não consta da documentação
+# da NextFit; ative depois de confirmar que a API o aplica
+CLIENT_LOOKUP_ENABLED = os.getenv("CLIENT_LOOKUP_ENABLED", "false").lower() in ("true", "1", "yes")
+CLIENT_LOOKUP_MAX_PER_RUN = int(os.getenv("CLIENT_LOOKUP_MAX_PER_RUN", "200"))
+# Respostas seguidas com outro cliente (filtro por id ignorado pela API) que encerram a busca na execução
+CLIENT_LOOKUP_MAX_MISMATCHES = int(os.getenv("CLIENT_LOOKUP_MAX_MISMATCHES", "3"))
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "5000"))
+CLIENT_CACHE_TTL_HOURS = float(os.getenv("CLIENT_CACHE_TTL_HOURS", "168"))
+
+# Exportar também o users.json (formato antigo) ao final de cada coleta
+EXPORT_USERS_JSON = os.getenv("EXPORT_USERS_JSON", "true").lower() in ("true", "1", "yes")
+
+# Aniversários em 29/02 em anos não bissextos: "feb28" (comemora em 28/02), "mar1" (em 01/03) ou "skip"
+BIRTHDAY_FEB29_POLICY = os.getenv("BIRTHDAY_FEB29_POLICY", "feb28").lower()
+
+# Métricas no formato Prometheus: porta do endpoint /metrics (0 desativa) e/ou arquivo gravado ao final de cada job
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+
+# Spans de tempo por etapa da verificação diária: sempre em accounts_today.json ("trace");
+# TRACE_LOG_PATH acrescenta uma linha JSON por execução (vazio desativa)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+
+# Backfill (cli.py backfill): processos simultâneos, uma data por processo; o rate limit é dividido entre eles
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Multi-tenant (scripts/tenants.py): arquivo com as academias atendidas por este processo.
+# Vazio: uma única academia configurada pelas variáveis de ambiente (TENANT_ID identifica nas métricas)
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+TENANT_ID = os.getenv("TENANT_ID", "default")
+# Threads do scheduler compartilhadas por todos os jobs (jobs de academias diferentes rodam em paralelo)
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "10"))
+# Job cujo tenant já está no limite de jobs simultâneos é reagendado para daqui a este tempo (segundos)
+JOB_SLOT_RETRY_SECONDS = int(os.getenv("JOB_SLOT_RETRY_SECONDS", "60"))
+
+# Várias réplicas (scripts/leases.py): cada execução de job tem um lease em LEASES_DB_PATH, no volume
+# compartilhado (fora do DATA_DIR de cada tenant). Só o dono do lease executa; as demais réplicas aguardam
+# e assumem se o dono parar de renovar (queda do nó). O volume precisa suportar locks de arquivo do SQLite.
+LEASES_ENABLED = os.getenv("LEASES_ENABLED", "false").lower() in ("true", "1", "yes")
+LEASES_DB_PATH = os.getenv("LEASES_DB_PATH", os.path.join(DATA_DIR, "leases.db"))
+REPLICA_ID = os.getenv("REPLICA_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Lease renovado a cada TTL/3 enquanto o job roda; réplicas em espera verificam a cada POLL segundos
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "60"))
+LEASE_POLL_SECONDS = float(os.getenv("LEASE_POLL_SECONDS", "10"))
+# Réplica viva: heartbeat nos últimos REPLICA_TTL_SECONDS
+REPLICA_TTL_SECONDS = float(os.getenv("REPLICA_TTL_SECONDS", "60"))
+# Divide o envio entre as réplicas vivas pelo hash do telefone normalizado (requer LEASES_ENABLED)
+SEND_SHARDING = os.getenv("SEND_SHARDING", "false").lower() in ("true", "1", "yes")
+# Reserva de uma mensagem da outbox por uma réplica (expira se ela cair antes de registrar o envio)
+OUTBOX_CLAIM_SECONDS = float(os.getenv("OUTBOX_CLAIM_SECONDS", "300"))
+# Varredura periódica da outbox do dia: cada réplica envia o que ficou pendente no seu shard (0 desativa)
+OUTBOX_SWEEP_MINUTES = int(os.getenv("OUTBOX_SWEEP_MINUTES", "15"))
 
 # Headers
 API_HEADERS = {
@@ -52,6 +187,35 @@ API_HEADERS = {
 MESSAGE_API_URL = os.getenv("MESSAGE_API_URL", "https://app.mundodosbots.com.br/api/contacts")
 MESSAGE_API_TOKEN = os.getenv("MESSAGE_API_TOKEN", "")
 
+# Envio concorrente de mensagens
+# Número de workers enviando em paralelo e tamanho do pool de conexões HTTP reutilizadas
+MESSAGE_MAX_WORKERS = int(os.getenv("MESSAGE_MAX_WORKERS", "8"))
+MESSAGE_POOL_SIZE = int(os.getenv("MESSAGE_POOL_SIZE", str(MESSAGE_MAX_WORKERS)))
+# Tamanho da fila entre a preparação e o envio (backpressure do pipeline diário)
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "100"))
+
+# Outbox (outbox.db): tentativas por mensagem antes de desistir e dias de histórico mantidos
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "3"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+# Sessão HTTP de cada provedor: conexões mantidas no pool, retries do transporte (5xx/conexão)
+# com backoff e métodos que podem ser repetidos
+HTTP_PROVIDERS = {
+    "nextfit": {
+        # Páginas em voo: janelas x prefetch na verificação, prefetch na coleta
+        "pool_size": int(os.getenv("NEXTFIT_POOL_SIZE", str(max(10, ACCOUNTS_WINDOW_WORKERS * ACCOUNTS_PREFETCH_PAGES, COLLECT_PREFETCH_PAGES)))),
+        "retries": MAX_RETRIES,
+        "backoff": RETRY_DELAY,
+        "methods": ["GET"],
+    },
+    "mundodosbots": {
+        "pool_size": MESSAGE_POOL_SIZE,
+        "retries": 3,
+        "backoff": 1,
+        "methods": ["POST"],
+    },
+}
+
 # Configurações de campos e flow_ids (serão configurados depois)
 # Mapeamento: qual campo da NextFit vai para qual campo da API de mensagens
 MESSAGE_FIELD_MAPPINGS = {
@@ -78,6 +242,21 @@ MESSAGE_CUSTOM_FIELDS = {
     "campo5": os.getenv("MESSAGE_FIELD_5", ""),  # Data de vencimento (apenas data, sem hora)
 }
 
+# Agrupamento: mensagens do mesmo telefone e tipo viram um único envio
+# Regra de cada campo ao combinar: first, last, sum, join, min ou max
+MESSAGE_COALESCE_ENABLED = os.getenv("MESSAGE_COALESCE_ENABLED", "true").lower() in ("true", "1", "yes")
+MESSAGE_COALESCE_SEPARATOR = os.getenv("MESSAGE_COALESCE_SEPARATOR", ", ")
+# Mensagens retidas no agrupamento de uma janela: acima disso os grupos mais antigos seguem para o envio
+# (memória limitada e backpressure da fila de envio; uma conta posterior do mesmo telefone vira outro envio)
+MESSAGE_COALESCE_MAX_PENDING = int(os.getenv("MESSAGE_COALESCE_MAX_PENDING", "500"))
+MESSAGE_COALESCE_RULES = {
+    "campo1": os.getenv("MESSAGE_COALESCE_CAMPO1", "first"),  # Nome
+    "campo2": os.getenv("MESSAGE_COALESCE_CAMPO2", "sum"),    # Valor
+    "campo3": os.getenv("MESSAGE_COALESCE_CAMPO3", "min"),    # Vencimento
+    "campo4": os.getenv("MESSAGE_COALESCE_CAMPO4", "join"),   # Plano
+    "campo5": os.getenv("MESSAGE_COALESCE_CAMPO5", "min"),    # Data de vencimento
+}
+
 # Controle de envio de mensagens (para testes)
 # Se False, o sistema coleta dados mas não envia mensagens
 SEND_MESSAGES = os.getenv("SEND_MESSAGES", "true").lower() in ("true", "1", "yes")
@@ -89,3 +268,52 @@ VALID_ACCOUNT_STATUSES = [
     "EmAndamento"
 ]
 # Status que NÃO devem receber mensagens: "Recebido", "Cancelado"
+
+
+# Sobreposição por tenant: dentro de overrides(...), config.X devolve o valor do tenant
+# em vez do global. Só as configurações que algum tenant sobrepõe passam pela consulta ao
+# contexto (_overridable); as demais são lidas direto do módulo. O valor vale para o
+# contexto corrente (thread ou tarefa): threads de trabalho criadas durante um job precisam
+# herdar o contexto via tracing.propagate (pool de páginas, janelas e workers de envio já
+# fazem isso); uma thread criada sem ele lê os valores globais.
+_overrides: contextvars.ContextVar = contextvars.ContextVar("config_overrides", default=None)
+_overridable: set = set()
+
+
+class _ConfigModule(types.ModuleType):
+    def __getattribute__(self, name):
+        if name in _overridable:
+            values = _overrides.get()
+            if values is not None and name in values:
+                return values[name]
+        return super().__getattribute__(name)
+
+
+sys.modules[__name__].__class__ = _ConfigModule
+
+
+def push_overrides(values: dict) -> contextvars.Token:
+    """Ativa os valores no contexto corrente até pop_overrides(token)"""
+    unknown = [name for name in values if not name.isupper() or name not in globals()]
+    if unknown:
+        raise ValueError(f"Configurações desconhecidas não podem ser sobrepostas: {sorted(unknown)}")
+    _overridable.update(values)
+    return _overrides.set(values)
+
+
+def pop_overrides(token: contextvars.Token):
+    _overrides.reset(token)
+
+
+def active_overrides() -> dict:
+    """Valores sobrepostos no contexto corrente (vazio fora de overrides(...))"""
+    return dict(_overrides.get() or {})
+
+
+@contextmanager
+def overrides(values: dict):
+    token = push_overrides(values)
+    try:
+        yield
+    finally:
+        pop_overrides(token)
@@ -3,11 +3,23 @@ Script principal que gerencia os agendamentos dos jobs
 Usa APScheduler para executar:
 - Coleta de usuários: Todo domingo às 2h da manhã
 - Verificação de contas: Todo dia às 9h da manhã
+
+Ao iniciar, o scheduler sobe imediatamente: a coleta inicial é dispensada se o
+snapshot de clientes estiver fresco e, caso contrário, roda em segundo plano.
+
+Com TENANTS_FILE, os jobs de todas as academias são agendados neste processo e
+executados em um pool de threads compartilhado (SCHEDULER_MAX_WORKERS): jobs de
+academias diferentes no mesmo horário rodam em paralelo.
+
+Com LEASES_ENABLED, várias réplicas podem rodar ao mesmo tempo: cada execução
+de job é feita por uma só (scripts/leases.py) e, com SEND_SHARDING, o envio é
+dividido entre as réplicas vivas.
 """
 import os
 import sys
 import logging
 import signal
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 # Garantir que está rodando em venv (antes de importar outras dependências)
@@ -24,15 +36,18 @@ except Exception as e:
     # Se falhar, continuar mesmo assim (pode estar no Docker ou venv já ativo)
     pass
 
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import pytz
 
 # Adicionar scripts ao path
 sys.path.insert(0, os.path.dirname(__file__))
 
 # Importar scripts
-from scripts import collect_users, check_accounts
+from scripts import collect_users, check_accounts, outbox, metrics, tenants, leases
+import config.config as config
 
 # Garantir que diretórios existem
 log_dir = os.getenv('LOG_DIR', 'logs')
@@ -54,32 +69,217 @@ logger = logging.getLogger(__name__)
 # Timezone de Brasília
 TZ_BRASILIA = pytz.timezone('America/Sao_Paulo')
 
-# Criar scheduler
-scheduler = BlockingScheduler(timezone=TZ_BRASILIA)
+# Padrões dos jobs: no pool compartilhado, um job pode ficar na fila mais que o 1s de tolerância
+# padrão do APScheduler (ex: mais academias às 9h do que threads) e seria descartado como perdido;
+# sem limite de atraso ele roda assim que houver thread livre, e execuções acumuladas viram uma só
+JOB_DEFAULTS = {"misfire_grace_time": None, "coalesce": True}
+
+
+def create_scheduler(scheduler_class=BlockingScheduler, max_workers: int = None):
+    """Scheduler com o pool de threads compartilhado pelos jobs de todos os tenants"""
+    return scheduler_class(timezone=TZ_BRASILIA, job_defaults=JOB_DEFAULTS,
+                           executors={"default": ThreadPoolExecutor(max_workers or config.SCHEDULER_MAX_WORKERS)})
 
 
-def job_collect_users():
+scheduler = create_scheduler()
+
+
+def defer(func, tenant: tenants.Tenant, job: str, *args):
+    """
+    Slot do tenant ocupado: registra a execução como ignorada e reagenda o job para
+    daqui a JOB_SLOT_RETRY_SECONDS, sem prender uma thread do pool esperando o slot
+    """
+    retry_in = config.JOB_SLOT_RETRY_SECONDS
+    logger.info(f"[{tenant.id}] {job}: limite de jobs simultâneos do tenant ocupado; nova tentativa em {retry_in}s")
+    with metrics.track_job(job) as run:
+        run.skip()
+    scheduler.add_job(
+        func,
+        args=[tenant, *args],
+        id=tenant.job_id(f'{job}_retry'),
+        name=f'[{tenant.id}] {job} (nova tentativa)',
+        next_run_time=datetime.now(TZ_BRASILIA) + timedelta(seconds=retry_in),
+        replace_existing=True
+    )
+
+
+def job_collect_users(tenant: tenants.Tenant):
     """Job para coletar usuários todo domingo às 2h"""
-    logger.info("=" * 60)
-    logger.info("INICIANDO JOB: Coleta de usuários (Domingo 2h)")
-    logger.info("=" * 60)
-    try:
-        collect_users.collect_all_users()
-        logger.info("Job de coleta de usuários concluído com sucesso")
-    except Exception as e:
-        logger.error(f"Erro no job de coleta de usuários: {e}", exc_info=True)
+    with tenant.activate(), tenant.job_slot(tenants.SLOT_COLLECT) as acquired:
+        if not acquired:
+            defer(job_collect_users, tenant, "collect_users")
+            return
+        logger.info("=" * 60)
+        logger.info(f"[{tenant.id}] INICIANDO JOB: Coleta de usuários (Domingo 2h)")
+        logger.info("=" * 60)
+        try:
+            with metrics.track_job("collect_users") as run:
+                ran, _ = leases.run_once("collect_users", collect_users.collect_all_users)
+                if not ran:
+                    run.skip()
+            if ran:
+                logger.info(f"[{tenant.id}] Job de coleta de usuários concluído com sucesso")
+        except Exception as e:
+            logger.error(f"[{tenant.id}] Erro no job de coleta de usuários: {e}", exc_info=True)
 
 
-def job_check_accounts():
+def job_check_accounts(tenant: tenants.Tenant):
     """Job para verificar contas e aniversariantes todo dia às 9h"""
+    with tenant.activate(), tenant.job_slot(tenants.SLOT_SEND) as acquired:
+        if not acquired:
+            defer(job_check_accounts, tenant, "check_accounts")
+            return
+        logger.info("=" * 60)
+        logger.info(f"[{tenant.id}] INICIANDO JOB: Verificação de contas e aniversariantes (9h)")
+        logger.info("=" * 60)
+        try:
+            with metrics.track_job("check_accounts") as run:
+                # Réplicas em espera enviam o seu shard do que o dono do job já registrou na outbox
+                ran, _ = leases.run_once("check_accounts", check_accounts.check_accounts_and_birthdays,
+                                         on_standby=drain_shard)
+                if not ran:
+                    run.skip()
+            if ran:
+                logger.info(f"[{tenant.id}] Job de verificação de contas concluído com sucesso")
+        except Exception as e:
+            logger.error(f"[{tenant.id}] Erro no job de verificação de contas: {e}", exc_info=True)
+
+
+def drain_shard():
+    """Envia o shard desta réplica das mensagens pendentes de hoje (apenas com SEND_SHARDING)"""
+    if config.SEND_MESSAGES and leases.send_shard() is not None:
+        outbox.drain_outbox()
+
+
+def job_sweep_outbox(tenant: tenants.Tenant):
+    """Reenvia pendências de hoje do shard desta réplica (ex: shard de uma réplica que caiu)"""
+    with tenant.activate():
+        try:
+            if config.SEND_MESSAGES:
+                outbox.drain_outbox()
+        except Exception as e:
+            logger.error(f"[{tenant.id}] Erro na varredura da outbox: {e}", exc_info=True)
+
+
+def job_startup(tenant: tenants.Tenant, collect: bool, exclusive: bool):
+    """
+    Trabalho de início de um tenant, executado em segundo plano no pool do scheduler:
+    reenvio da outbox e, se o snapshot não estiver fresco, a coleta inicial
+
+    O reenvio ocupa o slot de envio do tenant, para não correr junto com a verificação
+    das 9h sobre as mesmas linhas da outbox; com o slot ocupado, o trabalho de início
+    é reagendado. A coleta ocupa o slot de coleta; exclusive: ela também segura o de
+    envio (snapshot vazio: a verificação é reagendada até a coleta terminar; com um
+    snapshot existente ela roda em paralelo, lendo a última geração completa)
+    """
+    slots = (tenants.SLOT_SEND, tenants.SLOT_COLLECT) if collect and exclusive else (tenants.SLOT_SEND,)
+    with tenant.activate(), tenant.job_slot(*slots) as acquired:
+        if not acquired:
+            defer(job_startup, tenant, "startup", collect, exclusive)
+            return
+        # Retomar envios interrompidos (ex: queda no meio do job das 9h): apenas o que ficou pendente hoje
+        if config.SEND_MESSAGES:
+            try:
+                outbox.drain_outbox()
+            except Exception as e:
+                logger.error(f"[{tenant.id}] ✗ Erro ao reenviar mensagens pendentes da outbox: {e}", exc_info=True)
+        if collect and exclusive:
+            startup_collect(tenant)
+
+    if collect and not exclusive:
+        with tenant.activate(), tenant.job_slot(tenants.SLOT_COLLECT) as acquired:
+            if acquired:
+                startup_collect(tenant)
+            else:
+                logger.info(f"[{tenant.id}] Coleta inicial dispensada: já há uma coleta em execução")
+
+
+def startup_collect(tenant: tenants.Tenant):
+    """Coleta inicial de usuários (no contexto do tenant)"""
     logger.info("=" * 60)
-    logger.info("INICIANDO JOB: Verificação de contas e aniversariantes (9h)")
+    logger.info(f"[{tenant.id}] EXECUTANDO COLETA INICIAL DE USUÁRIOS")
     logger.info("=" * 60)
     try:
-        check_accounts.check_accounts_and_birthdays()
-        logger.info("Job de verificação de contas concluído com sucesso")
+        with metrics.track_job("collect_users") as run:
+            # Réplicas iniciadas no mesmo dia não repetem a coleta de quem já fez
+            ran, _ = leases.run_once("collect_users", collect_users.collect_all_users,
+                                     run_key=f"startup-{date.today().isoformat()}", wait=False)
+            if not ran:
+                run.skip()
+        if ran:
+            logger.info(f"[{tenant.id}] ✓ Coleta inicial de usuários concluída com sucesso")
     except Exception as e:
-        logger.error(f"Erro no job de verificação de contas: {e}", exc_info=True)
+        logger.error(f"[{tenant.id}] ✗ Erro na coleta inicial de usuários: {e}", exc_info=True)
+
+
+def schedule_startup(tenant: tenants.Tenant):
+    """Verifica o snapshot existente e agenda o trabalho de início do tenant para rodar já, sem bloquear"""
+    with tenant.activate():
+        try:
+            status = collect_users.snapshot_freshness()
+        except Exception as e:
+            logger.error(f"[{tenant.id}] Erro ao verificar o snapshot de clientes: {e}", exc_info=True)
+            status = {"fresh": False, "reason": f"erro ao verificar snapshot: {e}", "clients": 0}
+        send_messages = config.SEND_MESSAGES
+
+    if status["fresh"]:
+        logger.info(f"[{tenant.id}] Snapshot com {status['clients']} clientes ({status['reason']}): "
+                    f"coleta inicial dispensada")
+        if not send_messages:
+            return
+    else:
+        logger.info(f"[{tenant.id}] Coleta inicial agendada em segundo plano: {status['reason']}")
+
+    scheduler.add_job(
+        job_startup,
+        args=[tenant, not status["fresh"], not status["clients"]],
+        id=tenant.job_id('startup'),
+        name=f'[{tenant.id}] Início (outbox{"" if status["fresh"] else " e coleta inicial"})',
+        # Roda assim que o scheduler subir, mesmo que ele demore a iniciar (JOB_DEFAULTS)
+        next_run_time=datetime.now(TZ_BRASILIA),
+        replace_existing=True
+    )
+
+
+def schedule_tenant(tenant: tenants.Tenant):
+    """Agenda os jobs de um tenant (horários da configuração do tenant)"""
+    with tenant.activate():
+        collect_day = config.COLLECT_USERS_DAY_OF_WEEK
+        collect_hour = config.COLLECT_USERS_HOUR
+
+    # Agendar job de coleta de usuários: Todo domingo às 2h da manhã (configurável)
+    scheduler.add_job(
+        job_collect_users,
+        trigger=CronTrigger(day_of_week=collect_day, hour=collect_hour, minute=0, timezone=TZ_BRASILIA),
+        args=[tenant],
+        id=tenant.job_id('collect_users'),
+        name=f'[{tenant.id}] Coleta de usuários ({collect_day} {collect_hour}h)',
+        replace_existing=True
+    )
+    logger.info(f"[{tenant.id}] Job agendado: Coleta de usuários - {collect_day} às {collect_hour}:00")
+
+    # Agendar job de verificação de contas: Todo dia às 9h da manhã
+    scheduler.add_job(
+        job_check_accounts,
+        trigger=CronTrigger(hour=9, minute=0, timezone=TZ_BRASILIA),
+        args=[tenant],
+        id=tenant.job_id('check_accounts'),
+        name=f'[{tenant.id}] Verificação de contas e aniversariantes (9h)',
+        replace_existing=True
+    )
+    logger.info(f"[{tenant.id}] Job agendado: Verificação de contas - Todo dia às 9:00")
+
+    # Varredura da outbox entre réplicas: o shard de uma réplica que caiu é assumido pelas demais
+    if config.LEASES_ENABLED and config.OUTBOX_SWEEP_MINUTES > 0:
+        scheduler.add_job(
+            job_sweep_outbox,
+            trigger=IntervalTrigger(minutes=config.OUTBOX_SWEEP_MINUTES, timezone=TZ_BRASILIA),
+            args=[tenant],
+            id=tenant.job_id('sweep_outbox'),
+            name=f'[{tenant.id}] Varredura da outbox ({config.OUTBOX_SWEEP_MINUTES} min)',
+            replace_existing=True
+        )
+        logger.info(f"[{tenant.id}] Job agendado: Varredura da outbox - a cada {config.OUTBOX_SWEEP_MINUTES} min")
 
 
 def setup_signal_handlers():
@@ -101,36 +301,20 @@ def main():
     # Configurar handlers de sinal
     setup_signal_handlers()
     
-    # Executar coleta de usuários UMA VEZ ao iniciar (não esperar domingo)
-    logger.info("=" * 60)
-    logger.info("EXECUTANDO COLETA INICIAL DE USUÁRIOS")
-    logger.info("=" * 60)
-    try:
-        collect_users.collect_all_users()
-        logger.info("✓ Coleta inicial de usuários concluída com sucesso")
-    except Exception as e:
-        logger.error(f"✗ Erro na coleta inicial de usuários: {e}", exc_info=True)
-        logger.warning("Continuando com scheduler mesmo com erro na coleta inicial...")
+    # Endpoint /metrics (Prometheus), se METRICS_PORT estiver configurado
+    metrics.start_server()
     
-    # Agendar job de coleta de usuários: Todo domingo às 2h da manhã
-    scheduler.add_job(
-        job_collect_users,
-        trigger=CronTrigger(day_of_week='sun', hour=2, minute=0, timezone=TZ_BRASILIA),
-        id='collect_users',
-        name='Coleta de usuários (Domingo 2h)',
-        replace_existing=True
-    )
-    logger.info("Job agendado: Coleta de usuários - Todo domingo às 2:00")
+    # Registro desta réplica (heartbeat) para leases e shards de envio, se LEASES_ENABLED
+    leases.start_heartbeat()
     
-    # Agendar job de verificação de contas: Todo dia às 9h da manhã
-    scheduler.add_job(
-        job_check_accounts,
-        trigger=CronTrigger(hour=9, minute=0, timezone=TZ_BRASILIA),
-        id='check_accounts',
-        name='Verificação de contas e aniversariantes (9h)',
-        replace_existing=True
-    )
-    logger.info("Job agendado: Verificação de contas - Todo dia às 9:00")
+    # Academias atendidas por este processo (TENANTS_FILE ou a configuração global)
+    tenant_list = tenants.load_tenants()
+
+    # Jobs de cada tenant; a coleta inicial só roda se o snapshot não estiver fresco
+    # (SNAPSHOT_MAX_AGE_HOURS), em segundo plano no pool do scheduler
+    for tenant in tenant_list:
+        schedule_tenant(tenant)
+        schedule_startup(tenant)
     
     # Listar jobs agendados
     logger.info("\nJobs agendados:")
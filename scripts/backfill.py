@@ -0,0 +1,163 @@
+"""
+Backfill / replay da verificação diária em um intervalo de datas
+Cada data roda check_accounts_and_birthdays em um processo do pool (uma data por
+worker), lendo o mesmo snapshot de clientes (somente leitura, geração fixada em
+cada worker) e gravando um resultado por data em BACKFILL_DIR. Por padrão é
+dry-run: as mensagens são preparadas e contadas, mas não enviadas.
+
+O cache de clientes é lido por todos os workers e gravado por nenhum (vários
+processos reescrevendo o mesmo arquivo perderiam entradas uns dos outros). Em
+dry-run os workers também não buscam na NextFit clientes fora do snapshot e do
+cache: as contas deles aparecem sem cliente associado no resultado.
+
+Usado para auditar o que deveria ter sido enviado durante uma indisponibilidade
+e para exercitar a associação/preparação com volume.
+"""
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.snapshots import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def date_range(start: date, end: date) -> List[date]:
+    """Datas de start a end, inclusive"""
+    if end < start:
+        raise ValueError(f"Data final {end} anterior à inicial {start}")
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def result_path(target_date: date, output_dir: Optional[str] = None) -> str:
+    return os.path.join(output_dir or config.BACKFILL_DIR, f"accounts_{target_date.isoformat()}.json")
+
+
+def _init_worker(workers: int, log_level: int, tenant_id: Optional[str]):
+    """
+    Inicialização de cada processo do pool
+    O processo roda com a configuração do tenant (um processo spawn não herda o
+    contexto de quem chamou o backfill) até o fim. O rate limit é por processo:
+    a taxa configurada é dividida entre os workers para que o backfill inteiro
+    respeite o mesmo limite da API que um job normal.
+    """
+    from scripts import tenants
+
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s',
+                        force=True)
+    config.push_overrides(tenants.get_tenant(tenant_id).overrides)
+    for settings in config.RATE_LIMITS.values():
+        for key in ("rate", "max_rate", "min_rate"):
+            settings[key] = settings[key] / workers
+        settings["burst"] = max(1, settings["burst"] // workers)
+
+
+def _run_date(target_date: date, dry_run: bool, output_path: str) -> Dict:
+    """Executa a verificação de uma data (no processo do pool) e devolve o resumo"""
+    from scripts import check_accounts
+
+    started = time.perf_counter()
+    result = check_accounts.check_accounts_and_birthdays(
+        target_date=target_date,
+        dry_run=dry_run,
+        output_path=output_path,
+        fetch_missing_clients=False if dry_run else None,
+        read_only_cache=True,
+        # A retenção da outbox fica com o job diário: purgar aqui apagaria as datas antigas já enviadas
+        purge_outbox=False,
+    )
+    summary = {
+        "date": target_date.isoformat(),
+        "ok": result is not None,
+        "duration": round(time.perf_counter() - started, 3),
+        "output": output_path,
+    }
+    if result is not None:
+        summary.update({
+            "users_generation": result["users_generation"],
+            "accounts": sum(window["total"] for window in result["accounts"].values()),
+            "with_user_info": sum(window["with_user_info"] for window in result["accounts"].values()),
+            "birthdays": result["birthdays"]["total"],
+            "messages": dict(result["messages_sent"]),
+        })
+        if "messages_failed" in result:
+            summary["messages_failed"] = dict(result["messages_failed"])
+    return summary
+
+
+def backfill(start: date, end: date, workers: Optional[int] = None, dry_run: bool = True,
+             output_dir: Optional[str] = None, tenant_id: Optional[str] = None) -> Dict:
+    """
+    Executa a verificação para cada data do intervalo em um pool de processos
+
+    Args:
+        start, end: Intervalo de datas (inclusive)
+        workers: Processos simultâneos (padrão: config.BACKFILL_WORKERS)
+        dry_run: Apenas prepara as mensagens (padrão); com False, envia pela outbox da data
+        output_dir: Diretório dos resultados (padrão: config.BACKFILL_DIR)
+        tenant_id: Tenant em que os workers rodam (padrão: config.TENANT_ID, o tenant ativo)
+
+    Returns:
+        Resumo com o resultado de cada data, gravado também em <output_dir>/backfill_<início>_<fim>.json
+    """
+    dates = date_range(start, end)
+    tenant_id = tenant_id or config.TENANT_ID
+    output_dir = output_dir or config.BACKFILL_DIR
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(workers or config.BACKFILL_WORKERS, len(dates)))
+    mode = "dry-run" if dry_run else "ENVIO"
+    logger.info(f"[{tenant_id}] Backfill {start} a {end}: {len(dates)} datas, {workers} processos, modo {mode}")
+
+    started = time.perf_counter()
+    results: Dict[str, Dict] = {}
+    # spawn: os workers não herdam threads e conexões abertas do processo principal
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(workers, logging.getLogger().getEffectiveLevel(), tenant_id)) as executor:
+        futures = {
+            executor.submit(_run_date, target_date, dry_run, result_path(target_date, output_dir)): target_date
+            for target_date in dates
+        }
+        for future in as_completed(futures):
+            target_date = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Backfill {target_date}: falhou: {e}", exc_info=True)
+                summary = {"date": target_date.isoformat(), "ok": False, "error": str(e)}
+            results[summary["date"]] = summary
+            if summary["ok"]:
+                logger.info(f"Backfill {summary['date']}: {summary['accounts']} contas, "
+                            f"{sum(summary['messages'].values())} mensagens ({summary['duration']}s)")
+
+    ordered = [results[d.isoformat()] for d in dates]
+    generations = sorted({r["users_generation"] for r in ordered if r.get("users_generation") is not None})
+    if len(generations) > 1:
+        logger.warning(f"Snapshot de clientes mudou durante o backfill (gerações {generations}); "
+                       "os resultados usam bases diferentes")
+    report = {
+        "tenant": tenant_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "dry_run": dry_run,
+        "workers": workers,
+        "timestamp": datetime.now().isoformat(),
+        "duration": round(time.perf_counter() - started, 3),
+        "users_generations": generations,
+        "failed": [r["date"] for r in ordered if not r["ok"]],
+        "dates": ordered,
+    }
+    summary_path = os.path.join(output_dir, f"backfill_{start.isoformat()}_{end.isoformat()}.json")
+    write_json_atomic(summary_path, report, indent=2)
+    logger.info(f"Backfill concluído em {report['duration']}s: {len(dates) - len(report['failed'])} datas ok, "
+                f"{len(report['failed'])} com falha. Resumo em {summary_path}")
+    return report
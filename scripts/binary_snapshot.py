@@ -0,0 +1,326 @@
+"""
+Snapshot binário compacto dos clientes, lido via mmap sob demanda
+Alternativa ao users.json: o arquivo é mapeado em memória e só os clientes
+referenciados pelas contas do dia (ou aniversariantes) são decodificados.
+
+Layout (little-endian):
+    cabeçalho   magic "NFCS", versão, total, geração e offsets das seções
+    registros   [u32 tamanho][campos UTF-8 separados por 0x1F] por cliente
+    índice      pares (u64 id, u64 offset) ordenados por id (busca binária)
+    aniversário 12x31 slots (u32 início, u32 quantidade) + offsets u64 dos registros
+    meta        JSON com last_updated, invalid_birth_dates etc.
+
+Uso:
+    python -m scripts.binary_snapshot convert [users.json] [users.bin]
+    python -m scripts.binary_snapshot bench [users.json] [users.bin] [--lookups N]
+"""
+import os
+import sys
+import json
+import mmap
+import random
+import struct
+import tempfile
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.birthdays import month_day, normalize_birth_date
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NFCS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIQQQQQ")
+LENGTH = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<QQ")
+BDAY_SLOT = struct.Struct("<II")
+OFFSET = struct.Struct("<Q")
+BDAY_SLOTS = 12 * 31
+FIELDS = ("id", "nome", "telefone", "data_nascimento", "data_nascimento_normalizada")
+SEPARATOR = "\x1f"
+
+
+def _bday_slot(month: int, day: int) -> int:
+    return (month - 1) * 31 + (day - 1)
+
+
+def write_binary_snapshot(users: Iterable[Dict], path: Optional[str] = None, generation: int = 0,
+                          meta: Optional[Dict] = None) -> int:
+    """
+    Grava o snapshot binário de forma atômica (temporário + rename)
+    Leitores com o arquivo antigo mapeado continuam lendo a versão antiga.
+
+    Returns:
+        Quantidade de clientes gravados
+    """
+    path = path or config.USERS_BIN_PATH
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+
+    index: List[Tuple[int, int]] = []
+    birthdays: Dict[int, List[int]] = {}
+    count = 0
+    skipped = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(b"\0" * HEADER.size)
+        data_offset = f.tell()
+        for user in users:
+            user_id = str(user.get("id") or "")
+            if not user_id.isdigit():
+                skipped += 1
+                continue
+            if "data_nascimento_normalizada" not in user:
+                user = dict(user)
+                user["data_nascimento_normalizada"], _ = normalize_birth_date(user.get("data_nascimento"))
+            payload = SEPARATOR.join(
+                str(user.get(field) or "").replace(SEPARATOR, " ") for field in FIELDS
+            ).encode("utf-8")
+            offset = f.tell()
+            f.write(LENGTH.pack(len(payload)))
+            f.write(payload)
+            index.append((int(user_id), offset))
+            month, day = month_day(user.get("data_nascimento_normalizada") or "")
+            if month is not None:
+                birthdays.setdefault(_bday_slot(month, day), []).append(offset)
+            count += 1
+
+        index.sort()
+        index_offset = f.tell()
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+
+        bday_offset = f.tell()
+        start = 0
+        for slot in range(BDAY_SLOTS):
+            slot_count = len(birthdays.get(slot, ()))
+            f.write(BDAY_SLOT.pack(start, slot_count))
+            start += slot_count
+        for slot in range(BDAY_SLOTS):
+            for offset in birthdays.get(slot, ()):
+                f.write(OFFSET.pack(offset))
+
+        meta_offset = f.tell()
+        meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode("utf-8")
+        f.write(meta_bytes)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, count, generation, data_offset,
+                            index_offset, bday_offset, meta_offset, len(meta_bytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target)
+
+    if skipped:
+        logger.warning(f"{skipped} usuários com id não numérico ficaram fora do snapshot binário")
+    return count
+
+
+class BinarySnapshot:
+    """
+    Leitor do snapshot binário com a mesma interface de consulta do ClientStore
+    (count, get, get_many, find_by_birthday(s), get_meta, generation)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.USERS_BIN_PATH
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self._count, self._generation, self._data_offset, self._index_offset,
+         self._bday_offset, meta_offset, meta_length) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Arquivo {self.path} não é um snapshot binário válido")
+        self._index_count = (self._bday_offset - self._index_offset) // INDEX_ENTRY.size
+        self._bday_entries = self._bday_offset + BDAY_SLOTS * BDAY_SLOT.size
+        self._meta = json.loads(self._mm[meta_offset:meta_offset + meta_length] or b"{}")
+
+    def close(self):
+        if not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def pin_snapshot(self) -> int:
+        # O arquivo mapeado já é imutável: trocas atômicas criam um novo inode
+        return self._generation
+
+    def release_snapshot(self):
+        pass
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self._meta.get(key)
+        return default if value is None else str(value)
+
+    def count(self) -> int:
+        return self._count
+
+    def _record_at(self, offset: int) -> Dict:
+        (length,) = LENGTH.unpack_from(self._mm, offset)
+        start = offset + LENGTH.size
+        values = self._mm[start:start + length].decode("utf-8").split(SEPARATOR)
+        user = dict(zip(FIELDS, values))
+        user["id"] = int(user["id"])
+        return user
+
+    def _find_offset(self, client_id: int) -> Optional[int]:
+        lo, hi = 0, self._index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_id, offset = INDEX_ENTRY.unpack_from(self._mm, self._index_offset + mid * INDEX_ENTRY.size)
+            if entry_id < client_id:
+                lo = mid + 1
+            elif entry_id > client_id:
+                hi = mid
+            else:
+                return offset
+        return None
+
+    def get(self, client_id) -> Optional[Dict]:
+        """Busca um cliente pelo id (busca binária no índice, decodifica só esse registro)"""
+        key = str(client_id)
+        if not key.isdigit():
+            return None
+        offset = self._find_offset(int(key))
+        return self._record_at(offset) if offset is not None else None
+
+    def get_many(self, client_ids: Iterable) -> Dict[str, Dict]:
+        """Busca vários clientes; retorna dicionário id (string) -> cliente"""
+        found = {}
+        for client_id in {str(client_id) for client_id in client_ids if client_id is not None}:
+            user = self.get(client_id)
+            if user is not None:
+                found[client_id] = user
+        return found
+
+    def find_by_birthday(self, month: int, day: int) -> List[Dict]:
+        """Aniversariantes do dia/mês, direto do índice de aniversário"""
+        start, slot_count = BDAY_SLOT.unpack_from(
+            self._mm, self._bday_offset + _bday_slot(month, day) * BDAY_SLOT.size
+        )
+        users = []
+        for i in range(start, start + slot_count):
+            (offset,) = OFFSET.unpack_from(self._mm, self._bday_entries + i * OFFSET.size)
+            users.append(self._record_at(offset))
+        return sorted(users, key=lambda user: user["id"])
+
+    def find_by_birthdays(self, keys: Iterable[Tuple[int, int]]) -> List[Dict]:
+        users = []
+        for month, day in keys:
+            users.extend(self.find_by_birthday(month, day))
+        return users
+
+    def iter_all(self) -> Iterator[Dict]:
+        offset = self._data_offset
+        while offset < self._index_offset:
+            (length,) = LENGTH.unpack_from(self._mm, offset)
+            yield self._record_at(offset)
+            offset += LENGTH.size + length
+
+
+def convert_json(json_path: str, bin_path: str) -> int:
+    """Converte um users.json (formato da coleta) para o snapshot binário"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    meta = {
+        "last_updated": data.get("last_updated"),
+        "invalid_birth_dates": data.get("invalid_birth_dates", 0),
+    }
+    return write_binary_snapshot(data.get("users", []), bin_path, data.get("generation", 0), meta)
+
+
+_BENCH_CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+mode, path, ids_path = sys.argv[1], sys.argv[2], sys.argv[3]
+with open(ids_path, encoding="utf-8") as f:
+    ids = json.load(f)
+started = time.perf_counter()
+if mode == "json":
+    with open(path, encoding="utf-8") as f:
+        users = {{str(u["id"]): u for u in json.load(f)["users"]}}
+    get = users.get
+else:
+    from scripts.binary_snapshot import BinarySnapshot
+    get = BinarySnapshot(path).get
+loaded = time.perf_counter()
+found = sum(1 for client_id in ids if get(client_id) is not None)
+done = time.perf_counter()
+max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    # VmHWM é zerado no exec; ru_maxrss pode herdar o pico do processo pai
+    with open("/proc/self/status") as f:
+        max_rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    pass
+print(json.dumps({{"load_s": loaded - started, "lookup_s": done - loaded, "found": found,
+                  "max_rss_kb": max_rss_kb}}))
+"""
+
+
+def benchmark(json_path: str, bin_path: str, lookups: int = 500) -> Dict[str, Dict]:
+    """Mede tempo de carga, tempo de consultas e RSS máximo de cada formato em processos separados"""
+    with BinarySnapshot(bin_path) as snapshot:
+        all_ids = [str(user["id"]) for user in snapshot.iter_all()]
+    random.seed(42)
+    ids = random.sample(all_ids, min(lookups, len(all_ids)))
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    code = _BENCH_CHILD.format(root=root)
+    results = {}
+    with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as ids_file:
+        json.dump(ids, ids_file)
+    try:
+        for mode, path in (("json", json_path), ("binary", bin_path)):
+            output = subprocess.check_output([sys.executable, "-c", code, mode, path, ids_file.name])
+            results[mode] = json.loads(output)
+            results[mode]["file_bytes"] = os.path.getsize(path)
+    finally:
+        os.unlink(ids_file.name)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot binário de clientes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("convert", "bench"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("json_path", nargs="?", default=config.USERS_JSON_PATH)
+        cmd.add_argument("bin_path", nargs="?", default=config.USERS_BIN_PATH)
+        if name == "bench":
+            cmd.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        total = convert_json(args.json_path, args.bin_path)
+        print(f"{total} clientes convertidos para {args.bin_path}")
+        return 0
+
+    if not Path(args.bin_path).exists():
+        convert_json(args.json_path, args.bin_path)
+    results = benchmark(args.json_path, args.bin_path, args.lookups)
+    print(f"{'formato':<8} {'arquivo':>12} {'carga (s)':>10} {'consultas (s)':>14} {'RSS máx (KB)':>13}")
+    for mode, r in results.items():
+        print(f"{mode:<8} {r['file_bytes']:>12} {r['load_s']:>10.3f} {r['lookup_s']:>14.4f} {r['max_rss_kb']:>13}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
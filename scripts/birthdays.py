@@ -0,0 +1,81 @@
+"""
+Normalização de datas de nascimento e índice de aniversariantes
+A data é interpretada uma única vez, na coleta, e guardada como YYYY-MM-DD;
+a verificação diária só consulta o índice (mês, dia) -> clientes.
+"""
+import os
+import sys
+import calendar
+import logging
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dateutil import parser as date_parser
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+# Políticas para aniversários em 29/02 quando o ano não é bissexto
+FEB29_POLICIES = ("feb28", "mar1", "skip")
+
+
+def parse_birth_date(value) -> Optional[date]:
+    """Interpreta a data de nascimento da NextFit; retorna None se vazia ou inválida"""
+    if not value:
+        return None
+    try:
+        return date_parser.parse(str(value)).date()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def normalize_birth_date(value) -> Tuple[str, bool]:
+    """
+    Normaliza a data de nascimento para YYYY-MM-DD
+
+    Returns:
+        Tupla (data normalizada ou "", True se havia valor mas não foi possível interpretá-lo)
+    """
+    parsed = parse_birth_date(value)
+    if parsed is None:
+        return "", bool(value)
+    return parsed.isoformat(), False
+
+
+def month_day(normalized: str) -> Tuple[Optional[int], Optional[int]]:
+    """Extrai (mês, dia) de uma data já normalizada (YYYY-MM-DD)"""
+    if not normalized or len(normalized) < 10:
+        return None, None
+    return int(normalized[5:7]), int(normalized[8:10])
+
+
+def birthday_keys(target_date: date, policy: Optional[str] = None) -> List[Tuple[int, int]]:
+    """
+    Retorna os pares (mês, dia) que fazem aniversário em target_date
+
+    Em anos não bissextos, quem nasceu em 29/02 é incluído em 28/02 (policy "feb28"),
+    em 01/03 (policy "mar1") ou não é incluído (policy "skip").
+    """
+    if policy is None:
+        policy = config.BIRTHDAY_FEB29_POLICY
+    keys = [(target_date.month, target_date.day)]
+    if not calendar.isleap(target_date.year):
+        if policy == "feb28" and (target_date.month, target_date.day) == (2, 28):
+            keys.append((2, 29))
+        elif policy == "mar1" and (target_date.month, target_date.day) == (3, 1):
+            keys.append((2, 29))
+    return keys
+
+
+def build_birthday_index(users: Iterable[Dict]) -> Dict[str, List]:
+    """Monta o índice "MM-DD" -> [ids] a partir de usuários já normalizados"""
+    index: Dict[str, List] = {}
+    for user in users:
+        month, day = month_day(user.get("data_nascimento_normalizada") or "")
+        if month is None:
+            continue
+        index.setdefault(f"{month:02d}-{day:02d}", []).append(user.get("id"))
+    return index
@@ -5,21 +5,29 @@ Busca contas em múltiplos períodos e envia mensagens
 """
 import os
 import sys
-import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, date, timedelta
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from dateutil import parser as date_parser
 
 # Adicionar o diretório raiz ao path para importar config
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 import config.config as config
 from scripts import send_messages
+from scripts import http_client, leases, metrics, tracing
+from scripts.pagination import iter_pages
+from scripts.client_store import open_client_store
+from scripts.binary_snapshot import BinarySnapshot
+from scripts.client_lookup import ClientCache, ClientJoinIndex
+from scripts.outbox import Outbox, OutboxEmitter
+from scripts.coalesce import Coalescer
+from scripts.snapshots import read_json_snapshot, write_json_atomic
+from scripts.birthdays import birthday_keys, month_day, normalize_birth_date
+from scripts.models import RECEIVABLE_ALIASES, Client, FieldResolver, Receivable
 
 # Configurar logging
 logging.basicConfig(
@@ -28,139 +36,212 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Tipo de mensagem enviada para cada janela de vencimento
+MESSAGE_TYPE_BY_PERIOD = {
+    "vencendo_hoje": "boleto_vencendo_hoje",
+    "vencendo_3_dias": "boleto_vencendo_3_dias",
+    "vencido_3_dias": "boleto_vencido_3_dias",
+    "vencido_5_dias": "boleto_vencido_5_dias",
+    "vencido_30_dias": "boleto_vencido_30_dias",
+}
 
-def create_session_with_retry():
-    """Cria uma sessão requests com retry automático"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=config.MAX_RETRIES,
-        backoff_factor=config.RETRY_DELAY,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+
+def flow_type_index() -> Dict[int, str]:
+    """Índice reverso flow_id -> tipo de mensagem (config.FLOW_IDS)"""
+    return {flow_id: message_type for message_type, flow_id in config.FLOW_IDS.items() if flow_id}
+
+
+def count_results_by_type(results) -> tuple:
+    """
+    Conta envios com sucesso e com falha por tipo de mensagem
+    
+    Returns:
+        Tupla (enviadas por tipo, falhas por tipo)
+    """
+    type_by_flow = flow_type_index()
+    sent = dict.fromkeys(config.FLOW_IDS, 0)
+    failed = dict.fromkeys(config.FLOW_IDS, 0)
+    for r in results:
+        message_type = r.message_type or type_by_flow.get(r.flow_id)
+        if message_type is None:
+            continue
+        counter = sent if r.success else failed
+        counter[message_type] = counter.get(message_type, 0) + 1
+    return sent, failed
 
 
 def load_users():
-    """Carrega os usuários do arquivo JSON"""
-    users_file = Path(config.USERS_JSON_PATH)
+    """Carrega os usuários do arquivo JSON (ou da geração anterior, se o atual estiver indisponível)"""
+    data, used_path = read_json_snapshot(config.USERS_JSON_PATH)
     
-    if not users_file.exists():
+    if data is None:
         logger.error(f"Arquivo {config.USERS_JSON_PATH} não encontrado!")
         return []
     
-    try:
-        with open(users_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            users = data.get("users", [])
-            logger.info(f"Carregados {len(users)} usuários do arquivo")
-            return users
-    except Exception as e:
-        logger.error(f"Erro ao carregar usuários: {e}", exc_info=True)
-        return []
+    users = data.get("users", [])
+    logger.info(f"Carregados {len(users)} usuários do arquivo {used_path}")
+    return users
 
 
-def fetch_accounts_receber(session, data_inicio: str, data_fim: str) -> List[Dict]:
-    """Busca contas a receber para um período"""
+def open_users_source():
+    """
+    Abre a fonte de clientes da verificação diária conforme config.USERS_BACKEND
+    Ambas as fontes fixam a última geração completa durante a execução.
+    """
+    if config.USERS_BACKEND == "binary":
+        if Path(config.USERS_BIN_PATH).exists():
+            return BinarySnapshot(config.USERS_BIN_PATH)
+        logger.warning(f"Snapshot binário {config.USERS_BIN_PATH} não encontrado. Usando {config.USERS_DB_PATH}")
+    return open_client_store(pin=True)
+
+
+def fetch_accounts_page(session, data_inicio: str, data_fim: str, skip: int):
+    """Busca uma página de contas a receber para um período"""
     url = f"{config.BASE_URL}{config.ENDPOINT_CONTAS_RECEBER}"
     params = {
         "DataVencimentoInicio": data_inicio,
         "DataVencimentoFim": data_fim,
+        "Skip": skip,
         "Take": config.ITEMS_PER_PAGE,
         "version": config.API_VERSION
     }
-    
-    all_accounts = []
-    skip = 0
+    logger.debug(f"Buscando contas: Skip={skip}, DataInicio={data_inicio}, DataFim={data_fim}")
+    response = http_client.request("nextfit", "GET", url, session=session,
+                                   headers=config.API_HEADERS, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_accounts_page(accounts_data):
+    """
+    Extrai a lista de contas de uma página da API
+
+    Returns:
+        Tupla (lista de contas ou None se o formato for inesperado, temProximaPagina ou None)
+    """
+    tem_proxima_pagina = None
+    if isinstance(accounts_data, list):
+        accounts_list = accounts_data
+    elif isinstance(accounts_data, dict):
+        accounts_list = accounts_data.get("data") or accounts_data.get("items") or accounts_data.get("contas") or []
+        if "temProximaPagina" in accounts_data:
+            tem_proxima_pagina = bool(accounts_data.get("temProximaPagina"))
+        if not accounts_list:
+            accounts_list = [accounts_data]
+    else:
+        return None, None
+    return accounts_list, tem_proxima_pagina
+
+
+def is_last_accounts_page(accounts_data) -> bool:
+    accounts_list, tem_proxima_pagina = parse_accounts_page(accounts_data)
+    return (not accounts_list or tem_proxima_pagina is False
+            or len(accounts_list) < config.ITEMS_PER_PAGE)
+
+
+def iter_accounts_pages(session, data_inicio: str, data_fim: str):
+    """Gera as contas a receber de um período página a página (com prefetch)"""
+    def fetch_page(skip):
+        return fetch_accounts_page(session, data_inicio, data_fim, skip)
     
     try:
-        while True:
-            params["Skip"] = skip
-            logger.debug(f"Buscando contas: Skip={skip}, DataInicio={data_inicio}, DataFim={data_fim}")
-            
-            response = session.get(url, headers=config.API_HEADERS, params=params, timeout=30)
-            response.raise_for_status()
-            accounts_data = response.json()
-            
-            # Processar resposta
-            if isinstance(accounts_data, list):
-                accounts_list = accounts_data
-            elif isinstance(accounts_data, dict):
-                accounts_list = accounts_data.get("data") or accounts_data.get("items") or accounts_data.get("contas") or []
-                if not accounts_list and isinstance(accounts_data, dict):
-                    accounts_list = [accounts_data]
-            else:
-                logger.warning(f"Formato de resposta inesperado: {type(accounts_data)}")
-                break
-            
-            if not accounts_list or len(accounts_list) == 0:
-                break
-            
-            all_accounts.extend(accounts_list)
-            
-            if len(accounts_list) < config.ITEMS_PER_PAGE:
-                break
-            
-            skip += config.ITEMS_PER_PAGE
-        
-        return all_accounts
-        
+        with closing(iter_pages(fetch_page, config.ITEMS_PER_PAGE,
+                                prefetch=config.ACCOUNTS_PREFETCH_PAGES,
+                                is_last=is_last_accounts_page)) as pages:
+            for skip, accounts_data in pages:
+                accounts_list, _ = parse_accounts_page(accounts_data)
+                if accounts_list is None:
+                    logger.warning(f"Formato de resposta inesperado: {type(accounts_data)}")
+                    break
+                
+                if not accounts_list:
+                    break
+                
+                metrics.PAGES_FETCHED.inc(tenant=config.TENANT_ID, source="contas_receber")
+                yield accounts_list
+    
     except requests.exceptions.RequestException as e:
         logger.error(f"Erro ao buscar contas a receber: {e}", exc_info=True)
         raise
 
 
-def get_accounts_with_user_info(accounts: List[Dict], users: List[Dict]) -> List[Dict]:
-    """Associa contas a receber com informações dos usuários"""
-    users_dict = {str(user.get("id")): user for user in users}
+def fetch_accounts_receber(session, data_inicio: str, data_fim: str) -> List[Dict]:
+    """Busca todas as contas a receber para um período"""
+    all_accounts = []
+    for accounts_list in iter_accounts_pages(session, data_inicio, data_fim):
+        all_accounts.extend(accounts_list)
+    return all_accounts
+
+
+def build_users_index(users: List[Dict]) -> Dict[str, Dict]:
+    """Indexa os usuários por id (string) para o join com as contas"""
+    return {str(user.get("id")): user for user in users}
+
+
+def get_accounts_with_user_info(accounts: List, users) -> List[Dict]:
+    """
+    Associa contas a receber com informações dos usuários
+    
+    accounts pode conter Receivable ou os dicionários crus da API (convertidos
+    aqui, com a variação de chave resolvida uma vez para a página).
+    users pode ser a lista de usuários, um índice já pronto de build_users_index
+    ou um ClientStore (consulta apenas os clientes referenciados pelas contas).
+    """
+    resolver = FieldResolver(RECEIVABLE_ALIASES)
+    receivables = [
+        account if isinstance(account, Receivable) else Receivable.from_api(account, resolver)
+        for account in accounts
+    ]
+    
+    if hasattr(users, "get_many"):
+        users_dict = users.get_many(r.cliente_id for r in receivables if r.cliente_id)
+    elif isinstance(users, dict):
+        users_dict = users
+    else:
+        users_dict = build_users_index(users)
     
     accounts_with_users = []
     
-    for account in accounts:
-        cliente_id = (
-            account.get("CodigoCliente") or 
-            account.get("codigoCliente") or 
-            account.get("ClienteId") or 
-            account.get("clienteId") or
-            account.get("IdCliente") or
-            account.get("idCliente")
-        )
-        
+    for receivable in receivables:
         user_info = None
-        if cliente_id:
-            user_info = users_dict.get(str(cliente_id))
+        if receivable.cliente_id:
+            user = users_dict.get(str(receivable.cliente_id))
+            if user is not None:
+                user_info = user if isinstance(user, Client) else Client.from_dict(user)
         
         accounts_with_users.append({
-            "conta": account,
-            "cliente_id": cliente_id,
+            "conta": receivable,
+            "cliente_id": receivable.cliente_id,
             "user_info": user_info
         })
     
     return accounts_with_users
 
 
-def find_birthday_users(users: List[Dict], target_date: date = None) -> List[Dict]:
-    """Identifica usuários que fazem aniversário na data especificada"""
+def find_birthday_users(users, target_date: date = None) -> List[Dict]:
+    """
+    Identifica usuários que fazem aniversário na data especificada
+    users pode ser a lista de usuários ou um ClientStore (consulta pelo índice de aniversário).
+    Aniversários em 29/02 seguem config.BIRTHDAY_FEB29_POLICY nos anos não bissextos.
+    """
     if target_date is None:
         target_date = date.today()
     
+    keys = birthday_keys(target_date)
+    if hasattr(users, "find_by_birthdays"):
+        return users.find_by_birthdays(keys)
+    
     birthday_users = []
     
     for user in users:
-        data_nascimento_str = user.get("data_nascimento") or user.get("DataNascimento") or ""
-        
-        if not data_nascimento_str:
-            continue
+        # Usar a data já normalizada na coleta; interpretar apenas usuários antigos sem ela
+        if "data_nascimento_normalizada" in user:
+            normalizada = user.get("data_nascimento_normalizada") or ""
+        else:
+            normalizada, _ = normalize_birth_date(user.get("data_nascimento") or user.get("DataNascimento") or "")
         
-        try:
-            data_nascimento = date_parser.parse(data_nascimento_str).date()
-            if data_nascimento.month == target_date.month and data_nascimento.day == target_date.day:
-                birthday_users.append(user)
-        except (ValueError, TypeError):
-            continue
+        if month_day(normalizada) in keys:
+            birthday_users.append(user)
     
     return birthday_users
 
@@ -193,10 +274,15 @@ def get_date_range_strings(target_date: date) -> Dict[str, tuple]:
     }
 
 
-def prepare_message_data(user: Dict, conta_data: Dict = None, message_type: str = "aniversariante") -> Dict:
-    """Prepara dados para envio de mensagem"""
-    phone = user.get("telefone") or user.get("Telefone") or ""
-    first_name = user.get("nome") or user.get("Nome") or ""
+def prepare_message_data(user, conta_data=None, message_type: str = "aniversariante") -> Dict:
+    """
+    Prepara dados para envio de mensagem
+    user é um Client (ou dicionário armazenado) e conta_data um Receivable (ou dicionário)
+    """
+    if not isinstance(user, Client):
+        user = Client.from_dict(user)
+    phone = user.telefone or ""
+    first_name = user.nome or ""
     
     if not phone:
         return None
@@ -212,9 +298,11 @@ def prepare_message_data(user: Dict, conta_data: Dict = None, message_type: str
         field_mappings[config.MESSAGE_CUSTOM_FIELDS["campo1"]] = first_name
     
     if conta_data:
-        valor = conta_data.get("valor") or conta_data.get("Valor") or ""
-        vencimento = conta_data.get("vencimento") or conta_data.get("DataVencimento") or conta_data.get("dataVencimento") or ""
-        plano = conta_data.get("descricao") or conta_data.get("Descricao") or ""  # Nome do plano
+        if not isinstance(conta_data, Receivable):
+            conta_data = Receivable.from_api(conta_data)
+        valor = conta_data.valor or ""
+        vencimento = conta_data.vencimento or ""
+        plano = conta_data.descricao or ""  # Nome do plano
         
         # Extrair apenas a data (sem hora) do vencimento
         data_vencimento_apenas = ""
@@ -256,22 +344,170 @@ def prepare_message_data(user: Dict, conta_data: Dict = None, message_type: str
         "phone": phone,
         "first_name": first_name,
         "field_mappings": field_mappings,
-        "flow_id": flow_id
+        "flow_id": flow_id,
+        # Metadados para a chave de idempotência da outbox
+        "message_type": message_type,
+        "cliente_id": user.id,
+        "conta_id": conta_data.identity() if conta_data else None
     }
 
 
-def check_accounts_and_birthdays():
-    """Função principal: verifica contas a receber e aniversariantes em múltiplos períodos"""
+def build_conta_data(conta) -> Dict:
+    """Extrai os dados da conta usados no histórico e nas mensagens"""
+    if not isinstance(conta, Receivable):
+        conta = Receivable.from_api(conta)
+    return conta.to_conta_data()
+
+
+def process_window(session, period_name: str, data_inicio: str, data_fim: str,
+                   users, emit) -> tuple:
+    """
+    Busca as contas de uma janela e prepara as mensagens página a página
+    
+    As mensagens preparadas passam pelo agrupamento (um envio por telefone e
+    tipo): a API não ordena as contas por telefone, então qualquer página
+    posterior ainda pode completar um grupo, e os grupos ficam retidos até o fim
+    da janela. A retenção é limitada (config.MESSAGE_COALESCE_MAX_PENDING): acima
+    dela os grupos mais antigos seguem para emit durante a busca, mantendo a
+    memória constante e o backpressure da fila de envio limitada página a página.
+    
+    Returns:
+        Tupla (resumo da janela para result["accounts"], mensagens emitidas após o agrupamento)
+    """
+    with tracing.span("window", period=period_name, pages=0) as window_span:
+        logger.info(f"Buscando contas: {period_name} ({data_inicio} a {data_fim})")
+        message_type = MESSAGE_TYPE_BY_PERIOD.get(period_name)
+        window = {
+            "total": 0,
+            "with_user_info": 0,
+            "accounts": []
+        }
+        coalescer = Coalescer(emit)
+        
+        # Esquema da resposta resolvido na primeira página e reutilizado nas seguintes
+        resolver = FieldResolver(RECEIVABLE_ALIASES)
+        
+        pages = tracing.timed_iter(window_span, "fetch", iter_accounts_pages(session, data_inicio, data_fim))
+        for accounts in pages:
+            # Lease perdido: outra réplica assumiu a verificação
+            leases.check_lease()
+            window_span.incr("pages")
+            window["total"] += len(accounts)
+            receivables = [Receivable.from_api(account, resolver) for account in accounts]
+            
+            with window_span.accumulate("join"):
+                matched = get_accounts_with_user_info(receivables, users)
+            for acc in matched:
+                if acc["user_info"] is None:
+                    continue
+                window["with_user_info"] += 1
+                
+                conta = acc["conta"]
+                conta_status = conta.status
+                
+                # Sempre adicionar à lista de contas (para histórico)
+                window["accounts"].append({
+                    "cliente_id": acc["cliente_id"],
+                    "user": acc["user_info"].to_dict(),
+                    "conta_data": conta.to_conta_data()
+                })
+                
+                # Filtrar por status: apenas enviar mensagem para status válidos
+                if conta_status in config.VALID_ACCOUNT_STATUSES:
+                    # Preparar mensagem apenas para contas com status válido
+                    with window_span.accumulate("prepare"):
+                        msg_data = prepare_message_data(acc["user_info"], conta, message_type)
+                        if msg_data:
+                            coalescer.add(msg_data)
+                else:
+                    logger.debug(f"Conta do cliente {acc['cliente_id']} com status '{conta_status}' ignorada (não está em VALID_ACCOUNT_STATUSES)")
+        
+        # Entrega à outbox e à fila de envio (inclui a espera por backpressure da fila)
+        with window_span.accumulate("emit"):
+            coalescer.flush()
+        window["messages_merged"] = coalescer.merged
+        logger.info(f"Encontradas {window['total']} contas para {period_name}")
+        if coalescer.merged:
+            logger.info(f"{coalescer.received} mensagens de {period_name} agrupadas em {coalescer.emitted} envios")
+        window_span.set(accounts=window["total"], with_user_info=window["with_user_info"],
+                        messages=coalescer.emitted)
+    return window, coalescer.emitted
+
+
+def process_all_windows(session, date_ranges: Dict[str, tuple], users, emit,
+                        max_workers: Optional[int] = None) -> Dict[str, tuple]:
+    """
+    Processa todas as janelas de vencimento em paralelo
+    
+    Args:
+        max_workers: Janelas simultâneas (padrão: config.ACCOUNTS_WINDOW_WORKERS)
+    
+    Returns:
+        Dicionário período -> (resumo da janela, mensagens preparadas), na ordem de date_ranges
+    """
+    def run(item):
+        period_name, (data_inicio, data_fim) = item
+        return process_window(session, period_name, data_inicio, data_fim, users, emit)
+    
+    max_workers = max(1, min(max_workers or config.ACCOUNTS_WINDOW_WORKERS, len(date_ranges)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="window") as executor:
+        results = list(executor.map(tracing.propagate(run), date_ranges.items()))
+    return dict(zip(date_ranges.keys(), results))
+
+
+def check_accounts_and_birthdays(target_date: Optional[date] = None, dry_run: Optional[bool] = None,
+                                 window_workers: Optional[int] = None, send_workers: Optional[int] = None,
+                                 output_path: Optional[str] = None, fetch_missing_clients: Optional[bool] = None,
+                                 read_only_cache: bool = False, purge_outbox: bool = True):
+    """
+    Função principal: verifica contas a receber e aniversariantes em múltiplos períodos
+    
+    Funciona como um pipeline: cada página de contas é associada aos usuários,
+    filtrada e transformada em mensagem assim que chega, e a mensagem segue
+    direto para a fila de envio (limitada, com backpressure).
+    
+    O tempo de cada etapa é registrado em spans (scripts/tracing.py), gravados
+    em result["trace"] e em config.TRACE_LOG_PATH.
+    
+    Args:
+        target_date: Data de referência das janelas e dos aniversários (padrão: hoje)
+        dry_run: Prepara as mensagens sem enviar nem registrar na outbox (padrão: not config.SEND_MESSAGES)
+        window_workers: Janelas buscadas em paralelo (padrão: config.ACCOUNTS_WINDOW_WORKERS)
+        send_workers: Envios simultâneos (padrão: config.MESSAGE_MAX_WORKERS)
+        output_path: Arquivo de resultado (padrão: config.ACCOUNTS_JSON_PATH)
+        fetch_missing_clients: Buscar na NextFit clientes fora do snapshot e do cache
+                               (padrão: config.CLIENT_LOOKUP_ENABLED)
+        read_only_cache: Não gravar o cache de clientes ao final (execuções em paralelo, ex: backfill)
+        purge_outbox: Remover da outbox os registros fora da retenção, contada a partir de target_date
+                      (o backfill desliga: datas antigas do intervalo seriam removidas)
+    """
+    if dry_run is None:
+        dry_run = not config.SEND_MESSAGES
+    with tracing.span("check_accounts") as trace:
+        return _check_accounts_and_birthdays(trace, target_date, dry_run, window_workers, send_workers,
+                                             output_path or config.ACCOUNTS_JSON_PATH,
+                                             fetch_missing_clients, read_only_cache, purge_outbox)
+
+
+def _check_accounts_and_birthdays(trace: tracing.Span, target_date: Optional[date], dry_run: bool,
+                                  window_workers: Optional[int], send_workers: Optional[int], output_path: str,
+                                  fetch_missing_clients: Optional[bool], read_only_cache: bool, purge_outbox: bool):
     logger.info("Iniciando verificação de contas a receber e aniversariantes")
     
-    # Carregar usuários
-    users = load_users()
-    if not users:
+    # Abrir o repositório de clientes (consultas pontuais, sem carregar todos em memória)
+    # fixando a última geração completa: uma coleta concorrente não altera esta execução
+    with tracing.span("load_users", backend=config.USERS_BACKEND) as load_span:
+        users = open_users_source()
+        total_users = users.count()
+        load_span.set(users=total_users)
+    if not total_users:
         logger.warning("Nenhum usuário carregado. Verificação pode estar incompleta.")
+        users.close()
         return None
+    logger.info(f"Repositório de clientes com {total_users} usuários ({users.path}, geração {users.generation})")
     
-    hoje = datetime.now().date()
-    session = create_session_with_retry()
+    hoje = target_date or datetime.now().date()
+    session = http_client.get_session("nextfit")
     
     # Obter ranges de datas
     date_ranges = get_date_range_strings(hoje)
@@ -279,9 +515,11 @@ def check_accounts_and_birthdays():
     result = {
         "date": hoje.isoformat(),
         "timestamp": datetime.now().isoformat(),
+        "users_generation": users.generation,
         "accounts": {},
         "birthdays": {
             "total": 0,
+            "invalid_birth_dates": int(users.get_meta("invalid_birth_dates", "0")),
             "users": []
         },
         "messages_sent": {
@@ -294,118 +532,114 @@ def check_accounts_and_birthdays():
         }
     }
     
-    messages_to_send = []
+    prepared_by_type = dict.fromkeys(result["messages_sent"], 0)
+    
+    # Destino das mensagens preparadas: outbox + fila de envio ou, em modo teste, apenas contagem
+    # A outbox guarda o que já foi entregue hoje: uma reexecução envia só o que faltou
+    sender = None
+    outbox = None
+    if not dry_run:
+        outbox = Outbox()
+        if purge_outbox:
+            outbox.purge(reference_date=hoje)
+        sender = send_messages.StreamingSender(
+            max_workers=send_workers,
+            on_result=lambda msg, res: outbox.mark(msg["outbox_key"], res.success, res.error)
+        ).start()
+        # Com várias réplicas: reserva cada envio e, com SEND_SHARDING, envia só o shard desta réplica
+        shard = leases.send_shard()
+        if shard is not None:
+            logger.info(f"Envio dividido entre réplicas: {shard} ({', '.join(shard.replicas)})")
+        emit = OutboxEmitter(outbox, hoje.isoformat(), sender.submit, shard=shard, owner=leases.claim_owner())
+    else:
+        emit = lambda msg: None
+    
+    # Índice de clientes da execução: snapshot, depois cache e busca na NextFit para clientes novos
+    client_cache = ClientCache.load(read_only=read_only_cache)
+    join_index = ClientJoinIndex(users, session=session, cache=client_cache, fetch_missing=fetch_missing_clients)
     
     try:
-        # Buscar contas para cada período
-        for period_name, (data_inicio, data_fim) in date_ranges.items():
-            logger.info(f"Buscando contas: {period_name} ({data_inicio} a {data_fim})")
-            accounts = fetch_accounts_receber(session, data_inicio, data_fim)
-            logger.info(f"Encontradas {len(accounts)} contas para {period_name}")
-            
-            accounts_with_users = get_accounts_with_user_info(accounts, users)
-            accounts_with_valid_users = [
-                acc for acc in accounts_with_users 
-                if acc["user_info"] is not None
-            ]
-            
-            result["accounts"][period_name] = {
-                "total": len(accounts),
-                "with_user_info": len(accounts_with_valid_users),
-                "accounts": []
-            }
+        try:
+            # Buscar e processar contas de todos os períodos em paralelo
+            with tracing.span("windows"):
+                windows = process_all_windows(session, date_ranges, join_index, emit, window_workers)
+            for period_name, (window, prepared) in windows.items():
+                result["accounts"][period_name] = window
+                prepared_by_type[MESSAGE_TYPE_BY_PERIOD[period_name]] += prepared
+            leases.check_lease()
             
-            # Preparar mensagens para este período
-            message_type_map = {
-                "vencendo_hoje": "boleto_vencendo_hoje",
-                "vencendo_3_dias": "boleto_vencendo_3_dias",
-                "vencido_3_dias": "boleto_vencido_3_dias",
-                "vencido_5_dias": "boleto_vencido_5_dias",
-                "vencido_30_dias": "boleto_vencido_30_dias",
-            }
+            # Identificar aniversariantes
+            logger.info(f"Identificando aniversariantes para {hoje}")
+            with tracing.span("birthdays") as birthday_span:
+                birthday_users = find_birthday_users(users, hoje)
+                birthday_span.set(found=len(birthday_users))
+            logger.info(f"Encontrados {len(birthday_users)} aniversariantes hoje")
             
-            message_type = message_type_map.get(period_name)
+            result["birthdays"]["total"] = len(birthday_users)
+            result["birthdays"]["users"] = birthday_users
             
-            for acc in accounts_with_valid_users:
-                conta_status = acc["conta"].get("Status") or acc["conta"].get("status") or ""
-                
-                conta_data = {
-                    "valor": acc["conta"].get("Valor") or acc["conta"].get("valor"),
-                    "vencimento": acc["conta"].get("DataVencimento") or acc["conta"].get("dataVencimento"),
-                    "status": conta_status,
-                    "descricao": acc["conta"].get("descricao") or acc["conta"].get("Descricao") or "",  # Plano do aluno
-                    "codigoOrigem": None
-                }
-                
-                # Extrair código do contrato/plano se disponível
-                receber_origem = acc["conta"].get("receberOrigem") or []
-                if receber_origem and isinstance(receber_origem, list) and len(receber_origem) > 0:
-                    origem = receber_origem[0]
-                    conta_data["codigoOrigem"] = origem.get("codigoOrigem")
-                    conta_data["origem"] = origem.get("origem")  # Ex: "Contrato", "Item", etc.
-                
-                # Sempre adicionar à lista de contas (para histórico)
-                result["accounts"][period_name]["accounts"].append({
-                    "cliente_id": acc["cliente_id"],
-                    "user": acc["user_info"],
-                    "conta_data": conta_data
-                })
-                
-                # Filtrar por status: apenas enviar mensagem para status válidos
-                if conta_status in config.VALID_ACCOUNT_STATUSES:
-                    # Preparar mensagem apenas para contas com status válido
-                    msg_data = prepare_message_data(acc["user_info"], conta_data, message_type)
+            # Preparar mensagens para aniversariantes (um envio por telefone)
+            with tracing.span("prepare_birthdays") as prepare_span:
+                coalescer = Coalescer(emit)
+                for user in birthday_users:
+                    msg_data = prepare_message_data(user, None, "aniversariante")
                     if msg_data:
-                        messages_to_send.append(msg_data)
-                else:
-                    logger.debug(f"Conta do cliente {acc['cliente_id']} com status '{conta_status}' ignorada (não está em VALID_ACCOUNT_STATUSES)")
-        
-        # Identificar aniversariantes
-        logger.info(f"Identificando aniversariantes para {hoje}")
-        birthday_users = find_birthday_users(users, hoje)
-        logger.info(f"Encontrados {len(birthday_users)} aniversariantes hoje")
+                        coalescer.add(msg_data)
+                coalescer.flush()
+                prepared_by_type["aniversariante"] += coalescer.emitted
+                prepare_span.set(messages=coalescer.emitted)
+        finally:
+            # Aguardar o envio de tudo que já foi enfileirado (o span mede só a espera final;
+            # os envios correm em paralelo com as etapas anteriores)
+            with tracing.span("send") as send_span:
+                stats = sender.close() if sender else None
+                if stats:
+                    send_span.set(total=stats['total'], sent=stats['sent'], failed=stats['failed'])
+            client_cache.save()
         
-        result["birthdays"]["total"] = len(birthday_users)
-        result["birthdays"]["users"] = birthday_users
+        result["client_lookup"] = dict(join_index.stats)
+        if join_index.stats["fetched"] or join_index.stats["cache"]:
+            logger.info(
+                f"Clientes fora do snapshot: {join_index.stats['fetched']} buscados na NextFit, "
+                f"{join_index.stats['cache']} do cache, {join_index.stats['not_found']} não encontrados"
+            )
         
-        # Preparar mensagens para aniversariantes
-        for user in birthday_users:
-            msg_data = prepare_message_data(user, None, "aniversariante")
-            if msg_data:
-                messages_to_send.append(msg_data)
+        if outbox is not None:
+            result["outbox"] = outbox.counts(hoje.isoformat())
+            result["outbox"]["already_delivered"] = emit.skipped
+            if emit.shard is not None:
+                result["outbox"]["other_shards"] = emit.deferred
+            if emit.skipped:
+                logger.info(f"Outbox: {emit.skipped} mensagens já entregues hoje não foram reenviadas")
         
-        # Enviar mensagens (se habilitado)
-        if messages_to_send:
-            if config.SEND_MESSAGES:
-                logger.info(f"Enviando {len(messages_to_send)} mensagens...")
-                stats = send_messages.send_batch_messages(messages_to_send)
-                
-                # Atualizar contadores
-                for msg in messages_to_send:
-                    # Identificar tipo pela flow_id
-                    for msg_type, flow_id in config.FLOW_IDS.items():
-                        if msg.get("flow_id") == flow_id and flow_id > 0:
-                            if stats['sent'] > 0:  # Simplificado - contar todas como enviadas se stats positivo
-                                result["messages_sent"][msg_type] += 1
+        total_prepared = sum(prepared_by_type.values())
+        if total_prepared:
+            if not dry_run:
+                # Contadores reais por tipo, a partir do resultado de cada envio
+                sent_by_type, failed_by_type = count_results_by_type(stats['results'])
+                result["messages_sent"].update(sent_by_type)
+                result["messages_failed"] = failed_by_type
+                result["delivery"] = send_messages.summarize_results(stats['results'])
+                logger.info(
+                    f"Envio concluído: {stats['sent']} enviadas, {stats['failed']} falharam de {stats['total']} total "
+                    f"(p95 {result['delivery']['latency_p95']}s, {result['delivery']['attempts']} tentativas)"
+                )
             else:
-                logger.info(f"[MODO TESTE] {len(messages_to_send)} mensagens preparadas mas NÃO enviadas (SEND_MESSAGES=false)")
-                logger.info(f"[MODO TESTE] Mensagens preparadas por tipo:")
-                for msg in messages_to_send:
-                    for msg_type, flow_id in config.FLOW_IDS.items():
-                        if msg.get("flow_id") == flow_id and flow_id > 0:
-                            result["messages_sent"][msg_type] += 1
-                            break
+                logger.info(f"[MODO TESTE] {total_prepared} mensagens preparadas mas NÃO enviadas (dry-run / SEND_MESSAGES=false)")
+                result["messages_sent"].update(prepared_by_type)
         else:
             logger.info("Nenhuma mensagem para enviar")
         
         # Salvar resultados
-        data_dir = Path(config.DATA_DIR)
-        data_dir.mkdir(parents=True, exist_ok=True)
+        trace.finish()
+        result["trace"] = trace.to_dict()
+        write_json_atomic(output_path, result, indent=2)
+        tracing.write_trace_log(trace, job="check_accounts", date=hoje.isoformat())
+        logger.info("Tempo por etapa: " + ", ".join(
+            f"{child.name}={child.duration:.2f}s" for child in trace.children
+        ))
         
-        with open(config.ACCOUNTS_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"Verificação concluída! Resultados salvos em {config.ACCOUNTS_JSON_PATH}")
+        logger.info(f"Verificação concluída! Resultados salvos em {output_path}")
         
         # Resumo
         total_accounts = sum(r["with_user_info"] for r in result["accounts"].values())
@@ -413,15 +647,20 @@ def check_accounts_and_birthdays():
         logger.info(f"Mensagens enviadas: {sum(result['messages_sent'].values())}")
         
         return result
-        
+    
     except Exception as e:
         logger.error(f"Erro durante a verificação: {e}", exc_info=True)
         raise
+    finally:
+        users.close()
+        if outbox is not None:
+            outbox.close()
 
 
 if __name__ == "__main__":
     try:
-        result = check_accounts_and_birthdays()
+        with metrics.track_job("check_accounts"):
+            result = check_accounts_and_birthdays()
         sys.exit(0)
     except Exception as e:
         logger.error(f"Falha na execução: {e}", exc_info=True)
@@ -0,0 +1,248 @@
+"""
+Índice de clientes da verificação diária
+Combina o snapshot semanal com um cache LRU persistido entre execuções e uma
+busca pontual na NextFit para clientes que se cadastraram depois da última coleta.
+"""
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.models import CLIENT_API_ALIASES, Client, FieldResolver
+from scripts.collect_users import parse_users_page
+from scripts import http_client
+from scripts.snapshots import read_json_snapshot, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ClientCache:
+    """
+    Cache LRU de clientes buscados sob demanda, com tamanho máximo e validade
+    read_only: save() não grava (processos que compartilham o arquivo, ex: backfill)
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: Optional[int] = None,
+                 ttl_hours: Optional[float] = None, read_only: bool = False):
+        self.path = path or config.CLIENT_CACHE_PATH
+        self.read_only = read_only
+        self.max_size = max_size if max_size is not None else config.CLIENT_CACHE_SIZE
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else config.CLIENT_CACHE_TTL_HOURS)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, **kwargs) -> "ClientCache":
+        cache = cls(path, **kwargs)
+        data, _ = read_json_snapshot(cache.path)
+        now = datetime.now()
+        expired = 0
+        # Entradas gravadas da menos para a mais recentemente usada
+        for entry in (data or {}).get("clients", []):
+            try:
+                fetched_at = datetime.fromisoformat(entry["fetched_at"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if now - fetched_at > cache.ttl:
+                expired += 1
+                continue
+            client = Client.from_dict(entry["client"])
+            cache._entries[str(client.id)] = (client, fetched_at)
+        cache._evict()
+        if expired:
+            cache._dirty = True
+        logger.debug(f"Cache de clientes: {len(cache._entries)} entradas carregadas, {expired} expiradas")
+        return cache
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._dirty = True
+
+    def get(self, client_id) -> Optional[Client]:
+        key = str(client_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if datetime.now() - entry[1] > self.ttl:
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, client: Client):
+        with self._lock:
+            key = str(client.id)
+            self._entries[key] = (client, datetime.now())
+            self._entries.move_to_end(key)
+            self._dirty = True
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def save(self):
+        """Grava o cache (atômico) se houve alteração"""
+        with self._lock:
+            if self.read_only or not self._dirty:
+                return
+            clients = [
+                {"client": client.to_dict(), "fetched_at": fetched_at.isoformat()}
+                for client, fetched_at in self._entries.values()
+            ]
+            self._dirty = False
+        write_json_atomic(self.path, {"clients": clients})
+
+
+class LookupMismatch(Exception):
+    """A busca por id devolveu outros clientes: a API não aplicou o filtro"""
+
+
+def fetch_client(session, client_id) -> Optional[Client]:
+    """
+    Busca um único cliente na NextFit; retorna None se não encontrado
+
+    Raises:
+        LookupMismatch: a resposta trouxe clientes, mas nenhum com o id pedido
+    """
+    url = f"{config.BASE_URL}{config.ENDPOINT_CLIENTE}"
+    params = {
+        config.CLIENTE_ID_PARAM: client_id,
+        "Skip": 0,
+        "Take": 1,
+        "version": config.API_VERSION
+    }
+    response = http_client.request("nextfit", "GET", url, session=session,
+                                   headers=config.API_HEADERS, params=params)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+
+    users_list, _ = parse_users_page(response.json())
+    resolver = FieldResolver(CLIENT_API_ALIASES)
+    for user in users_list or []:
+        client = Client.from_api(user, resolver)
+        # Não confiar que a API aplicou o filtro: aceitar apenas o id pedido
+        if str(client.id) == str(client_id):
+            return client
+    if users_list:
+        raise LookupMismatch(f"busca pelo cliente {client_id} devolveu {len(users_list)} outro(s) cliente(s)")
+    return None
+
+
+class ClientJoinIndex:
+    """
+    Índice de clientes de uma execução, compartilhado por todas as janelas
+
+    Cada id é resolvido uma única vez: primeiro no snapshot (ClientStore,
+    BinarySnapshot, lista ou dicionário), depois no cache LRU e, por fim, na
+    NextFit (até config.CLIENT_LOOKUP_MAX_PER_RUN buscas por execução). Após
+    config.CLIENT_LOOKUP_MAX_MISMATCHES respostas seguidas com outro cliente (a API
+    ignorou o filtro por id), a busca é desligada pelo resto da execução.
+    """
+
+    def __init__(self, source, session=None, cache: Optional[ClientCache] = None,
+                 fetch_missing: Optional[bool] = None, max_fetches: Optional[int] = None):
+        if hasattr(source, "get_many") or isinstance(source, dict):
+            self._source = source
+        else:
+            self._source = {str(user.get("id")): user for user in source}
+        self.session = session
+        self.cache = cache
+        self.fetch_missing = config.CLIENT_LOOKUP_ENABLED if fetch_missing is None else fetch_missing
+        self.max_fetches = config.CLIENT_LOOKUP_MAX_PER_RUN if max_fetches is None else max_fetches
+        self._resolved: Dict[str, Optional[Client]] = {}
+        self._resolve_lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._fetches = 0
+        self._mismatches = 0
+        self.stats = {"snapshot": 0, "cache": 0, "fetched": 0, "not_found": 0, "fetch_errors": 0, "mismatches": 0}
+
+    def _from_source(self, keys) -> Dict[str, Dict]:
+        if hasattr(self._source, "get_many"):
+            return self._source.get_many(keys)
+        return {key: self._source[key] for key in keys if key in self._source}
+
+    def _fetch(self, key: str) -> Optional[Client]:
+        """Busca na NextFit (sem o lock da resolução); o orçamento já foi reservado em get_many"""
+        if not self.fetch_missing:
+            return None
+        try:
+            client = fetch_client(self.session, key)
+        except LookupMismatch as e:
+            with self._resolve_lock:
+                self.stats["mismatches"] += 1
+                self._mismatches += 1
+                if self.fetch_missing and self._mismatches >= config.CLIENT_LOOKUP_MAX_MISMATCHES:
+                    self.fetch_missing = False
+                    logger.warning(f"Busca de clientes desativada nesta execução: {self._mismatches} respostas "
+                                   f"seguidas sem o cliente pedido ({e}); confira NEXTFIT_ENDPOINT_CLIENTE e "
+                                   f"NEXTFIT_CLIENTE_ID_PARAM")
+            return None
+        except Exception as e:
+            logger.warning(f"Erro ao buscar cliente {key} na NextFit: {e}")
+            with self._resolve_lock:
+                self.stats["fetch_errors"] += 1
+            return None
+        with self._resolve_lock:
+            self._mismatches = 0
+            self.stats["fetched" if client else "not_found"] += 1
+            if client and self.cache is not None:
+                self.cache.put(client)
+        return client
+
+    def get_many(self, client_ids: Iterable) -> Dict[str, Client]:
+        """Resolve vários ids; retorna dicionário id (string) -> Client apenas dos encontrados"""
+        keys = {str(client_id) for client_id in client_ids if client_id is not None}
+        # Janelas em paralelo pedem os mesmos ids: snapshot e cache são consultados sob o lock,
+        # e cada id ausente vira uma busca em voo (Future) que as outras janelas aguardam,
+        # de modo que cada id é buscado na NextFit uma única vez por execução sem que o
+        # HTTP de uma janela bloqueie as demais
+        with self._resolve_lock:
+            pending = [key for key in keys if key not in self._resolved and key not in self._in_flight]
+            to_fetch = self._resolve(pending) if pending else []
+            for key in to_fetch:
+                self._in_flight[key] = Future()
+            waiting = [self._in_flight[key] for key in keys if key in self._in_flight and key not in to_fetch]
+
+        for key in to_fetch:
+            client = self._fetch(key)
+            with self._resolve_lock:
+                self._resolved[key] = client
+                future = self._in_flight.pop(key)
+            future.set_result(client)
+        for future in waiting:
+            future.result()
+
+        with self._resolve_lock:
+            return {key: self._resolved[key] for key in keys if self._resolved.get(key) is not None}
+
+    def _resolve(self, pending) -> List[str]:
+        """Resolve pelo snapshot e pelo cache; retorna os ids a buscar na NextFit"""
+        for key, user in self._from_source(pending).items():
+            self._resolved[str(key)] = user if isinstance(user, Client) else Client.from_dict(user)
+            self.stats["snapshot"] += 1
+
+        to_fetch = []
+        for key in pending:
+            if key in self._resolved:
+                continue
+            client = self.cache.get(key) if self.cache is not None else None
+            if client is not None:
+                self.stats["cache"] += 1
+            elif self.fetch_missing and self.session is not None and self._fetches < self.max_fetches:
+                self._fetches += 1
+                to_fetch.append(key)
+                continue
+            self._resolved[key] = client
+        return to_fetch
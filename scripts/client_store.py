@@ -0,0 +1,437 @@
+"""
+Armazenamento dos clientes da NextFit em SQLite
+Substitui a leitura completa do users.json: a verificação diária faz apenas
+consultas pontuais (por id, telefone ou dia/mês de aniversário) usando índices.
+O users.json continua disponível como exportação para compatibilidade.
+
+Cada promoção de coleta gera uma nova geração do snapshot, gravada em uma única
+transação. O banco roda em modo WAL: a coleta escreve sem bloquear a verificação
+diária, que fixa (pin) a última geração completa durante toda a execução.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.birthdays import build_birthday_index, month_day, normalize_birth_date
+from scripts.snapshots import read_json_snapshot, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    id TEXT PRIMARY KEY,
+    nome TEXT NOT NULL DEFAULT '',
+    telefone TEXT NOT NULL DEFAULT '',
+    telefone_normalizado TEXT NOT NULL DEFAULT '',
+    data_nascimento TEXT NOT NULL DEFAULT '',
+    birth_date TEXT NOT NULL DEFAULT '',
+    birth_month INTEGER,
+    birth_day INTEGER,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_clients_phone ON clients (telefone_normalizado);
+CREATE INDEX IF NOT EXISTS idx_clients_birthday ON clients (birth_month, birth_day);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished_at TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    new INTEGER NOT NULL,
+    changed INTEGER NOT NULL,
+    removed INTEGER NOT NULL,
+    unchanged INTEGER NOT NULL,
+    duration_seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS staging_clients (
+    run_id TEXT NOT NULL,
+    skip INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (run_id, skip, position)
+);
+"""
+
+_COLUMNS = (
+    "id", "nome", "telefone", "telefone_normalizado", "data_nascimento",
+    "birth_date", "birth_month", "birth_day", "content_hash",
+)
+_INSERT_SQL = (
+    f"INSERT OR REPLACE INTO clients ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_COLUMNS))})"
+)
+
+# Limite de parâmetros por consulta IN (o SQLite antigo aceita no máximo 999)
+_MAX_IN_PARAMS = 500
+
+
+def normalize_phone(phone: str) -> str:
+    """Remove caracteres não numéricos do telefone (mantendo o +)"""
+    return ''.join(c for c in (phone or "") if c.isdigit() or c == '+')
+
+
+def content_hash(user: Dict) -> str:
+    """Hash do conteúdo relevante do cliente, usado para detectar alterações entre coletas"""
+    payload = "\x1f".join(str(user.get(field) or "") for field in ("nome", "telefone", "data_nascimento"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _restore_id(value: str):
+    """Ids numéricos voltam como int, como no users.json"""
+    return int(value) if value.isdigit() else value
+
+
+class ClientStore:
+    """Repositório de clientes com chave primária por id e índices por telefone e aniversário"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.USERS_DB_PATH
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # A mesma conexão é usada pelas threads das janelas; o lock serializa o acesso
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._pinned = False
+        with self._lock:
+            # WAL: leitores e escritor (coleta) não se bloqueiam
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """Atualiza bancos criados por versões anteriores (colunas birth_date e content_hash)"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(clients)")}
+        if "content_hash" not in columns:
+            # Sem hash, todos os registros contam como alterados na próxima sincronização
+            with self._conn:
+                self._conn.execute("ALTER TABLE clients ADD COLUMN content_hash TEXT")
+        if "birth_date" in columns:
+            return
+        with self._conn:
+            self._conn.execute("ALTER TABLE clients ADD COLUMN birth_date TEXT NOT NULL DEFAULT ''")
+            rows = self._conn.execute("SELECT id, data_nascimento FROM clients").fetchall()
+            updates = []
+            invalid_birth_dates = 0
+            for row in rows:
+                birth_date, invalid = normalize_birth_date(row["data_nascimento"])
+                birth_month, birth_day = month_day(birth_date)
+                updates.append((birth_date, birth_month, birth_day, row["id"]))
+                invalid_birth_dates += invalid
+            self._conn.executemany(
+                "UPDATE clients SET birth_date = ?, birth_month = ?, birth_day = ? WHERE id = ?", updates
+            )
+            self._set_meta("invalid_birth_dates", str(invalid_birth_dates))
+
+    def close(self):
+        with self._lock:
+            if self._pinned:
+                self.release_snapshot()
+            self._conn.close()
+
+    def pin_snapshot(self) -> int:
+        """
+        Fixa a geração atual para todas as leituras seguintes desta conexão
+        Promoções feitas pela coleta enquanto o snapshot está fixado só ficam
+        visíveis depois de release_snapshot (ou close).
+
+        Returns:
+            Número da geração fixada
+        """
+        with self._lock:
+            if not self._pinned:
+                self._conn.execute("BEGIN")
+                self._pinned = True
+            return self.generation
+
+    def release_snapshot(self):
+        """Libera a geração fixada por pin_snapshot"""
+        with self._lock:
+            if self._pinned:
+                self._conn.execute("COMMIT")
+                self._pinned = False
+
+    @property
+    def generation(self) -> int:
+        """Geração do snapshot (incrementada a cada coleta promovida)"""
+        return int(self.get_meta("generation", "0"))
+
+    def _bump_generation(self):
+        generation = int(self.get_meta("generation", "0")) + 1
+        self._set_meta("generation", str(generation))
+        return generation
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @staticmethod
+    def _row_to_user(row: sqlite3.Row) -> Dict:
+        return {
+            "id": _restore_id(row["id"]),
+            "nome": row["nome"],
+            "telefone": row["telefone"],
+            "data_nascimento": row["data_nascimento"],
+            "data_nascimento_normalizada": row["birth_date"],
+        }
+
+    @staticmethod
+    def _user_to_row(user: Dict) -> tuple:
+        telefone = user.get("telefone") or ""
+        data_nascimento = user.get("data_nascimento") or ""
+        # Usuários vindos da coleta já trazem a data normalizada; os do users.json antigo não
+        if "data_nascimento_normalizada" in user:
+            birth_date = user.get("data_nascimento_normalizada") or ""
+        else:
+            birth_date, _ = normalize_birth_date(data_nascimento)
+        birth_month, birth_day = month_day(birth_date)
+        return (
+            str(user.get("id")),
+            user.get("nome") or "",
+            telefone,
+            normalize_phone(telefone),
+            data_nascimento,
+            birth_date,
+            birth_month,
+            birth_day,
+            content_hash(user),
+        )
+
+    @staticmethod
+    def _count_invalid_birth_dates(rows: List[tuple]) -> int:
+        # Datas preenchidas (coluna 4) que não puderam ser normalizadas (coluna 5)
+        return sum(1 for row in rows if row[4] and not row[5])
+
+    def replace_all(self, users: Iterable[Dict], last_updated: Optional[str] = None) -> int:
+        """Substitui todos os clientes em uma única transação (leitores veem o snapshot antigo até o commit)"""
+        started = time.monotonic()
+        rows = [self._user_to_row(user) for user in users if user.get("id")]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM clients")
+            self._conn.executemany(_INSERT_SQL, rows)
+            self._set_meta("last_updated", last_updated or datetime.now().isoformat())
+            self._set_meta("total_users", str(len(rows)))
+            self._set_meta("invalid_birth_dates", str(self._count_invalid_birth_dates(rows)))
+            self._bump_generation()
+            stats = {"total": len(rows), "new": len(rows), "changed": 0, "removed": 0, "unchanged": 0}
+            self._record_sync_run("full", stats, time.monotonic() - started)
+        return len(rows)
+
+    def sync(self, users: Iterable[Dict], last_updated: Optional[str] = None) -> Dict[str, int]:
+        """
+        Sincronização incremental com o snapshot atual
+
+        Compara os usuários coletados com os armazenados por id e hash de conteúdo
+        e grava apenas os novos/alterados, removendo os que não vieram na coleta.
+        Deve receber a coleta completa (senão os ausentes seriam removidos).
+
+        Returns:
+            Estatísticas da execução: total, new, changed, removed, unchanged
+        """
+        started = time.monotonic()
+        rows = [self._user_to_row(user) for user in users if user.get("id")]
+        with self._lock, self._conn:
+            stored = dict(self._conn.execute("SELECT id, content_hash FROM clients"))
+            seen = set()
+            upserts = []
+            new = changed = 0
+            for row in rows:
+                client_id, row_hash = row[0], row[-1]
+                seen.add(client_id)
+                if client_id not in stored:
+                    new += 1
+                    upserts.append(row)
+                elif stored[client_id] != row_hash:
+                    changed += 1
+                    upserts.append(row)
+            removed_ids = [client_id for client_id in stored if client_id not in seen]
+
+            if upserts:
+                self._conn.executemany(_INSERT_SQL, upserts)
+            for i in range(0, len(removed_ids), _MAX_IN_PARAMS):
+                chunk = removed_ids[i:i + _MAX_IN_PARAMS]
+                self._conn.execute(f"DELETE FROM clients WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+            stats = {
+                "total": len(seen),
+                "new": new,
+                "changed": changed,
+                "removed": len(removed_ids),
+                "unchanged": len(seen) - new - changed,
+            }
+            self._set_meta("last_updated", last_updated or datetime.now().isoformat())
+            self._set_meta("total_users", str(len(seen)))
+            self._set_meta("invalid_birth_dates", str(self._count_invalid_birth_dates(rows)))
+            if upserts or removed_ids:
+                self._bump_generation()
+            self._record_sync_run("incremental", stats, time.monotonic() - started)
+        return stats
+
+    def _record_sync_run(self, mode: str, stats: Dict[str, int], duration: float):
+        self._conn.execute(
+            "INSERT INTO sync_runs (finished_at, mode, total, new, changed, removed, unchanged, duration_seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(), mode, stats["total"], stats["new"], stats["changed"],
+             stats["removed"], stats["unchanged"], round(duration, 3)),
+        )
+
+    def last_sync_runs(self, limit: int = 10) -> List[Dict]:
+        """Estatísticas das últimas sincronizações (mais recente primeiro)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM sync_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def stage_page(self, run_id: str, skip: int, users: List[Dict]):
+        """Grava uma página coletada na área de staging (idempotente por run_id + skip)"""
+        rows = [
+            (run_id, skip, position, json.dumps(user, ensure_ascii=False))
+            for position, user in enumerate(users)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM staging_clients WHERE run_id = ? AND skip = ?", (run_id, skip))
+            self._conn.executemany("INSERT INTO staging_clients VALUES (?, ?, ?, ?)", rows)
+
+    def load_staged(self, run_id: str, before_skip: Optional[int] = None) -> List[Dict]:
+        """
+        Carrega as páginas já coletadas de uma execução, em ordem de Skip
+        Páginas a partir de before_skip (não confirmadas no checkpoint) são descartadas.
+        """
+        with self._lock, self._conn:
+            if before_skip is not None:
+                self._conn.execute(
+                    "DELETE FROM staging_clients WHERE run_id = ? AND skip >= ?", (run_id, before_skip)
+                )
+            rows = self._conn.execute(
+                "SELECT payload FROM staging_clients WHERE run_id = ? ORDER BY skip, position", (run_id,)
+            ).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def clear_staging(self, run_id: Optional[str] = None):
+        """Remove a área de staging de uma execução (ou de todas)"""
+        with self._lock, self._conn:
+            if run_id is None:
+                self._conn.execute("DELETE FROM staging_clients")
+            else:
+                self._conn.execute("DELETE FROM staging_clients WHERE run_id = ?", (run_id,))
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    def get(self, client_id) -> Optional[Dict]:
+        """Busca um cliente pelo id"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM clients WHERE id = ?", (str(client_id),)).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def get_many(self, client_ids: Iterable) -> Dict[str, Dict]:
+        """Busca vários clientes de uma vez; retorna dicionário id (string) -> cliente"""
+        keys = list({str(client_id) for client_id in client_ids if client_id is not None})
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _MAX_IN_PARAMS):
+                chunk = keys[i:i + _MAX_IN_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                for row in self._conn.execute(f"SELECT * FROM clients WHERE id IN ({placeholders})", chunk):
+                    found[row["id"]] = self._row_to_user(row)
+        return found
+
+    def find_by_phone(self, phone: str) -> List[Dict]:
+        """Busca clientes pelo telefone normalizado"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM clients WHERE telefone_normalizado = ? ORDER BY id",
+                (normalize_phone(phone),),
+            ).fetchall()
+        return [self._row_to_user(row) for row in rows]
+
+    def find_by_birthday(self, month: int, day: int) -> List[Dict]:
+        """Busca os clientes que fazem aniversário no dia/mês informado"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM clients WHERE birth_month = ? AND birth_day = ? ORDER BY id",
+                (month, day),
+            ).fetchall()
+        return [self._row_to_user(row) for row in rows]
+
+    def find_by_birthdays(self, keys: Iterable[Tuple[int, int]]) -> List[Dict]:
+        """Busca os aniversariantes de vários pares (mês, dia), ex.: 28/02 e 29/02"""
+        users = []
+        for month, day in keys:
+            users.extend(self.find_by_birthday(month, day))
+        return users
+
+    def iter_all(self) -> Iterator[Dict]:
+        """Percorre todos os clientes (usado na exportação)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM clients ORDER BY rowid").fetchall()
+        for row in rows:
+            yield self._row_to_user(row)
+
+    def export_json(self, path: Optional[str] = None) -> str:
+        """Exporta os clientes no formato do users.json (troca atômica, mantendo a geração anterior)"""
+        path = path or config.USERS_JSON_PATH
+        users = list(self.iter_all())
+        output_data = {
+            "generation": self.generation,
+            "last_updated": self.get_meta("last_updated"),
+            "total_users": len(users),
+            "invalid_birth_dates": int(self.get_meta("invalid_birth_dates", "0")),
+            "users": users,
+            # Índice "MM-DD" -> [ids] para consultas de aniversário sem reinterpretar datas
+            "birthday_index": build_birthday_index(users)
+        }
+        write_json_atomic(path, output_data, keep_previous=True, indent=2)
+        return path
+
+    def import_json(self, path: Optional[str] = None) -> int:
+        """Importa um users.json existente (migração do formato antigo); usa a geração anterior se preciso"""
+        path = path or config.USERS_JSON_PATH
+        data, used_path = read_json_snapshot(path)
+        if data is None:
+            raise FileNotFoundError(f"Nenhum snapshot disponível em {path}")
+        return self.replace_all(data.get("users", []), data.get("last_updated"))
+
+
+def open_client_store(path: Optional[str] = None, pin: bool = False) -> ClientStore:
+    """
+    Abre o repositório de clientes
+    Se o banco ainda estiver vazio e existir um users.json, importa-o uma única vez.
+    Com pin=True, a última geração completa fica fixada até o close().
+    """
+    store = ClientStore(path)
+    if store.count() == 0:
+        try:
+            total = store.import_json(config.USERS_JSON_PATH)
+            logger.info(f"Importados {total} usuários de {config.USERS_JSON_PATH} para {store.path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Erro ao importar {config.USERS_JSON_PATH}: {e}", exc_info=True)
+    if pin:
+        store.pin_snapshot()
+    return store
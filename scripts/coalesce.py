@@ -0,0 +1,167 @@
+"""
+Agrupamento das mensagens antes do envio
+Um cliente com várias contas na mesma janela (ou vários clientes com o mesmo
+telefone) recebe um único flow por tipo de mensagem: as mensagens são agrupadas
+por telefone normalizado e tipo, e os campos são combinados conforme
+config.MESSAGE_COALESCE_RULES (ex: soma dos valores, lista dos planos).
+"""
+import os
+import sys
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.client_store import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Separador dos ids de clientes/contas agrupados (entra na chave da outbox)
+ID_SEPARATOR = "+"
+
+
+def _to_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    return float(str(value).replace(",", "."))
+
+
+def _merge_values(values: List, rule: str):
+    present = [value for value in values if value not in (None, "")]
+    if not present:
+        return values[0] if values else ""
+    if rule == "sum":
+        try:
+            return round(sum(_to_number(value) for value in present), 2)
+        except (TypeError, ValueError):
+            rule = "join"
+    if rule == "join":
+        unique = list(OrderedDict.fromkeys(str(value) for value in present))
+        return config.MESSAGE_COALESCE_SEPARATOR.join(unique)
+    if rule == "min":
+        return min(present, key=str)
+    if rule == "max":
+        return max(present, key=str)
+    if rule == "last":
+        return present[-1]
+    return present[0]
+
+
+def _join_ids(values) -> str:
+    ids = sorted({str(value) for value in values if value not in (None, "")})
+    return ID_SEPARATOR.join(ids)
+
+
+def merge_messages(messages: List[Dict], rules: Optional[Dict[str, str]] = None) -> Dict:
+    """Combina mensagens do mesmo telefone e tipo em uma só"""
+    if len(messages) == 1:
+        return messages[0]
+    if rules is None:
+        rules = config.MESSAGE_COALESCE_RULES
+
+    # As regras são definidas por campo lógico (campo1..campo5); o payload usa o nome configurado na API
+    rule_by_field = {
+        field_name: rules.get(campo, "first")
+        for campo, field_name in config.MESSAGE_CUSTOM_FIELDS.items() if field_name
+    }
+    field_names = list(OrderedDict.fromkeys(
+        name for msg in messages for name in msg.get("field_mappings", {})
+    ))
+    field_mappings = {
+        name: _merge_values([msg.get("field_mappings", {}).get(name) for msg in messages],
+                            rule_by_field.get(name, "first"))
+        for name in field_names
+    }
+
+    first = messages[0]
+    merged = dict(first)
+    merged["field_mappings"] = field_mappings
+    merged["cliente_id"] = _join_ids(msg.get("cliente_id") for msg in messages)
+    merged["conta_id"] = _join_ids(msg.get("conta_id") for msg in messages) or None
+    merged["coalesced"] = len(messages)
+    # Contas cobertas pelo envio (registradas na outbox, fora do payload)
+    merged["members"] = [{"cliente_id": msg.get("cliente_id"), "conta_id": msg.get("conta_id")} for msg in messages]
+    return merged
+
+
+def with_coalesce_key(msg: Dict) -> Dict:
+    """
+    Marca uma mensagem agrupada com o telefone normalizado do grupo
+
+    A outbox usa o telefone na chave do envio agrupado e registra cada conta
+    coberta (members) com a chave individual (ver outbox.outbox_key). Mensagens
+    de uma conta só não recebem a marca e mantêm a chave (data, cliente, conta, flow).
+    """
+    phone = normalize_phone(msg.get("phone"))
+    if phone:
+        msg = dict(msg, coalesce_key=phone)
+    return msg
+
+
+class Coalescer:
+    """
+    Etapa de agrupamento entre a preparação e o envio
+
+    add() acumula as mensagens; flush() emite uma mensagem por grupo
+    (telefone normalizado, tipo de mensagem), na ordem do primeiro item de cada grupo.
+    Com mais de max_pending mensagens retidas (config.MESSAGE_COALESCE_MAX_PENDING),
+    add() emite os grupos mais antigos na hora: a memória não cresce com a janela e a
+    espera da fila de envio chega a quem busca as páginas. Uma conta do mesmo telefone
+    que chegue depois vira outro envio. Desativado (MESSAGE_COALESCE_ENABLED=false),
+    add() emite cada mensagem na hora.
+
+    delivered(msg) (padrão: emit.delivered, ex: OutboxEmitter) indica contas já
+    entregues hoje: elas saem do grupo antes do agrupamento, e um grupo sem
+    contas restantes não é emitido.
+    """
+
+    def __init__(self, emit: Callable[[Dict], None], rules: Optional[Dict[str, str]] = None,
+                 enabled: Optional[bool] = None, delivered: Optional[Callable[[Dict], bool]] = None,
+                 max_pending: Optional[int] = None):
+        self.emit = emit
+        self.delivered = delivered if delivered is not None else getattr(emit, "delivered", None)
+        self.rules = rules
+        self.enabled = config.MESSAGE_COALESCE_ENABLED if enabled is None else enabled
+        self.max_pending = max(1, config.MESSAGE_COALESCE_MAX_PENDING if max_pending is None else max_pending)
+        self.received = 0
+        self.emitted = 0
+        self.merged = 0
+        self.pending = 0
+        self._groups: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+
+    def add(self, msg: Dict):
+        self.received += 1
+        if not self.enabled:
+            self.emitted += 1
+            self.emit(msg)
+            return
+        key = (normalize_phone(msg.get("phone")), msg.get("message_type") or msg.get("flow_id"))
+        self._groups.setdefault(key, []).append(msg)
+        self.pending += 1
+        while self.pending > self.max_pending:
+            _, messages = self._groups.popitem(last=False)
+            self.pending -= len(messages)
+            self._emit_group(messages)
+
+    def _emit_group(self, messages: List[Dict]) -> bool:
+        if self.delivered is not None:
+            messages = [msg for msg in messages if not self.delivered(msg)]
+            if not messages:
+                return False
+        if len(messages) == 1:
+            self.emit(messages[0])
+        else:
+            logger.debug(f"{len(messages)} mensagens agrupadas para {messages[0].get('phone')} ({messages[0].get('message_type')})")
+            self.emit(with_coalesce_key(merge_messages(messages, self.rules)))
+            self.merged += len(messages) - 1
+        self.emitted += 1
+        return True
+
+    def flush(self) -> int:
+        """Emite os grupos ainda retidos; retorna quantos foram emitidos nesta chamada"""
+        groups, self._groups = self._groups, OrderedDict()
+        self.pending = 0
+        return sum(1 for messages in groups.values() if self._emit_group(messages))
+
@@ -1,23 +1,31 @@
 """
 Script para coletar todos os usuários da API NextFit
 Executa todo domingo às 2h da manhã
-CRÍTICO: Sempre deleta o arquivo users.json existente e cria um novo do zero
+Modo incremental (padrão): compara a coleta com o snapshot armazenado e grava apenas o que mudou
+Modo completo (COLLECT_MODE=full): recria o snapshot inteiro do zero
+Em ambos os modos o snapshot anterior continua legível até a nova geração ser promovida
 """
 import os
 import sys
 import json
-import time
+import uuid
 import logging
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, Optional
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # Adicionar o diretório raiz ao path para importar config
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 import config.config as config
+from scripts import http_client, leases, metrics
+from scripts.pagination import iter_pages
+from scripts.client_store import ClientStore, open_client_store
+from scripts.models import CLIENT_API_ALIASES, Client, FieldResolver
+from scripts.snapshots import write_json_atomic
+from scripts.binary_snapshot import write_binary_snapshot
 
 # Configurar logging
 logging.basicConfig(
@@ -27,35 +35,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def create_session_with_retry():
-    """Cria uma sessão requests com retry automático"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=config.MAX_RETRIES,
-        backoff_factor=config.RETRY_DELAY,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-
-def delete_existing_users_file():
-    """Deleta o arquivo users.json existente"""
-    users_file = Path(config.USERS_JSON_PATH)
-    if users_file.exists():
-        try:
-            users_file.unlink()
-            logger.info(f"Arquivo {config.USERS_JSON_PATH} deletado com sucesso")
-        except Exception as e:
-            logger.error(f"Erro ao deletar arquivo {config.USERS_JSON_PATH}: {e}")
-            raise
-    else:
-        logger.info(f"Arquivo {config.USERS_JSON_PATH} não existe, prosseguindo...")
-
-
 def fetch_users_page(session, skip, take):
     """Busca uma página de usuários da API"""
     url = f"{config.BASE_URL}{config.ENDPOINT_CLIENTES}"
@@ -67,7 +46,8 @@ def fetch_users_page(session, skip, take):
     
     try:
         logger.info(f"Buscando usuários: Skip={skip}, Take={take}")
-        response = session.get(url, headers=config.API_HEADERS, params=params, timeout=30)
+        response = http_client.request("nextfit", "GET", url, session=session,
+                                       headers=config.API_HEADERS, params=params)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -75,135 +55,289 @@ def fetch_users_page(session, skip, take):
         raise
 
 
-def extract_user_data(user):
-    """Extrai os campos necessários de um usuário"""
-    # ID
-    user_id = user.get("id") or user.get("Id") or user.get("codigoCliente")
-    
-    # Nome
-    nome = user.get("nome") or user.get("Nome") or ""
-    
-    # Telefone - a API retorna dddFone e fone separados
-    ddd_fone = user.get("dddFone") or user.get("ddd") or ""
-    fone = user.get("fone") or user.get("telefone") or user.get("Telefone") or ""
-    
-    # Combinar DDD + telefone
-    telefone = ""
-    if ddd_fone and fone:
-        telefone = f"{ddd_fone}{fone}".strip()
-    elif fone:
-        telefone = fone.strip()
-    elif ddd_fone:
-        telefone = ddd_fone.strip()
+def extract_user_data(user, resolver=None):
+    """
+    Extrai os campos necessários de um usuário
+    Com um FieldResolver compartilhado pela coleta, as variações de chave da API
+    são resolvidas uma vez por esquema em vez de a cada registro.
+    """
+    return Client.from_api(user, resolver).to_dict()
+
+
+def parse_users_page(users_data):
+    """
+    Extrai a lista de usuários de uma página da API
     
-    # Data de nascimento
-    data_nascimento = user.get("dataNascimento") or user.get("DataNascimento") or user.get("data_nascimento") or ""
+    Returns:
+        Tupla (lista de usuários, temProximaPagina). A lista é None se o formato
+        for inesperado; temProximaPagina é None se a API não informar o campo.
+    """
+    if isinstance(users_data, list):
+        return users_data, None
+    if isinstance(users_data, dict):
+        # A API NextFit retorna: {"items": [...], "temProximaPagina": true/false}
+        users_list = users_data.get("items") or users_data.get("data") or users_data.get("usuarios") or users_data.get("clientes") or []
+        tem_proxima_pagina = None
+        if "temProximaPagina" in users_data:
+            tem_proxima_pagina = bool(users_data.get("temProximaPagina"))
+        if not users_list:
+            # Se não encontrar lista, pode ser que o objeto seja o próprio usuário
+            users_list = [users_data]
+        return users_list, tem_proxima_pagina
+    return None, None
+
+
+def load_checkpoint():
+    """
+    Carrega o checkpoint de uma coleta interrompida
+    Retorna None se não houver checkpoint válido (inexistente, de outro modo ou antigo demais).
+    """
+    checkpoint_file = Path(config.COLLECT_CHECKPOINT_PATH)
+    if not checkpoint_file.exists():
+        return None
+    try:
+        with open(checkpoint_file, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        started_at = datetime.fromisoformat(checkpoint["started_at"])
+    except Exception as e:
+        logger.warning(f"Checkpoint de coleta inválido ({e}). Iniciando nova coleta.")
+        return None
     
-    return {
-        "id": user_id,
-        "nome": nome,
-        "telefone": telefone,
-        "data_nascimento": data_nascimento
-    }
+    age_hours = (datetime.now() - started_at).total_seconds() / 3600
+    if checkpoint.get("mode") != config.COLLECT_MODE or checkpoint.get("take") != config.ITEMS_PER_PAGE:
+        logger.info("Checkpoint de coleta com configuração diferente. Iniciando nova coleta.")
+        return None
+    if age_hours > config.COLLECT_CHECKPOINT_MAX_AGE_HOURS:
+        logger.info(f"Checkpoint de coleta com {age_hours:.1f}h descartado (limite {config.COLLECT_CHECKPOINT_MAX_AGE_HOURS}h)")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)"""
+    write_json_atomic(config.COLLECT_CHECKPOINT_PATH, checkpoint)
+
+
+def clear_checkpoint():
+    """Remove o checkpoint após uma coleta concluída"""
+    checkpoint_file = Path(config.COLLECT_CHECKPOINT_PATH)
+    if checkpoint_file.exists():
+        checkpoint_file.unlink()
 
 
-def collect_all_users():
-    """Coleta todos os usuários da API NextFit com paginação"""
+def snapshot_freshness(max_age_hours: Optional[float] = None) -> Dict:
+    """
+    Verifica se o snapshot atual dispensa a coleta ao iniciar o scheduler
+
+    O snapshot é considerado fresco quando tem clientes, a última coleta
+    concluída tem menos de max_age_hours (padrão: config.SNAPSHOT_MAX_AGE_HOURS),
+    não há coleta interrompida a retomar e o snapshot binário existe (se for a
+    fonte da verificação diária).
+
+    Returns:
+        {"fresh": bool, "reason": str, "clients": int, "age_hours": float | None}
+    """
+    if max_age_hours is None:
+        max_age_hours = config.SNAPSHOT_MAX_AGE_HOURS
+    store = open_client_store()
+    try:
+        clients = store.count()
+        last_updated = store.get_meta("last_updated")
+    finally:
+        store.close()
+
+    status = {"fresh": False, "reason": "", "clients": clients, "age_hours": None}
+    if last_updated:
+        try:
+            status["age_hours"] = round((datetime.now() - datetime.fromisoformat(last_updated)).total_seconds() / 3600, 2)
+        except ValueError:
+            pass
+
+    if not clients:
+        status["reason"] = "snapshot vazio"
+    elif status["age_hours"] is None:
+        status["reason"] = "data da última coleta desconhecida"
+    elif max_age_hours <= 0 or status["age_hours"] > max_age_hours:
+        status["reason"] = f"última coleta há {status['age_hours']:.1f}h (limite {max_age_hours}h)"
+    elif load_checkpoint() is not None:
+        status["reason"] = "coleta interrompida a retomar"
+    elif config.USERS_BACKEND == "binary" and not Path(config.USERS_BIN_PATH).exists():
+        status["reason"] = f"snapshot binário {config.USERS_BIN_PATH} ausente"
+    else:
+        status["fresh"] = True
+        status["reason"] = f"última coleta há {status['age_hours']:.1f}h"
+    return status
+
+
+def is_last_users_page(users_data) -> bool:
+    """Última página da coleta: resposta vazia, temProximaPagina = false ou menos itens que Take"""
+    if not users_data:
+        return True
+    users_list, tem_proxima_pagina = parse_users_page(users_data)
+    if not users_list:
+        return True
+    if tem_proxima_pagina is not None:
+        return not tem_proxima_pagina
+    return len(users_list) < config.ITEMS_PER_PAGE
+
+
+def dedupe_users(users):
+    """Remove ids repetidos (páginas deslocadas entre execuções), mantendo o registro mais recente"""
+    by_id = {}
+    for user in users:
+        by_id[str(user["id"])] = user
+    return list(by_id.values())
+
+
+def collect_all_users(prefetch: Optional[int] = None):
+    """
+    Coleta todos os usuários da API NextFit com paginação
+    
+    Cada página coletada é gravada na área de staging do banco e o checkpoint
+    (run_id, próximo Skip, páginas gravadas) é atualizado. Se a coleta for
+    interrompida, a próxima execução retoma do último Skip confirmado; o
+    snapshot de clientes só é atualizado quando a coleta termina.
+    
+    Args:
+        prefetch: Páginas em voo (padrão: config.COLLECT_PREFETCH_PAGES)
+    """
     logger.info("Iniciando coleta de usuários da API NextFit")
     
-    # CRÍTICO: Deletar arquivo existente antes de começar
-    delete_existing_users_file()
+    incremental = config.COLLECT_MODE == "incremental"
     
     # Garantir que o diretório existe
     data_dir = Path(config.DATA_DIR)
     data_dir.mkdir(parents=True, exist_ok=True)
     
-    session = create_session_with_retry()
-    all_users = []
-    skip = 0
-    total_collected = 0
+    store = ClientStore()
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        all_users = store.load_staged(checkpoint["run_id"], before_skip=checkpoint["next_skip"])
+        logger.info(
+            f"Retomando coleta {checkpoint['run_id']} a partir de Skip={checkpoint['next_skip']} "
+            f"({checkpoint['pages_written']} páginas, {len(all_users)} usuários já coletados)"
+        )
+    else:
+        store.clear_staging()
+        checkpoint = {
+            "run_id": uuid.uuid4().hex,
+            "started_at": datetime.now().isoformat(),
+            "mode": config.COLLECT_MODE,
+            "take": config.ITEMS_PER_PAGE,
+            "next_skip": 0,
+            "pages_written": 0,
+            "users_collected": 0
+        }
+        all_users = []
+    
+    session = http_client.get_session("nextfit")
+    total_collected = checkpoint["users_collected"]
+    # Variações de chave detectadas na primeira página e reutilizadas nas seguintes
+    resolver = FieldResolver(CLIENT_API_ALIASES)
+    
+    def fetch_page(skip):
+        return fetch_users_page(session, skip, config.ITEMS_PER_PAGE)
     
     try:
-        while True:
-            # Buscar página
-            users_data = fetch_users_page(session, skip, config.ITEMS_PER_PAGE)
-            
-            # Verificar se recebeu dados
-            if not users_data:
-                logger.warning(f"Nenhum dado retornado para Skip={skip}")
-                break
-            
-            # Processar resposta da API
-            # A API retorna um dicionário com chave "items" e "temProximaPagina"
-            users_list = []
-            tem_proxima_pagina = False
-            
-            if isinstance(users_data, list):
-                users_list = users_data
-            elif isinstance(users_data, dict):
-                # A API NextFit retorna: {"items": [...], "temProximaPagina": true/false}
-                users_list = users_data.get("items") or users_data.get("data") or users_data.get("usuarios") or users_data.get("clientes") or []
-                tem_proxima_pagina = users_data.get("temProximaPagina", False)
-                if not users_list and isinstance(users_data, dict):
-                    # Se não encontrar lista, pode ser que o objeto seja o próprio usuário
-                    users_list = [users_data]
-            else:
-                logger.warning(f"Formato de resposta inesperado: {type(users_data)}")
-                break
-            
-            # Se não há mais usuários, parar
-            if not users_list or len(users_list) == 0:
-                logger.info("Não há mais usuários para coletar")
-                break
-            
-            # Extrair dados dos usuários
-            for user in users_list:
-                user_data = extract_user_data(user)
-                if user_data["id"]:  # Só adicionar se tiver ID
-                    all_users.append(user_data)
-            
-            total_collected += len(users_list)
-            logger.info(f"Coletados {len(users_list)} usuários nesta página. Total acumulado: {total_collected}")
-            
-            # Verificar se há próxima página
-            # Se temProximaPagina estiver disponível, usar ele
-            # Caso contrário, verificar se recebeu menos que o Take
-            if isinstance(users_data, dict) and "temProximaPagina" in users_data:
-                if not tem_proxima_pagina:
-                    logger.info("Última página alcançada (temProximaPagina = false)")
+        # Páginas buscadas com prefetch (várias em voo) e entregues em ordem de Skip
+        with closing(iter_pages(fetch_page, config.ITEMS_PER_PAGE,
+                                prefetch=prefetch or config.COLLECT_PREFETCH_PAGES,
+                                start_skip=checkpoint["next_skip"],
+                                is_last=is_last_users_page)) as pages:
+            for skip, users_data in pages:
+                # Verificar se recebeu dados
+                if not users_data:
+                    logger.warning(f"Nenhum dado retornado para Skip={skip}")
+                    break
+                
+                users_list, tem_proxima_pagina = parse_users_page(users_data)
+                if users_list is None:
+                    logger.warning(f"Formato de resposta inesperado: {type(users_data)}")
+                    break
+                
+                # Se não há mais usuários, parar
+                if not users_list or len(users_list) == 0:
+                    logger.info("Não há mais usuários para coletar")
+                    break
+                
+                # Extrair dados dos usuários
+                page_users = []
+                for user in users_list:
+                    user_data = extract_user_data(user, resolver)
+                    if user_data["id"]:  # Só adicionar se tiver ID
+                        page_users.append(user_data)
+                all_users.extend(page_users)
+                
+                total_collected += len(users_list)
+                metrics.PAGES_FETCHED.inc(tenant=config.TENANT_ID, source="clientes")
+                logger.info(f"Coletados {len(users_list)} usuários nesta página. Total acumulado: {total_collected}")
+                
+                # Confirmar a página: staging primeiro, depois o checkpoint (só enquanto o lease é desta réplica)
+                leases.check_lease()
+                store.stage_page(checkpoint["run_id"], skip, page_users)
+                checkpoint["next_skip"] = skip + config.ITEMS_PER_PAGE
+                checkpoint["pages_written"] += 1
+                checkpoint["users_collected"] = total_collected
+                save_checkpoint(checkpoint)
+                
+                # Verificar se há próxima página
+                # Se temProximaPagina estiver disponível, usar ele
+                # Caso contrário, verificar se recebeu menos que o Take
+                if tem_proxima_pagina is not None:
+                    if not tem_proxima_pagina:
+                        logger.info("Última página alcançada (temProximaPagina = false)")
+                        break
+                elif len(users_list) < config.ITEMS_PER_PAGE:
+                    logger.info("Última página alcançada (menos itens que Take)")
                     break
-            elif len(users_list) < config.ITEMS_PER_PAGE:
-                logger.info("Última página alcançada (menos itens que Take)")
-                break
-            
-            # Próxima página
-            skip += config.ITEMS_PER_PAGE
-            
-            # Delay para não sobrecarregar a API
-            delay = getattr(config, 'REQUEST_DELAY', 1.0)
-            logger.debug(f"Aguardando {delay}s antes da próxima requisição...")
-            time.sleep(delay)
         
-        # Salvar todos os usuários em um novo arquivo JSON
-        output_data = {
-            "last_updated": datetime.now().isoformat(),
-            "total_users": len(all_users),
-            "users": all_users
-        }
+        if incremental and not all_users:
+            # Uma coleta vazia removeria todos os clientes do snapshot
+            logger.warning("Nenhum usuário coletado. Snapshot atual mantido sem alterações.")
+            clear_checkpoint()
+            store.clear_staging(checkpoint["run_id"])
+            return False
+        
+        all_users = dedupe_users(all_users)
+        
+        # Coleta completa: promover para o repositório SQLite (em uma única transação)
+        last_updated = datetime.now().isoformat()
+        store_path = Path(store.path).resolve()
+        logger.info(f"Salvando dados em: {store_path}")
+        if incremental:
+            stats = store.sync(all_users, last_updated)
+            logger.info(
+                f"Sincronização incremental: {stats['new']} novos, {stats['changed']} alterados, "
+                f"{stats['removed']} removidos, {stats['unchanged']} sem alteração"
+            )
+            has_changes = bool(stats["new"] or stats["changed"] or stats["removed"])
+        else:
+            store.replace_all(all_users, last_updated)
+            has_changes = True
+        invalid_birth_dates = int(store.get_meta("invalid_birth_dates", "0"))
+        if invalid_birth_dates:
+            logger.warning(f"{invalid_birth_dates} usuários com data de nascimento inválida (ignorados nos aniversários)")
         
-        # Garantir que o diretório existe
-        users_file_path = Path(config.USERS_JSON_PATH)
-        users_file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Exportação JSON para compatibilidade (só reescrita quando algo mudou)
+        if config.EXPORT_USERS_JSON and (has_changes or not Path(config.USERS_JSON_PATH).exists()):
+            export_path = Path(store.export_json(config.USERS_JSON_PATH)).resolve()
+            logger.info(f"✓ Exportação JSON salva em: {export_path}")
         
-        # Mostrar caminho completo onde será salvo
-        full_path = users_file_path.resolve()
-        logger.info(f"Salvando dados em: {full_path}")
+        # Snapshot binário compacto (leitura via mmap na verificação diária)
+        if config.WRITE_BINARY_SNAPSHOT and (has_changes or not Path(config.USERS_BIN_PATH).exists()):
+            meta = {
+                "last_updated": store.get_meta("last_updated"),
+                "invalid_birth_dates": invalid_birth_dates
+            }
+            write_binary_snapshot(store.iter_all(), config.USERS_BIN_PATH, store.generation, meta)
+            logger.info(f"✓ Snapshot binário salvo em: {Path(config.USERS_BIN_PATH).resolve()}")
         
-        with open(config.USERS_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
+        store.clear_staging(checkpoint["run_id"])
+        clear_checkpoint()
+        metrics.record_snapshot(store.count(), (store.path, config.USERS_JSON_PATH, config.USERS_BIN_PATH))
         
-        logger.info(f"✓ Coleta concluída! Total de {len(all_users)} usuários salvos")
-        logger.info(f"✓ Arquivo salvo em: {full_path}")
+        logger.info(f"✓ Coleta concluída! Total de {len(all_users)} usuários salvos (geração {store.generation})")
+        logger.info(f"✓ Banco salvo em: {store_path}")
         return True
         
     except Exception as e:
@@ -224,12 +358,17 @@ def collect_all_users():
                 logger.warning(f"Dados parciais salvos em {backup_path}")
             except Exception as backup_error:
                 logger.error(f"Erro ao salvar backup: {backup_error}")
+        if Path(config.COLLECT_CHECKPOINT_PATH).exists():
+            logger.warning(f"Checkpoint mantido: a próxima coleta retoma a partir de Skip={checkpoint['next_skip']}")
         raise
+    finally:
+        store.close()
 
 
 if __name__ == "__main__":
     try:
-        success = collect_all_users()
+        with metrics.track_job("collect_users"):
+            success = collect_all_users()
         sys.exit(0 if success else 1)
     except Exception as e:
         logger.error(f"Falha na execução: {e}", exc_info=True)
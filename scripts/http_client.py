@@ -0,0 +1,244 @@
+"""
+Camada HTTP compartilhada pelas chamadas à NextFit e à API de mensagens
+Cada provedor tem uma sessão própria (pool de conexões keep-alive dimensionado
+por config.HTTP_PROVIDERS, gzip, timeouts de conexão e leitura separados) e todas
+as requisições passam por request(): rate limit do provedor, retries limitados
+por um orçamento global e hooks que registram latência, bytes, status e
+tentativas por endpoint.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts.rate_limiter import get_limiter, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """
+    Orçamento global de retries (compartilhado por todos os provedores)
+
+    Cada requisição deposita `ratio` tokens e cada retry consome um; o saldo é
+    limitado a `max_tokens`. Em uma falha generalizada os retries ficam
+    limitados a cerca de `ratio` das requisições, em vez de multiplicar a carga.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = float(ratio)
+        self.max_tokens = max(1.0, float(max_tokens))
+        self.tokens = self.max_tokens
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+        return False
+
+
+retry_budget = RetryBudget(config.HTTP_RETRY_BUDGET_RATIO, config.HTTP_RETRY_BUDGET_MAX)
+
+
+class BudgetedRetry(Retry):
+    """Retry do urllib3 que só repete enquanto houver saldo no orçamento global"""
+
+    # 429 fica com request(), que ajusta o token bucket do provedor (nunca repetido aqui)
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method, url, response=response, error=error,
+                                      _pool=_pool, _stacktrace=_stacktrace)
+        if not retry_budget.withdraw():
+            logger.warning(f"Orçamento de retries esgotado; desistindo de {method} {url}")
+            reason = error or ResponseError(f"orçamento de retries esgotado (status {getattr(response, 'status', None)})")
+            raise MaxRetryError(_pool, url, reason)
+        return new_retry
+
+
+@dataclass(slots=True)
+class RequestRecord:
+    """Registro de uma requisição entregue aos hooks"""
+    provider: str
+    method: str
+    endpoint: str
+    status: Optional[int]
+    latency: float
+    bytes: int
+    attempts: int
+    throttled: int
+    error: Optional[str] = None
+
+
+_hooks: List[Callable[[RequestRecord], None]] = []
+
+
+def add_hook(hook: Callable[[RequestRecord], None]):
+    """Registra uma função chamada após cada requisição (ex: métricas)"""
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[RequestRecord], None]):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+class EndpointStats:
+    """Hook padrão: totais por (provedor, endpoint) desde o início do processo"""
+
+    def __init__(self):
+        self._stats: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record: RequestRecord):
+        key = (record.provider, record.endpoint)
+        with self._lock:
+            stats = self._stats.setdefault(key, {
+                "requests": 0, "errors": 0, "retries": 0, "throttled": 0, "bytes": 0,
+                "latency_total": 0.0, "latency_max": 0.0, "status": {},
+            })
+            stats["requests"] += 1
+            stats["retries"] += max(0, record.attempts - 1)
+            stats["throttled"] += record.throttled
+            stats["bytes"] += record.bytes
+            stats["latency_total"] += record.latency
+            stats["latency_max"] = max(stats["latency_max"], record.latency)
+            status = str(record.status) if record.status is not None else "erro"
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            if record.error or (record.status or 0) >= 400:
+                stats["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Cópia dos totais, com a latência média calculada"""
+        with self._lock:
+            result = {}
+            for (provider, endpoint), stats in self._stats.items():
+                item = dict(stats, status=dict(stats["status"]))
+                item["latency_avg"] = round(stats["latency_total"] / stats["requests"], 4)
+                result[f"{provider} {endpoint}"] = item
+            return result
+
+
+endpoint_stats = EndpointStats()
+add_hook(endpoint_stats)
+
+
+def create_session(provider: str) -> requests.Session:
+    """Cria a sessão de um provedor conforme config.HTTP_PROVIDERS"""
+    settings = config.HTTP_PROVIDERS[provider]
+    session = requests.Session()
+    retry_strategy = BudgetedRetry(
+        total=settings["retries"],
+        backoff_factor=settings["backoff"],
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=settings["methods"],
+        # Sem isso o urllib3 repete qualquer status com Retry-After por conta própria
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=1,
+                          pool_maxsize=max(1, settings["pool_size"]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+_sessions: Dict[Tuple[str, str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(provider: str) -> requests.Session:
+    """Sessão compartilhada do provedor no tenant corrente (criada na primeira chamada)"""
+    key = (config.TENANT_ID, provider)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = create_session(provider)
+    return session
+
+
+def _transport_retries(response: requests.Response) -> int:
+    """Quantas vezes o urllib3 repetiu a requisição (erros 5xx/conexão) antes desta resposta"""
+    retries = getattr(response.raw, "retries", None)
+    return len(retries.history) if retries is not None and retries.history else 0
+
+
+def _emit(record: RequestRecord):
+    for hook in list(_hooks):
+        try:
+            hook(record)
+        except Exception as e:
+            logger.error(f"Erro em hook HTTP: {e}", exc_info=True)
+
+
+def request(provider: str, method: str, url: str, session: Optional[requests.Session] = None,
+            max_retries: Optional[int] = None, **kwargs) -> requests.Response:
+    """
+    Executa uma requisição pelo transporte do provedor
+
+    Respeita o token bucket do provedor; respostas 429 reduzem a taxa e são
+    repetidas até max_retries vezes (dentro do orçamento global de retries).
+    Só respostas 2xx/3xx aumentam a taxa; 4xx e 5xx a mantêm.
+    A última resposta é devolvida para o chamador tratar (raise_for_status);
+    response.attempts traz o total de tentativas (429 + retries do urllib3).
+    """
+    if max_retries is None:
+        max_retries = config.MAX_RETRIES
+    if session is None:
+        session = get_session(provider)
+    kwargs.setdefault("timeout", (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT))
+    limiter = get_limiter(provider)
+    endpoint = urlparse(url).path
+    attempts = 0
+    throttled = 0
+    started = time.perf_counter()
+    retry_budget.deposit()
+    while True:
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _emit(RequestRecord(provider, method, endpoint, None, time.perf_counter() - started,
+                                0, attempts + 1, throttled, str(e)))
+            raise
+        attempts += 1 + _transport_retries(response)
+        response.attempts = attempts
+        if response.status_code != 429:
+            if response.status_code < 400:
+                limiter.on_success()
+            break
+        throttled += 1
+        limiter.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+        if throttled > max_retries or not retry_budget.withdraw():
+            break
+        response.close()
+
+    _emit(RequestRecord(provider, method, endpoint, response.status_code, time.perf_counter() - started,
+                        len(response.content), attempts, throttled))
+    return response
@@ -0,0 +1,329 @@
+"""
+Coordenação entre réplicas do scheduler pelo volume compartilhado
+Cada execução de um job (ex: check_accounts de 2024-03-10 do tenant X) tem um
+lease em SQLite (config.LEASES_DB_PATH). Só a réplica dona executa e renova o
+lease enquanto roda; as demais aguardam e assumem a execução se o lease
+expirar sem ter sido concluído (queda do nó). A outbox garante que o que já foi
+entregue não é reenviado por quem assume.
+
+As réplicas registram heartbeats na mesma base; com config.SEND_SHARDING o
+envio é dividido entre as réplicas vivas pelo hash do telefone normalizado
+(ShardAssignment), e cada réplica drena da outbox apenas o seu shard.
+
+Se o lease não puder ser renovado (outra réplica assumiu ou ele expirou), a
+execução é interrompida no próximo check_lease(): entre janelas/páginas e antes
+de cada envio.
+"""
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts import tracing
+from scripts.client_store import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+STATE_HELD = "held"
+STATE_RELEASED = "released"
+STATE_DONE = "done"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    state TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replicas (
+    replica_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL,
+    started_at TEXT NOT NULL
+);
+"""
+
+# Leases e réplicas mortas mantidos por este tempo antes da limpeza (segundos)
+_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Sinalizado pela renovação quando o lease da execução corrente é perdido
+_lease_lost: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar("lease_lost", default=None)
+
+
+class LeaseLost(Exception):
+    """O lease da execução foi perdido: outra réplica pode estar executando o job"""
+
+
+def check_lease():
+    """Interrompe a execução (LeaseLost) se o lease do job corrente foi perdido; fora de run_once não faz nada"""
+    lost = _lease_lost.get()
+    if lost is not None and lost.is_set():
+        raise LeaseLost("lease da execução perdido; interrompendo para não duplicar o trabalho de outra réplica")
+
+
+class LeaseStore:
+    """Leases nomeados e registro de réplicas vivas, em SQLite no volume compartilhado"""
+
+    def __init__(self, path: Optional[str] = None, replica_id: Optional[str] = None):
+        self.path = path or config.LEASES_DB_PATH
+        self.replica_id = replica_id or config.REPLICA_ID
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: transações explícitas (BEGIN IMMEDIATE) para ler e gravar o lease atomicamente
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def try_acquire(self, name: str, ttl: Optional[float] = None) -> str:
+        """
+        Tenta tomar o lease
+
+        Returns:
+            STATE_HELD se esta réplica ficou com o lease; STATE_DONE se a execução
+            já foi concluída; o dono atual se o lease está com outra réplica.
+        """
+        ttl = ttl or config.LEASE_TTL_SECONDS
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, state, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                if row["state"] == STATE_DONE:
+                    return STATE_DONE
+                if row["state"] == STATE_HELD and row["owner"] != self.replica_id and row["expires_at"] > now:
+                    return row["owner"]
+                if row["state"] == STATE_HELD and row["owner"] != self.replica_id:
+                    logger.warning(f"Lease '{name}' de {row['owner']} expirou; assumindo a execução")
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, state, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (name, self.replica_id, STATE_HELD, now + ttl, datetime.now().isoformat())
+            )
+        return STATE_HELD
+
+    def renew(self, name: str, ttl: Optional[float] = None) -> bool:
+        """Estende o lease; False se ele não pertence mais a esta réplica"""
+        ttl = ttl or config.LEASE_TTL_SECONDS
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE leases SET expires_at = ?, updated_at = ? WHERE name = ? AND owner = ? AND state = ?",
+                (time.time() + ttl, datetime.now().isoformat(), name, self.replica_id, STATE_HELD)
+            ).rowcount == 1
+
+    def release(self, name: str, done: bool):
+        """Libera o lease: done=True encerra a execução; False permite que outra réplica tente"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE leases SET state = ?, expires_at = ?, updated_at = ? WHERE name = ? AND owner = ?",
+                (STATE_DONE if done else STATE_RELEASED, time.time(), datetime.now().isoformat(),
+                 name, self.replica_id)
+            )
+
+    def heartbeat(self):
+        """Registra esta réplica como viva"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO replicas (replica_id, heartbeat_at, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(replica_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (self.replica_id, time.time(), datetime.now().isoformat())
+            )
+
+    def live_replicas(self, ttl: Optional[float] = None) -> List[str]:
+        """Réplicas com heartbeat recente (esta sempre incluída), em ordem estável"""
+        ttl = ttl or config.REPLICA_TTL_SECONDS
+        with self._lock:
+            rows = self._conn.execute("SELECT replica_id FROM replicas WHERE heartbeat_at > ?",
+                                      (time.time() - ttl,)).fetchall()
+        return sorted({row["replica_id"] for row in rows} | {self.replica_id})
+
+    def purge(self) -> int:
+        """Remove leases e réplicas sem atividade há mais de uma semana"""
+        cutoff = time.time() - _RETENTION_SECONDS
+        with self._transaction() as conn:
+            removed = conn.execute("DELETE FROM leases WHERE state != ? AND expires_at < ?",
+                                   (STATE_HELD, cutoff)).rowcount
+            removed += conn.execute("DELETE FROM replicas WHERE heartbeat_at < ?", (cutoff,)).rowcount
+        return removed
+
+
+class ShardAssignment:
+    """Divide os telefones entre as réplicas vivas: cada telefone pertence a exatamente uma"""
+
+    def __init__(self, replica_id: str, replicas: List[str]):
+        self.replica_id = replica_id
+        self.replicas = sorted(set(replicas) | {replica_id})
+        self.index = self.replicas.index(replica_id)
+
+    def __repr__(self):
+        return f"ShardAssignment({self.index + 1}/{len(self.replicas)})"
+
+    def owns(self, phone) -> bool:
+        if len(self.replicas) == 1:
+            return True
+        digest = hashlib.blake2b(normalize_phone(phone).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % len(self.replicas) == self.index
+
+
+def claim_owner() -> Optional[str]:
+    """Dono das reservas na outbox (None sem coordenação entre réplicas)"""
+    return config.REPLICA_ID if config.LEASES_ENABLED else None
+
+
+def send_shard() -> Optional[ShardAssignment]:
+    """Shard de envio desta réplica entre as vivas agora (None sem SEND_SHARDING)"""
+    if not (config.LEASES_ENABLED and config.SEND_SHARDING):
+        return None
+    with LeaseStore() as store:
+        return ShardAssignment(store.replica_id, store.live_replicas())
+
+
+_heartbeat_thread = None
+
+
+def start_heartbeat():
+    """Mantém o registro desta réplica vivo em uma thread daemon (apenas com LEASES_ENABLED)"""
+    global _heartbeat_thread
+    if not config.LEASES_ENABLED or _heartbeat_thread is not None:
+        return
+    store = LeaseStore()
+    store.heartbeat()
+    store.purge()
+    interval = max(1.0, config.REPLICA_TTL_SECONDS / 3)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                store.heartbeat()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao registrar heartbeat da réplica {store.replica_id}: {e}")
+
+    _heartbeat_thread = threading.Thread(target=run, name="replica-heartbeat", daemon=True)
+    _heartbeat_thread.start()
+    logger.info(f"Réplica {store.replica_id} registrada em {store.path}")
+
+
+@contextmanager
+def _renewing(store: LeaseStore, name: str):
+    """
+    Renova o lease a cada TTL/3 enquanto o bloco executa
+
+    Yields:
+        Evento sinalizado quando o lease é perdido (outra réplica o tomou ou
+        as renovações falharam até ele expirar)
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def run():
+        renewed_at = time.time()
+        while not stop.wait(max(1.0, config.LEASE_TTL_SECONDS / 3)):
+            try:
+                if not store.renew(name):
+                    logger.error(f"Lease '{name}' perdido para outra réplica durante a execução")
+                    lost.set()
+                    return
+                renewed_at = time.time()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao renovar lease '{name}': {e}")
+                if time.time() - renewed_at >= config.LEASE_TTL_SECONDS:
+                    logger.error(f"Lease '{name}' expirou sem renovação; outra réplica pode assumir")
+                    lost.set()
+                    return
+
+    thread = threading.Thread(target=tracing.propagate(run), name=f"lease-{name}", daemon=True)
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_once(job: str, fn: Callable, run_key: Optional[str] = None, wait: bool = True,
+             on_standby: Optional[Callable[[], None]] = None) -> Tuple[bool, Any]:
+    """
+    Executa fn em apenas uma réplica para esta execução do job
+
+    Args:
+        job: Nome do job (o lease é "<tenant>:<job>:<run_key>")
+        fn: Função executada pela réplica dona do lease
+        run_key: Identifica a execução (padrão: data de hoje)
+        wait: Aguardar enquanto outra réplica executa, assumindo se o lease expirar;
+              False desiste imediatamente
+        on_standby: Chamada a cada verificação enquanto outra réplica executa e ao final
+                    (ex: drenar o shard de envio desta réplica)
+
+    Returns:
+        (True, retorno de fn) se esta réplica executou; (False, None) se outra
+        réplica executou ou está executando, inclusive quando o lease foi perdido
+        no meio da execução (fn interrompida por check_lease). Sem
+        LEASES_ENABLED, sempre executa.
+    """
+    if not config.LEASES_ENABLED:
+        return True, fn()
+    name = f"{config.TENANT_ID}:{job}:{run_key or date.today().isoformat()}"
+    with LeaseStore() as store:
+        while True:
+            state = store.try_acquire(name)
+            if state == STATE_HELD:
+                break
+            if state == STATE_DONE or not wait:
+                logger.info(f"Lease '{name}' {'concluído' if state == STATE_DONE else f'com {state}'}; "
+                            f"execução ignorada nesta réplica")
+                if on_standby is not None:
+                    on_standby()
+                return False, None
+            logger.debug(f"Lease '{name}' com {state}; aguardando {config.LEASE_POLL_SECONDS}s")
+            if on_standby is not None:
+                on_standby()
+            time.sleep(config.LEASE_POLL_SECONDS)
+
+        logger.info(f"Lease '{name}' adquirido por {store.replica_id}")
+        done = False
+        try:
+            with _renewing(store, name) as lost:
+                token = _lease_lost.set(lost)
+                try:
+                    result = fn()
+                finally:
+                    _lease_lost.reset(token)
+            done = True
+            return True, result
+        except LeaseLost as e:
+            logger.warning(f"Execução de '{name}' interrompida: {e}")
+            return False, None
+        finally:
+            store.release(name, done)
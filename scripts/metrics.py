@@ -0,0 +1,313 @@
+"""
+Registro de métricas do processo (contadores, gauges e histogramas com labels)
+Exposto no formato texto do Prometheus em METRICS_PORT (/metrics) e/ou gravado
+em METRICS_FILE ao final de cada job, para uso offline.
+
+As requisições HTTP são medidas por um hook do transporte (scripts/http_client.py);
+jobs, páginas, envios e tamanho do snapshot são registrados pelos próprios scripts.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts import http_client
+
+logger = logging.getLogger(__name__)
+
+# Buckets de latência (segundos): de requisições rápidas até jobs de meia hora
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Labels de {self.name} devem ser {self.labelnames}, recebido {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: Tuple, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key: Tuple, state) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Todas as métricas no formato texto do Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Jobs (tenant: academia do job, config.TENANT_ID)
+JOB_DURATION = REGISTRY.histogram("nextfit_job_duration_seconds", "Duração dos jobs agendados", ("tenant", "job"))
+JOB_RUNS = REGISTRY.counter("nextfit_job_runs_total", "Execuções dos jobs por resultado", ("tenant", "job", "result"))
+JOB_LAST_SUCCESS = REGISTRY.gauge("nextfit_job_last_success_timestamp_seconds",
+                                  "Momento (epoch) da última execução bem-sucedida", ("tenant", "job"))
+
+# HTTP (alimentado pelo hook do transporte, na thread que fez a requisição)
+HTTP_DURATION = REGISTRY.histogram("nextfit_http_request_duration_seconds",
+                                   "Latência das requisições por endpoint (inclui retries e espera de 429)",
+                                   ("tenant", "provider", "endpoint"))
+HTTP_REQUESTS = REGISTRY.counter("nextfit_http_requests_total", "Requisições por endpoint e status",
+                                 ("tenant", "provider", "endpoint", "status"))
+HTTP_RETRIES = REGISTRY.counter("nextfit_http_retries_total", "Tentativas extras por endpoint (5xx, conexão e 429)",
+                                ("tenant", "provider", "endpoint"))
+HTTP_THROTTLED = REGISTRY.counter("nextfit_http_throttled_total", "Respostas 429 por endpoint",
+                                  ("tenant", "provider", "endpoint"))
+HTTP_BYTES = REGISTRY.counter("nextfit_http_response_bytes_total", "Bytes recebidos por endpoint",
+                              ("tenant", "provider", "endpoint"))
+
+# Coleta e verificação
+PAGES_FETCHED = REGISTRY.counter("nextfit_pages_fetched_total", "Páginas buscadas na NextFit", ("tenant", "source"))
+MESSAGES = REGISTRY.counter("nextfit_messages_total", "Mensagens enviadas por flow e resultado",
+                            ("tenant", "message_type", "flow_id", "result"))
+SEND_DURATION = REGISTRY.histogram("nextfit_message_send_duration_seconds", "Latência de cada envio de mensagem",
+                                   ("tenant", "message_type"))
+SNAPSHOT_CLIENTS = REGISTRY.gauge("nextfit_snapshot_clients", "Clientes no snapshot atual", ("tenant",))
+SNAPSHOT_BYTES = REGISTRY.gauge("nextfit_snapshot_bytes", "Tamanho dos arquivos do snapshot", ("tenant", "file"))
+
+
+def record_http_request(record: "http_client.RequestRecord"):
+    """Hook do transporte HTTP"""
+    labels = {"tenant": config.TENANT_ID, "provider": record.provider, "endpoint": record.endpoint}
+    HTTP_DURATION.observe(record.latency, **labels)
+    status = str(record.status) if record.status is not None else "erro"
+    HTTP_REQUESTS.inc(status=status, **labels)
+    if record.attempts > 1:
+        HTTP_RETRIES.inc(record.attempts - 1, **labels)
+    if record.throttled:
+        HTTP_THROTTLED.inc(record.throttled, **labels)
+    HTTP_BYTES.inc(record.bytes, **labels)
+
+
+http_client.add_hook(record_http_request)
+
+
+def record_send_result(result):
+    """Contabiliza um SendResult do envio de mensagens"""
+    message_type = result.message_type or ""
+    MESSAGES.inc(tenant=config.TENANT_ID, message_type=message_type, flow_id=result.flow_id,
+                 result="sent" if result.success else "failed")
+    SEND_DURATION.observe(result.latency, tenant=config.TENANT_ID, message_type=message_type)
+
+
+def record_snapshot(clients: int, paths: Iterable[str]):
+    """Tamanho do snapshot de clientes após uma coleta"""
+    SNAPSHOT_CLIENTS.set(clients, tenant=config.TENANT_ID)
+    for path in paths:
+        if path and Path(path).exists():
+            SNAPSHOT_BYTES.set(Path(path).stat().st_size, tenant=config.TENANT_ID, file=Path(path).name)
+
+
+class JobRun:
+    """Execução medida por track_job; skip() marca que o job não rodou nesta réplica"""
+
+    def __init__(self):
+        self.skipped = False
+
+    def skip(self):
+        self.skipped = True
+
+
+@contextmanager
+def track_job(job: str):
+    """
+    Mede a duração de um job e registra sucesso/falha
+
+    Uma execução marcada com run.skip() (ex: outra réplica é dona do lease) conta
+    como result="skipped", sem duração nem horário de último sucesso.
+    """
+    tenant = config.TENANT_ID
+    run = JobRun()
+    started = time.perf_counter()
+    try:
+        yield run
+    except Exception:
+        JOB_RUNS.inc(tenant=tenant, job=job, result="failure")
+        JOB_DURATION.observe(time.perf_counter() - started, tenant=tenant, job=job)
+        raise
+    else:
+        if run.skipped:
+            JOB_RUNS.inc(tenant=tenant, job=job, result="skipped")
+        else:
+            JOB_RUNS.inc(tenant=tenant, job=job, result="success")
+            JOB_LAST_SUCCESS.set(time.time(), tenant=tenant, job=job)
+            JOB_DURATION.observe(time.perf_counter() - started, tenant=tenant, job=job)
+    finally:
+        dump()
+
+
+def dump(path: Optional[str] = None):
+    """Grava as métricas em arquivo (config.METRICS_FILE), se configurado"""
+    path = path or config.METRICS_FILE
+    if not path:
+        return
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(REGISTRY.render(), encoding="utf-8")
+    os.replace(tmp_path, target)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics: {format % args}")
+
+
+_server = None
+
+
+def start_server(port: Optional[int] = None, host: Optional[str] = None):
+    """Expõe /metrics em uma thread daemon (config.METRICS_PORT; 0 desativa)"""
+    global _server
+    port = config.METRICS_PORT if port is None else port
+    if not port or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host or config.METRICS_HOST, port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Métricas disponíveis em http://{host or config.METRICS_HOST}:{_server.server_port}/metrics")
+    return _server
@@ -0,0 +1,189 @@
+"""
+Modelos tipados (com __slots__) para clientes e contas a receber
+Os registros da NextFit são convertidos uma única vez, na entrada; depois disso
+o código usa atributos em vez de cadeias de .get() com todas as variações de nome.
+
+A resolução dos nomes de campo é "compilada" por esquema: FieldResolver descobre
+no primeiro registro qual variação de chave a resposta usa (ex: "CodigoCliente"
+ou "codigoCliente") e a reutiliza nos registros seguintes, voltando à cadeia
+completa apenas quando a chave esperada não traz valor.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from scripts.birthdays import normalize_birth_date
+
+# Variações de nome de cada campo, em ordem de prioridade (mesma ordem das cadeias antigas)
+CLIENT_API_ALIASES = {
+    "id": ("id", "Id", "codigoCliente"),
+    "nome": ("nome", "Nome"),
+    "ddd": ("dddFone", "ddd"),
+    "fone": ("fone", "telefone", "Telefone"),
+    "data_nascimento": ("dataNascimento", "DataNascimento", "data_nascimento"),
+}
+
+# Clientes já armazenados (users.json / clients.db), incluindo variações de arquivos antigos
+CLIENT_STORED_ALIASES = {
+    "id": ("id", "Id"),
+    "nome": ("nome", "Nome"),
+    "telefone": ("telefone", "Telefone"),
+    "data_nascimento": ("data_nascimento", "DataNascimento"),
+    "data_nascimento_normalizada": ("data_nascimento_normalizada",),
+}
+
+RECEIVABLE_ALIASES = {
+    "id": ("Codigo", "codigo", "Id", "id"),
+    "cliente_id": ("CodigoCliente", "codigoCliente", "ClienteId", "clienteId", "IdCliente", "idCliente"),
+    "valor": ("Valor", "valor"),
+    "vencimento": ("DataVencimento", "dataVencimento", "vencimento"),
+    "status": ("Status", "status"),
+    "descricao": ("descricao", "Descricao"),
+}
+
+
+class FieldResolver:
+    """Resolve variações de nome de campo, memorizando a chave usada pelo esquema da resposta"""
+
+    __slots__ = ("aliases", "_keys")
+
+    def __init__(self, aliases: Dict[str, Tuple[str, ...]]):
+        self.aliases = aliases
+        self._keys: Dict[str, str] = {}
+
+    def get(self, record: Dict, field: str, default: Any = None) -> Any:
+        key = self._keys.get(field)
+        if key is not None:
+            value = record.get(key)
+            if value:
+                return value
+        for alias in self.aliases[field]:
+            value = record.get(alias)
+            if value:
+                self._keys[field] = alias
+                return value
+        return default
+
+
+_stored_client_resolver = FieldResolver(CLIENT_STORED_ALIASES)
+
+
+@dataclass(slots=True)
+class Client:
+    """Cliente da NextFit normalizado"""
+    id: Any
+    nome: str = ""
+    telefone: str = ""
+    data_nascimento: str = ""
+    data_nascimento_normalizada: str = ""
+
+    @classmethod
+    def from_api(cls, user: Dict, resolver: Optional[FieldResolver] = None) -> "Client":
+        """Constrói a partir de um item de /Pessoa/GetClientes"""
+        if resolver is None:
+            resolver = FieldResolver(CLIENT_API_ALIASES)
+        # Telefone - a API retorna dddFone e fone separados
+        ddd_fone = resolver.get(user, "ddd", "")
+        fone = resolver.get(user, "fone", "")
+
+        # Combinar DDD + telefone
+        telefone = ""
+        if ddd_fone and fone:
+            telefone = f"{ddd_fone}{fone}".strip()
+        elif fone:
+            telefone = fone.strip()
+        elif ddd_fone:
+            telefone = ddd_fone.strip()
+
+        data_nascimento = resolver.get(user, "data_nascimento", "")
+        data_nascimento_normalizada, _ = normalize_birth_date(data_nascimento)
+        return cls(
+            id=resolver.get(user, "id"),
+            nome=resolver.get(user, "nome", ""),
+            telefone=telefone,
+            data_nascimento=data_nascimento,
+            data_nascimento_normalizada=data_nascimento_normalizada,
+        )
+
+    @classmethod
+    def from_dict(cls, user: Dict) -> "Client":
+        """Constrói a partir de um cliente armazenado (users.json, clients.db ou users.bin)"""
+        resolver = _stored_client_resolver
+        data_nascimento = resolver.get(user, "data_nascimento", "")
+        normalizada = resolver.get(user, "data_nascimento_normalizada")
+        if normalizada is None and "data_nascimento_normalizada" not in user:
+            normalizada, _ = normalize_birth_date(data_nascimento)
+        return cls(
+            id=resolver.get(user, "id"),
+            nome=resolver.get(user, "nome", ""),
+            telefone=resolver.get(user, "telefone", ""),
+            data_nascimento=data_nascimento,
+            data_nascimento_normalizada=normalizada or "",
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "nome": self.nome,
+            "telefone": self.telefone,
+            "data_nascimento": self.data_nascimento,
+            "data_nascimento_normalizada": self.data_nascimento_normalizada,
+        }
+
+
+@dataclass(slots=True)
+class Receivable:
+    """Conta a receber normalizada"""
+    id: Any = None
+    cliente_id: Any = None
+    valor: Any = None
+    vencimento: Any = None
+    status: str = ""
+    descricao: str = ""
+    codigo_origem: Any = None
+    origem: Optional[str] = None
+    has_origem: bool = False
+
+    @classmethod
+    def from_api(cls, conta: Dict, resolver: Optional[FieldResolver] = None) -> "Receivable":
+        """Constrói a partir de um item de /ContaReceber (ou de um conta_data já extraído)"""
+        if resolver is None:
+            resolver = FieldResolver(RECEIVABLE_ALIASES)
+        receivable = cls(
+            id=resolver.get(conta, "id"),
+            cliente_id=resolver.get(conta, "cliente_id"),
+            valor=resolver.get(conta, "valor"),
+            vencimento=resolver.get(conta, "vencimento"),
+            status=resolver.get(conta, "status", ""),
+            descricao=resolver.get(conta, "descricao", ""),  # Plano do aluno
+            codigo_origem=conta.get("codigoOrigem"),
+            origem=conta.get("origem"),
+            has_origem="origem" in conta,
+        )
+
+        # Extrair código do contrato/plano se disponível
+        receber_origem = conta.get("receberOrigem") or []
+        if receber_origem and isinstance(receber_origem, list) and len(receber_origem) > 0:
+            origem = receber_origem[0]
+            receivable.codigo_origem = origem.get("codigoOrigem")
+            receivable.origem = origem.get("origem")  # Ex: "Contrato", "Item", etc.
+            receivable.has_origem = True
+        return receivable
+
+    def identity(self) -> str:
+        """Identificador estável da conta (o código, ou origem + vencimento + valor se a API não o enviar)"""
+        if self.id is not None:
+            return str(self.id)
+        return f"{self.codigo_origem or ''}@{self.vencimento or ''}@{self.valor or ''}"
+
+    def to_conta_data(self) -> Dict:
+        """Formato usado no histórico (accounts_today.json)"""
+        conta_data = {
+            "valor": self.valor,
+            "vencimento": self.vencimento,
+            "status": self.status,
+            "descricao": self.descricao,
+            "codigoOrigem": self.codigo_origem
+        }
+        if self.has_origem:
+            conta_data["origem"] = self.origem
+        return conta_data
@@ -0,0 +1,304 @@
+"""
+Outbox persistente das notificações diárias
+Cada mensagem preparada é registrada em SQLite com a chave
+(data, cliente, conta a receber, flow) antes de ir para a fila de envio, e o
+resultado do envio é gravado na mesma linha. Reexecuções do job (ou a
+recuperação após uma queda) enviam apenas o que ainda não foi entregue.
+Um envio agrupado (várias contas do mesmo telefone) registra em outbox_members
+as contas que cobre: cada conta é entregue uma vez por dia, sozinha ou num grupo.
+
+Com várias réplicas (config.LEASES_ENABLED), cada mensagem é reservada
+(claim) pela réplica que vai enviá-la; a reserva expira se a réplica cair antes
+de registrar o resultado. Com um ShardAssignment, cada réplica envia apenas os
+telefones do seu shard e deixa os demais pendentes para as outras.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+from scripts import leases
+from scripts.send_messages import StreamingSender
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    run_date TEXT NOT NULL,
+    cliente_id TEXT NOT NULL,
+    conta_id TEXT NOT NULL DEFAULT '',
+    flow_id INTEGER NOT NULL,
+    message_type TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    claimed_by TEXT,
+    claimed_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_date_status ON outbox (run_date, status);
+CREATE TABLE IF NOT EXISTS outbox_members (
+    member_key TEXT NOT NULL,
+    send_key TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    PRIMARY KEY (member_key, send_key)
+);
+"""
+
+# Campos da mensagem que vão para o payload (os demais são metadados da outbox)
+_PAYLOAD_FIELDS = ("phone", "first_name", "field_mappings", "flow_id", "message_type", "cliente_id", "conta_id")
+
+
+def outbox_key(run_date: str, cliente_id, conta_id, flow_id, coalesce_key: Optional[str] = None) -> str:
+    """
+    Chave de idempotência: um envio por data, cliente, conta e flow
+
+    Mensagens agrupadas (coalesce_key = telefone normalizado, presente só quando
+    o grupo tem mais de uma conta) usam data, telefone, flow e as contas do
+    grupo. Cada conta do grupo também fica registrada em outbox_members com a
+    sua própria chave (data, cliente, conta, flow): numa reexecução, as contas
+    já entregues saem do grupo antes do agrupamento (Outbox.delivered), então uma
+    conta paga no meio do dia não gera novo envio e uma conta nova ainda é enviada.
+    """
+    if coalesce_key:
+        return f"{run_date}:tel:{coalesce_key}:{flow_id}:{conta_id or cliente_id}"
+    return f"{run_date}:{cliente_id}:{conta_id or ''}:{flow_id}"
+
+
+class Outbox:
+    """Registro durável das mensagens do dia e do status de entrega de cada uma"""
+
+    def __init__(self, path: Optional[str] = None, max_attempts: Optional[int] = None):
+        self.path = path or config.OUTBOX_DB_PATH
+        self.max_attempts = max_attempts if max_attempts is not None else config.OUTBOX_MAX_ATTEMPTS
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # Janelas e workers de envio usam a mesma conexão; o lock serializa o acesso
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """Outboxes criadas antes das reservas entre réplicas não têm as colunas de claim"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        with self._conn:
+            if "claimed_by" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN claimed_by TEXT")
+            if "claimed_until" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN claimed_until REAL")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def enqueue(self, run_date: str, msg: Dict) -> Optional[str]:
+        """
+        Registra a mensagem (se ainda não existir) e informa se ela deve ser enviada
+
+        Returns:
+            A chave da outbox se a mensagem está pendente (nova ou com falha e
+            tentativas restantes); None se já foi entregue ou esgotou as tentativas.
+        """
+        key = outbox_key(run_date, msg.get("cliente_id"), msg.get("conta_id"), msg.get("flow_id"),
+                         msg.get("coalesce_key"))
+        now = datetime.now().isoformat()
+        payload = json.dumps({field: msg.get(field) for field in _PAYLOAD_FIELDS}, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, run_date, cliente_id, conta_id, flow_id, message_type, "
+                "payload, status, attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (key, run_date, str(msg.get("cliente_id")), str(msg.get("conta_id") or ""), msg.get("flow_id"),
+                 msg.get("message_type") or "", payload, STATUS_PENDING, now, now)
+            )
+            for member in msg.get("members") or []:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO outbox_members (member_key, send_key, run_date) VALUES (?, ?, ?)",
+                    (outbox_key(run_date, member.get("cliente_id"), member.get("conta_id"), msg.get("flow_id")),
+                     key, run_date)
+                )
+            row = self._conn.execute("SELECT status, attempts FROM outbox WHERE key = ?", (key,)).fetchone()
+        if row["status"] == STATUS_SENT or row["attempts"] >= self.max_attempts:
+            return None
+        return key
+
+    def delivered(self, run_date: str, msg: Dict) -> bool:
+        """Se a conta da mensagem (não agrupada) já foi entregue na data, sozinha ou num envio agrupado"""
+        key = outbox_key(run_date, msg.get("cliente_id"), msg.get("conta_id"), msg.get("flow_id"))
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM outbox WHERE status = ? AND (key = ? OR key IN "
+                "(SELECT send_key FROM outbox_members WHERE member_key = ?)) LIMIT 1",
+                (STATUS_SENT, key, key)
+            ).fetchone() is not None
+
+    def claim(self, key: str, owner: str, ttl: Optional[float] = None) -> bool:
+        """
+        Reserva a mensagem para envio por `owner`
+
+        False se já foi entregue ou está reservada por outra réplica (reserva
+        ainda não expirada); a reserva é liberada por mark().
+        """
+        ttl = ttl if ttl is not None else config.OUTBOX_CLAIM_SECONDS
+        now = time.time()
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE key = ? AND status != ? "
+                "AND (claimed_until IS NULL OR claimed_until < ? OR claimed_by = ?)",
+                (owner, now + ttl, key, STATUS_SENT, now, owner)
+            ).rowcount == 1
+
+    def mark(self, key: str, success: bool, error: Optional[str] = None):
+        """Grava o resultado de uma tentativa de envio (e libera a reserva)"""
+        status = STATUS_SENT if success else STATUS_FAILED
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ?, "
+                "claimed_by = NULL, claimed_until = NULL WHERE key = ?",
+                (status, None if success else error, datetime.now().isoformat(), key)
+            )
+
+    def pending(self, run_date: str) -> Iterator[Dict]:
+        """Mensagens da data ainda não entregues e com tentativas restantes"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload FROM outbox WHERE run_date = ? AND status != ? AND attempts < ? ORDER BY created_at",
+                (run_date, STATUS_SENT, self.max_attempts)
+            ).fetchall()
+        for row in rows:
+            msg = json.loads(row["payload"])
+            msg["outbox_key"] = row["key"]
+            yield msg
+
+    def counts(self, run_date: str) -> Dict[str, int]:
+        """Quantidade de mensagens por status na data"""
+        result = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_FAILED: 0}
+        with self._lock:
+            for row in self._conn.execute(
+                "SELECT status, COUNT(*) AS total FROM outbox WHERE run_date = ? GROUP BY status", (run_date,)
+            ):
+                result[row["status"]] = row["total"]
+        return result
+
+    def purge(self, retention_days: Optional[int] = None, reference_date: Optional[date] = None) -> int:
+        """Remove registros mais antigos que a retenção configurada, contada a partir de reference_date (padrão: hoje)"""
+        if retention_days is None:
+            retention_days = config.OUTBOX_RETENTION_DAYS
+        cutoff = ((reference_date or date.today()) - timedelta(days=retention_days)).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox_members WHERE run_date < ?", (cutoff,))
+            return self._conn.execute("DELETE FROM outbox WHERE run_date < ?", (cutoff,)).rowcount
+
+
+def _should_send(outbox: Outbox, msg: Dict, shard: Optional["leases.ShardAssignment"],
+                 owner: Optional[str]) -> Optional[str]:
+    """Motivo para não enviar a mensagem por esta réplica ("shard" ou "claimed"), ou None"""
+    if shard is not None and not shard.owns(msg.get("phone")):
+        return "shard"
+    if owner is not None and not outbox.claim(msg["outbox_key"], owner):
+        return "claimed"
+    return None
+
+
+class OutboxEmitter:
+    """
+    Destino das mensagens preparadas: registra cada uma na outbox e só a
+    repassa para o envio se ainda não foi entregue (nem já enviada nesta execução)
+
+    Com shard, mensagens de telefones de outras réplicas ficam pendentes na
+    outbox (contadas em `deferred`); com owner, cada envio é reservado antes.
+    delivered() é usado pelo Coalescer para tirar dos grupos as contas já entregues.
+    """
+
+    def __init__(self, outbox: Outbox, run_date: str, submit,
+                 shard: Optional["leases.ShardAssignment"] = None, owner: Optional[str] = None):
+        self.outbox = outbox
+        self.run_date = run_date
+        self.submit = submit
+        self.shard = shard
+        self.owner = owner
+        self.skipped = 0
+        self.deferred = 0
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def delivered(self, msg: Dict) -> bool:
+        """Se a conta já foi entregue hoje (contada em `skipped`)"""
+        if not self.outbox.delivered(self.run_date, msg):
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def __call__(self, msg: Dict):
+        key = self.outbox.enqueue(self.run_date, msg)
+        with self._lock:
+            if key is None or key in self._submitted:
+                self.skipped += 1
+                return
+            self._submitted.add(key)
+        msg["outbox_key"] = key
+        leases.check_lease()
+        reason = _should_send(self.outbox, msg, self.shard, self.owner)
+        if reason is not None:
+            with self._lock:
+                if reason == "shard":
+                    self.deferred += 1
+                else:
+                    self.skipped += 1
+            return
+        self.submit(msg)
+
+
+def drain_outbox(run_date: Optional[str] = None, outbox: Optional[Outbox] = None,
+                 max_workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Envia as mensagens pendentes de uma data (padrão: hoje) sem refazer a busca de contas
+    Usado na recuperação após uma queda no meio do envio e, com várias réplicas,
+    para cada uma enviar o seu shard (leases.send_shard) do que o dono do job registrou.
+    """
+    run_date = run_date or date.today().isoformat()
+    own_outbox = outbox is None
+    outbox = outbox or Outbox()
+    shard = leases.send_shard()
+    owner = leases.claim_owner()
+    try:
+        sender = StreamingSender(max_workers=max_workers,
+                                 on_result=lambda msg, result: outbox.mark(msg["outbox_key"], result.success, result.error))
+        with sender:
+            for msg in outbox.pending(run_date):
+                leases.check_lease()
+                if _should_send(outbox, msg, shard, owner) is None:
+                    sender.submit(msg)
+        stats = sender.stats
+        if stats['total']:
+            logger.info(f"Outbox {run_date}: {stats['sent']} enviadas, {stats['failed']} falharam de {stats['total']} pendentes")
+        return stats
+    finally:
+        if own_outbox:
+            outbox.close()
@@ -0,0 +1,69 @@
+"""
+Paginação com prefetch para endpoints da NextFit baseados em Skip/Take
+Como os offsets podem ser calculados de antemão, várias páginas ficam em voo ao
+mesmo tempo (limitadas pelo rate limiter) e são entregues ao chamador em ordem.
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from scripts.tracing import propagate
+
+logger = logging.getLogger(__name__)
+
+
+def iter_pages(fetch_page: Callable[[int], Any], take: int, prefetch: int = 1,
+               start_skip: int = 0, is_last: Optional[Callable[[Any], bool]] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    Gera (skip, resposta) em ordem crescente de Skip
+
+    Args:
+        fetch_page: Função que recebe o Skip e retorna a resposta da página
+        take: Tamanho da página (incremento do Skip)
+        prefetch: Número máximo de páginas em voo simultaneamente
+        start_skip: Skip da primeira página
+        is_last: Indica se a resposta é a última página (temProximaPagina = false
+                 ou página curta); a iteração termina nela
+
+    As páginas especulativas só começam depois de uma página cheia: uma janela
+    com uma única página curta custa uma requisição, não `prefetch`. Ao chegar a
+    última página nenhuma outra é agendada. O chamador também pode interromper a
+    iteração; as páginas pendentes que ainda não começaram são canceladas e as
+    que já estão em voo são aguardadas (erros delas são registrados no log). Um
+    erro em qualquer página entregue é propagado na ordem em que ela seria entregue.
+    """
+    if prefetch <= 1:
+        skip = start_skip
+        while True:
+            page = fetch_page(skip)
+            yield skip, page
+            if is_last is not None and is_last(page):
+                return
+            skip += take
+
+    # As threads do pool buscam as páginas com a configuração (tenant) e o span do chamador
+    fetch_page = propagate(fetch_page)
+    executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="page")
+    pending = deque()
+    next_skip = start_skip
+    # Uma página por vez até a primeira página cheia
+    in_flight = 1
+    try:
+        while True:
+            while len(pending) < in_flight:
+                pending.append((next_skip, executor.submit(fetch_page, next_skip)))
+                next_skip += take
+            skip, future = pending.popleft()
+            page = future.result()
+            yield skip, page
+            if is_last is not None and is_last(page):
+                return
+            in_flight = prefetch
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for skip, future in pending:
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(f"Página especulativa Skip={skip} descartada com erro: {future.exception()}")
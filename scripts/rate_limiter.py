@@ -0,0 +1,132 @@
+"""
+Módulo de controle de taxa (rate limit) compartilhado pelas chamadas HTTP
+Cada provedor (NextFit, mundodosbots) tem seu próprio token bucket, com ajuste
+AIMD: a taxa sobe aos poucos enquanto as respostas são bem-sucedidas (2xx/3xx) e cai pela
+metade a cada 429, respeitando o header Retry-After quando presente.
+Todos os workers do processo compartilham o mesmo bucket por provedor (um
+conjunto de buckets por tenant, já que cada academia usa sua própria chave).
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket thread-safe com ajuste AIMD da taxa"""
+
+    def __init__(self, name: str, rate: float, burst: float, min_rate: float, max_rate: float,
+                 increase_step: float = 0.5, decrease_factor: float = 0.5):
+        # rate e min_rate dividem o tempo de espera: zero ou negativo travaria o bucket
+        for field, value in (("rate", rate), ("min_rate", min_rate), ("max_rate", max_rate)):
+            if not float(value) > 0:
+                raise ValueError(f"Rate limit '{name}': {field} deve ser maior que zero, recebido {value!r} "
+                                 f"(config.RATE_LIMITS[{name!r}][{field!r}])")
+        if not 0 < float(decrease_factor) <= 1:
+            raise ValueError(f"Rate limit '{name}': decrease_factor deve estar em (0, 1], recebido {decrease_factor!r}")
+        self.name = name
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.min_rate = float(min_rate)
+        self.max_rate = max(float(max_rate), self.rate)
+        self.increase_step = float(increase_step)
+        self.decrease_factor = float(decrease_factor)
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self._last_refill = now
+
+    def acquire(self):
+        """Reserva um token, bloqueando o chamador até que a requisição possa sair"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+            if self.blocked_until > now:
+                wait = max(wait, self.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        """Aumento aditivo: cerca de increase_step req/s a cada segundo de respostas 2xx/3xx"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step / max(self.rate, 1.0))
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Redução multiplicativa após um 429, pausando o bucket pelo Retry-After"""
+        with self._lock:
+            self.throttled += 1
+            old_rate = self.rate
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.tokens = min(self.tokens, 0.0)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+        logger.warning(
+            f"Rate limit atingido em '{self.name}': taxa {old_rate:.2f} -> {self.rate:.2f} req/s, "
+            f"pausando {pause:.1f}s"
+        )
+
+
+_limiters: Dict[Tuple[str, str], TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> TokenBucket:
+    """Retorna o bucket compartilhado de um provedor (config.RATE_LIMITS do tenant corrente)"""
+    key = (config.TENANT_ID, name)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                settings = config.RATE_LIMITS.get(name, {})
+                limiter = TokenBucket(
+                    name,
+                    rate=settings.get("rate", 1.0),
+                    burst=settings.get("burst", 1),
+                    min_rate=settings.get("min_rate", 0.2),
+                    max_rate=settings.get("max_rate", settings.get("rate", 1.0)),
+                )
+                _limiters[key] = limiter
+    return limiter
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Converte o header Retry-After (segundos ou data HTTP) em segundos"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
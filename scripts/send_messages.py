@@ -4,50 +4,57 @@ Módulo para enviar mensagens via API mundodosbots
 import os
 import sys
 import logging
-from typing import Dict, List, Optional
+import time
+import queue
+import threading
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # Adicionar o diretório raiz ao path para importar config
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 import config.config as config
+from scripts import http_client, metrics, tracing
 
 logger = logging.getLogger(__name__)
 
 
-def create_message_session():
-    """Cria uma sessão requests com retry para envio de mensagens"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["POST"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+@dataclass(slots=True)
+class SendResult:
+    """Resultado de um envio: status HTTP, latência, tentativas e erro"""
+    phone: str
+    flow_id: Optional[int]
+    success: bool
+    status_code: Optional[int] = None
+    latency: float = 0.0
+    attempts: int = 0
+    error: Optional[str] = None
+    message_type: Optional[str] = None
+    outbox_key: Optional[str] = None
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
 
 
-def send_message(phone: str, first_name: str, field_mappings: Dict[str, str], flow_id: int) -> bool:
+def deliver_message(phone: str, first_name: str, field_mappings: Dict[str, str], flow_id: int,
+                    session: Optional[requests.Session] = None) -> SendResult:
     """
-    Envia mensagem via API mundodosbots
+    Envia mensagem via API mundodosbots e retorna o resultado detalhado
     
     Args:
         phone: Número de telefone
         first_name: Primeiro nome
         field_mappings: Dicionário com mapeamento campo -> valor
         flow_id: ID do fluxo a ser enviado
+        session: Sessão HTTP a reutilizar (padrão: sessão compartilhada do provedor)
     
     Returns:
-        True se enviado com sucesso, False caso contrário
+        SendResult com sucesso, status HTTP, latência (s), tentativas e erro
     """
     if not config.MESSAGE_API_TOKEN:
         logger.warning("Token da API de mensagens não configurado. Pulando envio.")
-        return False
+        return SendResult(phone=phone, flow_id=flow_id, success=False, error="MESSAGE_API_TOKEN não configurado")
     
     url = config.MESSAGE_API_URL
     headers = {
@@ -80,43 +87,176 @@ def send_message(phone: str, first_name: str, field_mappings: Dict[str, str], fl
         "actions": actions
     }
     
+    result = SendResult(phone=phone, flow_id=flow_id, success=False)
+    started = time.perf_counter()
     try:
-        session = create_message_session()
-        response = session.post(url, headers=headers, json=payload, timeout=30)
+        response = http_client.request("mundodosbots", "POST", url, session=session,
+                                       headers=headers, json=payload)
+        result.status_code = response.status_code
+        result.attempts = getattr(response, "attempts", 1)
         response.raise_for_status()
+        result.success = True
         logger.info(f"Mensagem enviada com sucesso para {phone} (flow_id: {flow_id})")
-        return True
     except requests.exceptions.RequestException as e:
+        result.attempts = result.attempts or 1
+        result.error = str(e)
         logger.error(f"Erro ao enviar mensagem para {phone}: {e}")
         if hasattr(e, 'response') and e.response is not None:
             logger.error(f"Resposta da API: {e.response.text}")
+    result.latency = time.perf_counter() - started
+    return result
+
+
+def send_message(phone: str, first_name: str, field_mappings: Dict[str, str], flow_id: int,
+                 session: Optional[requests.Session] = None) -> bool:
+    """
+    Envia mensagem via API mundodosbots
+    
+    Returns:
+        True se enviado com sucesso, False caso contrário (detalhes em deliver_message)
+    """
+    return deliver_message(phone, first_name, field_mappings, flow_id, session=session).success
+
+
+class StreamingSender:
+    """
+    Envia mensagens à medida que são produzidas
+    
+    Um conjunto fixo de workers consome uma fila limitada: quando a fila enche,
+    submit() bloqueia o produtor (backpressure), de modo que a busca de contas
+    e o envio avançam juntos sem acumular todas as mensagens em memória.
+    
+    Cada envio gera um SendResult, guardado em stats['results']; on_result(msg, result),
+    se informado, é chamado pelo worker após cada envio (ex: para registrar a entrega na outbox).
+    
+    Uso:
+        with StreamingSender() as sender:
+            for msg in mensagens:
+                sender.submit(msg)
+        stats = sender.stats
+    """
+    
+    def __init__(self, max_workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 on_result: Optional[Callable[[Dict, SendResult], None]] = None):
+        if max_workers is None:
+            max_workers = config.MESSAGE_MAX_WORKERS
+        if queue_size is None:
+            queue_size = config.MESSAGE_QUEUE_SIZE
+        self.max_workers = max(1, max_workers)
+        self.on_result = on_result
+        self.stats = {'sent': 0, 'failed': 0, 'total': 0, 'results': []}
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._session = http_client.get_session("mundodosbots")
+        self._workers = []
+    
+    def start(self):
+        """Inicia os workers de envio"""
+        # Workers enviam com a configuração (tenant) de quem iniciou o envio
+        run = tracing.propagate(self._run)
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=run, name=f"send-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+    
+    def submit(self, msg: Dict):
+        """Enfileira uma mensagem (bloqueia se a fila estiver cheia)"""
+        with self._lock:
+            self.stats['total'] += 1
+        self._queue.put(msg)
+    
+    def close(self) -> Dict:
+        """Aguarda o envio de tudo que foi enfileirado e encerra os workers"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        return self.stats
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
         return False
+    
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            try:
+                result = deliver_message(
+                    phone=msg.get('phone'),
+                    first_name=msg.get('first_name', ''),
+                    field_mappings=msg.get('field_mappings', {}),
+                    flow_id=msg.get('flow_id'),
+                    session=self._session
+                )
+            except Exception as e:
+                logger.error(f"Erro inesperado ao enviar mensagem para {msg.get('phone')}: {e}", exc_info=True)
+                result = SendResult(phone=msg.get('phone'), flow_id=msg.get('flow_id'), success=False,
+                                    attempts=1, error=str(e))
+            result.message_type = msg.get('message_type')
+            result.outbox_key = msg.get('outbox_key')
+            metrics.record_send_result(result)
+            with self._lock:
+                self.stats['results'].append(result)
+                if result.success:
+                    self.stats['sent'] += 1
+                else:
+                    self.stats['failed'] += 1
+            if self.on_result is not None:
+                try:
+                    self.on_result(msg, result)
+                except Exception as e:
+                    logger.error(f"Erro ao registrar resultado do envio para {msg.get('phone')}: {e}", exc_info=True)
+
+
+def summarize_results(results: List[SendResult]) -> Dict:
+    """Resumo dos envios: totais, taxa de falha, tentativas e latência (p50/p95/máx, em segundos)"""
+    latencies = sorted(r.latency for r in results)
+    failed = sum(1 for r in results if not r.success)
+    
+    def percentile(p):
+        if not latencies:
+            return 0.0
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+    
+    status_codes = {}
+    for r in results:
+        key = str(r.status_code) if r.status_code is not None else "erro"
+        status_codes[key] = status_codes.get(key, 0) + 1
+    return {
+        "total": len(results),
+        "sent": len(results) - failed,
+        "failed": failed,
+        "failure_rate": round(failed / len(results), 4) if results else 0.0,
+        "attempts": sum(r.attempts for r in results),
+        "latency_p50": percentile(0.50),
+        "latency_p95": percentile(0.95),
+        "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+        "status_codes": status_codes,
+    }
 
 
-def send_batch_messages(messages: List[Dict]) -> Dict[str, int]:
+def send_batch_messages(messages: List[Dict], max_workers: Optional[int] = None) -> Dict:
     """
-    Envia múltiplas mensagens
+    Envia múltiplas mensagens em paralelo, reutilizando o mesmo pool de conexões
     
     Args:
-        messages: Lista de dicionários com phone, first_name, field_mappings, flow_id
+        messages: Lista (ou iterável) de dicionários com phone, first_name, field_mappings, flow_id
+        max_workers: Número de envios simultâneos (padrão: config.MESSAGE_MAX_WORKERS)
     
     Returns:
-        Dicionário com estatísticas: {'sent': X, 'failed': Y, 'total': Z}
+        Dicionário com estatísticas: {'sent': X, 'failed': Y, 'total': Z, 'results': [SendResult, ...]}
     """
-    stats = {'sent': 0, 'failed': 0, 'total': len(messages)}
-    
-    for msg in messages:
-        success = send_message(
-            phone=msg.get('phone'),
-            first_name=msg.get('first_name', ''),
-            field_mappings=msg.get('field_mappings', {}),
-            flow_id=msg.get('flow_id')
-        )
-        
-        if success:
-            stats['sent'] += 1
-        else:
-            stats['failed'] += 1
+    with StreamingSender(max_workers=max_workers) as sender:
+        for msg in messages:
+            sender.submit(msg)
+    stats = sender.stats
     
     logger.info(f"Envio em lote concluído: {stats['sent']} enviadas, {stats['failed']} falharam de {stats['total']} total")
     return stats
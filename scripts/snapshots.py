@@ -0,0 +1,73 @@
+"""
+Escrita atômica e leitura segura dos snapshots em arquivo (users.json e similares)
+O arquivo novo é gravado em um temporário e trocado com os.replace, de modo que
+leitores sempre encontram uma versão completa. A geração anterior é mantida em
+<nome>.prev.json e usada como fallback se a atual estiver ausente ou corrompida.
+"""
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def previous_path(path: str) -> str:
+    """Caminho da geração anterior: users.json -> users.prev.json"""
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}.prev{p.suffix}"))
+
+
+def write_json_atomic(path: str, data: Any, keep_previous: bool = False, indent: Optional[int] = None):
+    """
+    Grava JSON de forma atômica (temporário + fsync + rename)
+
+    Com keep_previous, a versão atual vira <nome>.prev.json antes da troca, sem
+    nenhum instante em que o arquivo principal deixe de existir.
+    """
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if keep_previous and target.exists():
+        prev = Path(previous_path(path))
+        prev_tmp = prev.with_name(f".{prev.name}.{os.getpid()}.tmp")
+        try:
+            # Hard link preserva a geração atual sem copiar; cópia se o sistema de arquivos não suportar
+            if prev_tmp.exists():
+                prev_tmp.unlink()
+            os.link(target, prev_tmp)
+        except OSError:
+            shutil.copy2(target, prev_tmp)
+        os.replace(prev_tmp, prev)
+
+    os.replace(tmp_path, target)
+
+
+def read_json_snapshot(path: str) -> Tuple[Optional[Any], Optional[str]]:
+    """
+    Lê o snapshot mais recente completo
+
+    Returns:
+        Tupla (dados, caminho lido). Tenta o arquivo atual e depois a geração
+        anterior; retorna (None, None) se nenhum estiver disponível.
+    """
+    for candidate in (path, previous_path(path)):
+        if not Path(candidate).exists():
+            continue
+        try:
+            with open(candidate, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Snapshot {candidate} ilegível: {e}")
+            continue
+        if candidate != path:
+            logger.warning(f"Usando a geração anterior do snapshot: {candidate}")
+        return data, candidate
+    return None, None
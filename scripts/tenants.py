@@ -0,0 +1,201 @@
+"""
+Registro das academias (tenants) atendidas por um mesmo processo
+Cada tenant tem sua chave da NextFit, token da mundodosbots, flow ids, campos
+customizados, rate limits e diretório de dados. Os jobs de um tenant rodam
+dentro de tenant.activate(): os scripts continuam lendo config.X e recebem o
+valor do tenant (config.overrides), incluindo os caminhos em DATA_DIR.
+
+Formato do arquivo (config.TENANTS_FILE, JSON):
+
+    {"tenants": [
+        {"id": "academia_centro",
+         "api_key": "...",
+         "message_api_token": "...",
+         "data_dir": "/app/data/academia_centro",
+         "flow_ids": {"boleto_vencendo_hoje": 123, "aniversariante": 456},
+         "custom_fields": {"campo1": "nome", "campo2": "valor"},
+         "rate_limits": {"nextfit": {"rate": 1, "max_rate": 5}},
+         "max_concurrent_jobs": 2,
+         "settings": {"SEND_MESSAGES": false, "COLLECT_USERS_HOUR": 3}}
+    ]}
+
+Campos omitidos usam os valores globais (variáveis de ambiente); data_dir
+padrão é DATA_DIR/<id>. Sem TENANTS_FILE há um único tenant (TENANT_ID) com a
+configuração global, sem sobreposições.
+"""
+import os
+import re
+import sys
+import copy
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Tipos de job do tenant: cada tipo roda uma vez por vez. A coleta e a verificação
+# têm slots separados para rodarem juntas (a verificação lê a última geração
+# completa do snapshot enquanto a coleta prepara a próxima); o reenvio da outbox
+# usa o slot de envio, o mesmo da verificação, que grava nas mesmas linhas
+SLOT_COLLECT = "collect"
+SLOT_SEND = "send"
+
+
+class Tenant:
+    """
+    Uma academia: sobreposições de configuração e limite de jobs simultâneos
+    max_concurrent_jobs: jobs de tipos diferentes rodando ao mesmo tempo (padrão 2:
+    coleta e verificação em paralelo; 1 serializa os dois)
+    """
+
+    def __init__(self, tenant_id: str, overrides: Optional[Dict] = None, max_concurrent_jobs: int = 2,
+                 scoped: bool = True):
+        self.id = tenant_id
+        self.overrides = dict(overrides or {})
+        self.overrides["TENANT_ID"] = tenant_id
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        # scoped=False: tenant único do modo antigo (ids de job sem prefixo)
+        self.scoped = scoped
+        self._slots = threading.BoundedSemaphore(self.max_concurrent_jobs)
+        self._kinds = {SLOT_COLLECT: threading.Lock(), SLOT_SEND: threading.Lock()}
+
+    def __repr__(self):
+        return f"Tenant({self.id!r})"
+
+    def job_id(self, job: str) -> str:
+        return f"{self.id}:{job}" if self.scoped else job
+
+    @contextmanager
+    def activate(self):
+        """Executa o bloco com a configuração do tenant (herdada pelas threads via tracing.propagate)"""
+        with config.overrides(self.overrides):
+            Path(config.DATA_DIR).mkdir(parents=True, exist_ok=True)
+            yield self
+
+    @contextmanager
+    def job_slot(self, *kinds: str):
+        """
+        Reserva sem bloquear os tipos de job (SLOT_COLLECT, SLOT_SEND) e um dos
+        max_concurrent_jobs do tenant
+
+        O bloco recebe True se o job pode rodar agora e False se algum tipo ou o
+        limite está ocupado: o chamador reagenda o job em vez de esperar dentro de
+        uma thread do pool compartilhado, que as outras academias também usam.
+        """
+        held = []
+        acquired = False
+        try:
+            for kind in kinds:
+                if not self._kinds[kind].acquire(blocking=False):
+                    break
+                held.append(self._kinds[kind])
+            else:
+                acquired = self._slots.acquire(blocking=False)
+            yield acquired
+        finally:
+            if acquired:
+                self._slots.release()
+            for lock in held:
+                lock.release()
+
+
+def _merge_rate_limits(overrides: Dict) -> Dict:
+    rate_limits = copy.deepcopy(config.RATE_LIMITS)
+    for provider, settings in overrides.items():
+        if provider not in rate_limits:
+            raise ValueError(f"Provedor de rate limit desconhecido: {provider}")
+        rate_limits[provider].update(settings)
+    return rate_limits
+
+
+def build_tenant(entry: Dict) -> Tenant:
+    """Cria um Tenant a partir de uma entrada do arquivo de tenants"""
+    tenant_id = str(entry.get("id", "")).strip()
+    if not _VALID_ID.match(tenant_id):
+        raise ValueError(f"Id de tenant inválido: {tenant_id!r} (use letras, números, '_', '-' ou '.')")
+
+    overrides = {}
+    for name, value in (entry.get("settings") or {}).items():
+        if not name.isupper() or not hasattr(config, name):
+            raise ValueError(f"[{tenant_id}] configuração desconhecida em settings: {name}")
+        overrides[name] = value
+
+    data_dir = entry.get("data_dir") or os.path.join(config.DATA_DIR, tenant_id)
+    overrides.update(config.data_paths(data_dir))
+
+    if entry.get("api_key"):
+        overrides["API_KEY"] = entry["api_key"]
+        overrides["API_HEADERS"] = dict(config.API_HEADERS, **{"X-Api-Key": entry["api_key"]})
+    if entry.get("message_api_token"):
+        overrides["MESSAGE_API_TOKEN"] = entry["message_api_token"]
+    if entry.get("flow_ids"):
+        unknown = set(entry["flow_ids"]) - set(config.FLOW_IDS)
+        if unknown:
+            raise ValueError(f"[{tenant_id}] tipos de mensagem desconhecidos em flow_ids: {sorted(unknown)}")
+        overrides["FLOW_IDS"] = dict(config.FLOW_IDS, **{k: int(v) for k, v in entry["flow_ids"].items()})
+    if entry.get("custom_fields"):
+        overrides["MESSAGE_CUSTOM_FIELDS"] = dict(config.MESSAGE_CUSTOM_FIELDS, **entry["custom_fields"])
+    if entry.get("rate_limits"):
+        overrides["RATE_LIMITS"] = _merge_rate_limits(entry["rate_limits"])
+
+    return Tenant(tenant_id, overrides, max_concurrent_jobs=entry.get("max_concurrent_jobs", 2))
+
+
+def load_tenants(path: Optional[str] = None) -> List[Tenant]:
+    """
+    Tenants deste processo
+
+    Args:
+        path: Arquivo de tenants (padrão: config.TENANTS_FILE). Vazio: um único
+              tenant com a configuração global.
+    """
+    path = path if path is not None else config.TENANTS_FILE
+    if not path:
+        return [Tenant(config.TENANT_ID, scoped=False)]
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("tenants", []) if isinstance(data, dict) else data
+    if not entries:
+        raise ValueError(f"Nenhum tenant definido em {path}")
+
+    tenants = [build_tenant(entry) for entry in entries]
+    seen = set()
+    for tenant in tenants:
+        if tenant.id in seen:
+            raise ValueError(f"Tenant duplicado em {path}: {tenant.id}")
+        seen.add(tenant.id)
+    data_dirs = [tenant.overrides["DATA_DIR"] for tenant in tenants]
+    if len(set(map(os.path.abspath, data_dirs))) != len(data_dirs):
+        raise ValueError(f"Tenants em {path} compartilham o mesmo data_dir")
+    logger.info(f"{len(tenants)} tenant(s) carregado(s) de {path}: {', '.join(t.id for t in tenants)}")
+    return tenants
+
+
+def get_tenant(tenant_id: Optional[str] = None, path: Optional[str] = None) -> Tenant:
+    """
+    Um tenant pelo id, para execuções fora do scheduler (cli.py, workers do backfill)
+
+    Args:
+        tenant_id: Id do tenant; None aceita apenas quando há um único tenant configurado
+        path: Arquivo de tenants (padrão: config.TENANTS_FILE)
+    """
+    available = load_tenants(path)
+    ids = ", ".join(tenant.id for tenant in available)
+    if tenant_id is None:
+        if len(available) > 1:
+            raise ValueError(f"Vários tenants configurados; informe um deles ({ids})")
+        return available[0]
+    for tenant in available:
+        if tenant.id == tenant_id:
+            return tenant
+    raise ValueError(f"Tenant desconhecido: {tenant_id} (configurados: {ids})")
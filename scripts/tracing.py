@@ -0,0 +1,154 @@
+"""
+Spans de tempo das etapas de uma execução
+Cada etapa (carga de usuários, janelas de contas, associação, aniversariantes,
+preparação e envio) abre um span filho do span corrente; a árvore resultante é
+gravada no arquivo de resultado e, opcionalmente, em config.TRACE_LOG_PATH
+(uma linha JSON por execução) para comparar execuções dia a dia.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Adicionar o diretório raiz ao path para importar config
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config.config as config
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("tracing_span", default=None)
+
+
+class Span:
+    """Etapa medida: duração, atributos e spans filhos"""
+
+    __slots__ = ("name", "attributes", "children", "started", "duration", "calls", "_lock")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes: Dict = dict(attributes)
+        self.children: List["Span"] = []
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.calls = 1
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def incr(self, name: str, amount=1):
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+
+    def _add_child(self, child: "Span"):
+        with self._lock:
+            self.children.append(child)
+
+    @contextmanager
+    def accumulate(self, name: str):
+        """
+        Soma o tempo de várias chamadas em um único filho (ex: associação página a página)
+        O filho traz a duração total e o número de chamadas em `calls`.
+        """
+        with self._lock:
+            child = next((c for c in self.children if c.name == name), None)
+            if child is None:
+                child = Span(name)
+                child.duration = 0.0
+                child.calls = 0
+                self.children.append(child)
+        started = time.perf_counter()
+        try:
+            yield child
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                child.duration += elapsed
+                child.calls += 1
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict:
+        """Árvore do span; offset é o início relativo ao span raiz, em segundos"""
+        if origin is None:
+            origin = self.started
+        data = {
+            "name": self.name,
+            "offset": round(self.started - origin, 4),
+            "duration": round(self.duration if self.duration is not None else time.perf_counter() - self.started, 4),
+        }
+        if self.calls != 1:
+            data["calls"] = self.calls
+        data.update(self.attributes)
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Abre um span filho do span corrente (ou um span raiz, se não houver)"""
+    parent = _current.get()
+    current = Span(name, **attributes)
+    if parent is not None:
+        parent._add_child(current)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        current.finish()
+        _current.reset(token)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def timed_iter(parent: Span, name: str, iterable):
+    """Repassa os itens de iterable somando em parent.accumulate(name) o tempo de espera por cada um"""
+    iterator = iter(iterable)
+    while True:
+        with parent.accumulate(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Envolve fn para rodar em outra thread (ex: ThreadPoolExecutor) com o span corrente
+    Threads do pool não herdam o contexto de quem as criou.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def write_trace_log(root: Span, path: Optional[str] = None, **fields):
+    """Acrescenta a árvore de spans como uma linha JSON em config.TRACE_LOG_PATH (se configurado)"""
+    path = path or config.TRACE_LOG_PATH
+    if not path:
+        return
+    try:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        line = dict(fields, timestamp=datetime.now().isoformat(), trace=root.to_dict())
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.error(f"Erro ao gravar trace em {path}: {e}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Raiz do projeto no path para importar config e scripts
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from scripts import backfill, check_accounts
+
+
+def test_backfill_send_does_not_purge_outbox(monkeypatch, tmp_path):
+    calls = []
+
+    def check(**kwargs):
+        calls.append(kwargs)
+        return None
+
+    monkeypatch.setattr(check_accounts, "check_accounts_and_birthdays", check)
+    summary = backfill._run_date(date(2024, 3, 1), dry_run=False, output_path=str(tmp_path / "out.json"))
+    assert summary["date"] == "2024-03-01"
+    assert calls[0]["purge_outbox"] is False
+    assert calls[0]["target_date"] == date(2024, 3, 1)
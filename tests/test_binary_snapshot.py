@@ -0,0 +1,44 @@
+import pytest
+
+from scripts.binary_snapshot import BinarySnapshot, write_binary_snapshot
+
+USERS = [
+    {"id": 30, "nome": "Caio", "telefone": "11933330000", "data_nascimento": "1985-12-31"},
+    {"id": 7, "nome": "Ana\x1fMaria", "telefone": "11911110000", "data_nascimento": "1990-03-10T00:00:00"},
+    {"id": 12, "nome": "Bia", "telefone": "", "data_nascimento": "1992-03-10"},
+    {"id": "abc", "nome": "Sem id numérico", "telefone": "", "data_nascimento": ""},
+    {"id": 5, "nome": "Duda", "telefone": "11955550000", "data_nascimento": ""},
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "users.bin")
+    assert write_binary_snapshot(USERS, path, generation=4, meta={"last_updated": "2024-03-10T02:00:00"}) == 4
+    with BinarySnapshot(path) as snapshot:
+        yield snapshot
+
+
+def test_encode_and_lookup(snapshot):
+    assert snapshot.count() == 4
+    assert snapshot.generation == 4
+    assert snapshot.get_meta("last_updated") == "2024-03-10T02:00:00"
+    assert snapshot.get(7)["nome"] == "Ana Maria"
+    assert snapshot.get("30")["data_nascimento_normalizada"] == "1985-12-31"
+    assert snapshot.get(5)["telefone"] == "11955550000"
+    assert snapshot.get(6) is None
+    assert snapshot.get("abc") is None
+    assert set(snapshot.get_many([5, "12", 99, None])) == {"5", "12"}
+    assert [user["id"] for user in snapshot.iter_all()] == [30, 7, 12, 5]
+
+
+def test_birthday_index(snapshot):
+    assert [user["id"] for user in snapshot.find_by_birthday(3, 10)] == [7, 12]
+    assert [user["id"] for user in snapshot.find_by_birthdays([(12, 31), (1, 1)])] == [30]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "users.bin"
+    path.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        BinarySnapshot(str(path))
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from scripts import client_lookup
+from scripts.client_lookup import ClientCache, ClientJoinIndex
+from scripts.models import Client
+
+
+def test_read_only_cache_is_not_written(tmp_path):
+    path = str(tmp_path / "client_cache.json")
+    cache = ClientCache.load(path, read_only=True)
+    cache.put(Client(id=1, nome="Ana", telefone="11999990000"))
+    cache.save()
+    assert not os.path.exists(path)
+
+    cache = ClientCache.load(path)
+    cache.put(Client(id=1, nome="Ana", telefone="11999990000"))
+    cache.save()
+    assert ClientCache.load(path, read_only=True).get(1).nome == "Ana"
+
+
+def test_fetch_missing_disabled_skips_network(tmp_path, monkeypatch):
+    def fail(session, client_id):
+        raise AssertionError("busca na NextFit com fetch_missing=False")
+
+    monkeypatch.setattr(client_lookup, "fetch_client", fail)
+    cache = ClientCache.load(str(tmp_path / "client_cache.json"), read_only=True)
+    cache.put(Client(id=2, nome="Bia"))
+    index = ClientJoinIndex({"1": {"id": 1, "nome": "Caio"}}, session=object(), cache=cache, fetch_missing=False)
+    found = index.get_many([1, 2, 3])
+    assert set(found) == {"1", "2"}
+    assert index.stats["snapshot"] == 1 and index.stats["cache"] == 1 and index.stats["fetched"] == 0
+
+
+def test_lookup_stops_after_consecutive_mismatches(monkeypatch):
+    calls = []
+
+    def ignores_filter(session, client_id):
+        calls.append(client_id)
+        raise client_lookup.LookupMismatch(f"cliente {client_id}")
+
+    monkeypatch.setattr(client_lookup, "fetch_client", ignores_filter)
+    monkeypatch.setattr(client_lookup.config, "CLIENT_LOOKUP_MAX_MISMATCHES", 3)
+    index = ClientJoinIndex({}, session=object(), fetch_missing=True, max_fetches=200)
+    for client_id in range(20):
+        index.get_many([client_id])
+    assert len(calls) == 3
+    assert index.stats["mismatches"] == 3
+    assert not index.fetch_missing
+
+
+def test_fetch_client_rejects_other_client(monkeypatch):
+    class Response:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"items": [{"id": 99, "nome": "Outro"}], "temProximaPagina": False}
+
+    monkeypatch.setattr(client_lookup.http_client, "request", lambda *args, **kwargs: Response())
+    with pytest.raises(client_lookup.LookupMismatch):
+        client_lookup.fetch_client(None, 1)
@@ -0,0 +1,35 @@
+from scripts.client_store import ClientStore
+
+
+def user(client_id, nome="Ana", telefone="11999990000", data_nascimento="1990-03-10"):
+    return {"id": client_id, "nome": nome, "telefone": telefone, "data_nascimento": data_nascimento}
+
+
+def test_sync_round_trip(tmp_path):
+    path = str(tmp_path / "clients.db")
+    with ClientStore(path) as store:
+        stats = store.sync([user(1), user(2, nome="Bia"), user(3, nome="Caio")])
+        assert stats == {"total": 3, "new": 3, "changed": 0, "removed": 0, "unchanged": 0}
+        generation = store.generation
+
+        stats = store.sync([user(1), user(2, nome="Beatriz"), user(4, nome="Duda")])
+        assert stats == {"total": 3, "new": 1, "changed": 1, "removed": 1, "unchanged": 1}
+        assert store.generation == generation + 1
+
+    # Reaberto: o snapshot sincronizado é o que foi coletado por último
+    with ClientStore(path) as store:
+        assert store.count() == 3
+        assert store.get(3) is None
+        assert store.get(2)["nome"] == "Beatriz"
+        assert store.get(4)["id"] == 4
+        assert [client["id"] for client in store.find_by_birthday(3, 10)] == [1, 2, 4]
+        assert store.last_sync_runs(1)[0]["mode"] == "incremental"
+
+
+def test_sync_without_changes_keeps_generation(tmp_path):
+    with ClientStore(str(tmp_path / "clients.db")) as store:
+        store.sync([user(1), user(2, nome="Bia")])
+        generation = store.generation
+        stats = store.sync([user(2, nome="Bia"), user(1)])
+        assert stats["unchanged"] == 2
+        assert store.generation == generation
@@ -0,0 +1,122 @@
+import pytest
+
+from scripts.coalesce import Coalescer, merge_messages
+from scripts.outbox import Outbox, OutboxEmitter
+
+RUN_DATE = "2024-03-10"
+PHONE = "(11) 99999-0000"
+
+
+@pytest.fixture
+def box(tmp_path):
+    with Outbox(str(tmp_path / "outbox.db"), max_attempts=3) as outbox:
+        yield outbox
+
+
+def message(cliente_id, conta_id, phone=PHONE, valor="10,00"):
+    return {
+        "phone": phone,
+        "first_name": "Ana",
+        "flow_id": 1,
+        "message_type": "boleto_vencendo_hoje",
+        "cliente_id": cliente_id,
+        "conta_id": conta_id,
+        "field_mappings": {"valor": valor},
+    }
+
+
+def run(box, messages):
+    """Uma execução com agrupamento: registra, envia (sempre com sucesso) e marca na outbox"""
+    submitted = []
+    emitter = OutboxEmitter(box, RUN_DATE, submitted.append)
+    coalescer = Coalescer(emitter, enabled=True)
+    for msg in messages:
+        coalescer.add(dict(msg))
+    coalescer.flush()
+    for msg in submitted:
+        box.mark(msg["outbox_key"], True)
+    return submitted, emitter
+
+
+def test_merge_sums_values_and_keeps_member_ids():
+    merged = merge_messages([message(1, 10, valor="10,00"), message(2, 20, valor="5,50")],
+                            rules={"campo2": "sum"})
+    assert merged["cliente_id"] == "1+2"
+    assert merged["conta_id"] == "10+20"
+    assert merged["coalesced"] == 2
+    assert merged["members"] == [{"cliente_id": 1, "conta_id": 10}, {"cliente_id": 2, "conta_id": 20}]
+
+
+def test_single_message_group_keeps_per_receivable_key(box):
+    submitted, _ = run(box, [message(1, 10)])
+    assert submitted[0]["outbox_key"] == f"{RUN_DATE}:1:10:1"
+    assert "coalesce_key" not in submitted[0]
+
+
+def test_merged_group_uses_phone_key(box):
+    # Formatos diferentes do mesmo telefone caem no mesmo grupo
+    submitted, _ = run(box, [message(1, 10), message(2, 20, phone="11 99999-0000")])
+    assert len(submitted) == 1
+    assert submitted[0]["cliente_id"] == "1+2"
+    assert submitted[0]["outbox_key"] == f"{RUN_DATE}:tel:11999990000:1:10+20"
+
+
+def test_paid_receivable_does_not_resend_group(box):
+    run(box, [message(1, 10), message(2, 20)])
+    # A conta 10 foi paga antes da reexecução: a 20 já foi entregue no envio agrupado
+    second, emitter = run(box, [message(2, 20)])
+    assert second == []
+    assert emitter.skipped == 1
+    assert box.counts(RUN_DATE)["sent"] == 1
+
+
+def test_new_receivable_for_same_phone_is_still_sent(box):
+    run(box, [message(1, 10), message(2, 20)])
+    second, _ = run(box, [message(1, 10), message(2, 20), message(3, 30)])
+    assert [msg["conta_id"] for msg in second] == [30]
+    assert second[0]["outbox_key"] == f"{RUN_DATE}:3:30:1"
+
+    # Duas contas novas viram um novo envio agrupado, só com elas
+    third, _ = run(box, [message(1, 10), message(4, 40), message(5, 50)])
+    assert len(third) == 1
+    assert third[0]["conta_id"] == "40+50"
+
+    fourth, _ = run(box, [message(n, n * 10) for n in range(1, 6)])
+    assert fourth == []
+
+
+def test_group_delivered_individually_is_not_resent_merged(box):
+    run(box, [message(1, 10)])
+    second, _ = run(box, [message(1, 10), message(2, 20)])
+    assert [msg["conta_id"] for msg in second] == [20]
+
+
+def test_pending_messages_are_capped():
+    emitted = []
+    coalescer = Coalescer(emitted.append, enabled=True, max_pending=100)
+    peak = 0
+    for n in range(5000):
+        coalescer.add(message(n, n, phone=f"119{n:08d}"))
+        peak = max(peak, coalescer.pending)
+    # Os grupos mais antigos seguem para o envio durante a janela, não só no flush
+    assert peak == 100
+    assert len(emitted) == 4900
+    coalescer.flush()
+    assert len(emitted) == 5000 and coalescer.emitted == 5000
+
+
+def test_peak_memory_does_not_grow_with_window_size():
+    import tracemalloc
+
+    def peak_for(count):
+        coalescer = Coalescer(lambda msg: None, enabled=True, max_pending=200)
+        tracemalloc.start()
+        for n in range(count):
+            coalescer.add(message(n, n, phone=f"119{n:08d}", valor="x" * 1000 + str(n)))
+        coalescer.flush()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    small, large = peak_for(2000), peak_for(20000)
+    assert large < small * 1.5
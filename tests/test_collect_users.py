@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from scripts import collect_users
+from scripts.client_store import ClientStore
+
+TAKE = 30
+TOTAL = 100
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    config = collect_users.config
+    for name, path in config.data_paths(str(tmp_path)).items():
+        monkeypatch.setattr(config, name, path)
+    monkeypatch.setattr(config, "COLLECT_MODE", "incremental")
+    monkeypatch.setattr(config, "ITEMS_PER_PAGE", TAKE)
+    monkeypatch.setattr(config, "WRITE_BINARY_SNAPSHOT", False)
+    return tmp_path
+
+
+def fake_api(requested, fail_at=None):
+    def fetch_users_page(session, skip, take):
+        requested.append(skip)
+        if skip == fail_at:
+            raise RuntimeError("queda no meio da coleta")
+        ids = range(skip + 1, min(skip + take, TOTAL) + 1)
+        return {"items": [{"id": i, "nome": f"Cliente {i}", "telefone": "11999990000"} for i in ids],
+                "temProximaPagina": skip + take < TOTAL}
+    return fetch_users_page
+
+
+def test_interrupted_collection_resumes_from_checkpoint(data_dir, monkeypatch):
+    config = collect_users.config
+    requested = []
+    monkeypatch.setattr(collect_users, "fetch_users_page", fake_api(requested, fail_at=2 * TAKE))
+    with pytest.raises(RuntimeError):
+        collect_users.collect_all_users(prefetch=1)
+
+    with open(config.COLLECT_CHECKPOINT_PATH, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    assert checkpoint["next_skip"] == 2 * TAKE
+    assert checkpoint["pages_written"] == 2
+
+    requested.clear()
+    monkeypatch.setattr(collect_users, "fetch_users_page", fake_api(requested))
+    assert collect_users.collect_all_users(prefetch=1)
+
+    # Só as páginas ainda não confirmadas são buscadas de novo
+    assert min(requested) == 2 * TAKE
+    assert collect_users.load_checkpoint() is None
+    with ClientStore(config.USERS_DB_PATH) as store:
+        assert store.count() == TOTAL
+        assert store.get(1)["nome"] == "Cliente 1"
+        assert store.get(TOTAL)["nome"] == f"Cliente {TOTAL}"
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+import config.config as config
+from scripts import leases, metrics
+from scripts.outbox import Outbox, OutboxEmitter
+
+
+@pytest.fixture
+def lease_config(tmp_path):
+    values = {
+        "LEASES_ENABLED": True,
+        "LEASES_DB_PATH": str(tmp_path / "leases.db"),
+        "REPLICA_ID": "replica-a",
+        "TENANT_ID": "teste_leases",
+    }
+    with config.overrides(values):
+        yield values
+
+
+def as_replica(replica_id):
+    return config.overrides(dict(config.active_overrides(), REPLICA_ID=replica_id))
+
+
+def test_run_once_reports_whether_it_ran(lease_config):
+    assert leases.run_once("job", lambda: "resultado", run_key="r1") == (True, "resultado")
+    with as_replica("replica-b"):
+        assert leases.run_once("job", lambda: "de novo", run_key="r1") == (False, None)
+
+
+def test_run_once_without_leases_always_runs():
+    with config.overrides({"LEASES_ENABLED": False}):
+        assert leases.run_once("job", lambda: 1) == (True, 1)
+
+
+def test_track_job_records_skipped_run(lease_config):
+    leases.run_once("job", lambda: None, run_key="r2")
+    labels = {"tenant": "teste_leases", "job": "job_pulado"}
+    with as_replica("replica-b"):
+        with metrics.track_job("job_pulado") as run:
+            ran, _ = leases.run_once("job", lambda: None, run_key="r2")
+            if not ran:
+                run.skip()
+    assert metrics.JOB_RUNS.get(result="skipped", **labels) == 1
+    assert metrics.JOB_RUNS.get(result="success", **labels) == 0
+    assert metrics.JOB_LAST_SUCCESS.get(**labels) == 0
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "leases.db")
+    with leases.LeaseStore(path, "replica-a") as a, leases.LeaseStore(path, "replica-b") as b:
+        assert a.try_acquire("job", ttl=60) == leases.STATE_HELD
+        assert b.try_acquire("job") == "replica-a"
+        # replica-a caiu sem liberar: o lease expira e replica-b assume
+        assert a.renew("job", ttl=-1)
+        assert b.try_acquire("job") == leases.STATE_HELD
+        assert not a.renew("job")
+        b.release("job", done=True)
+        assert a.try_acquire("job") == leases.STATE_DONE
+
+
+def test_run_once_takes_over_expired_lease(lease_config):
+    with leases.LeaseStore() as store:
+        assert store.try_acquire("teste_leases:job:r3", ttl=60) == leases.STATE_HELD
+        store.renew("teste_leases:job:r3", ttl=-1)
+    with as_replica("replica-b"):
+        assert leases.run_once("job", lambda: "assumido", run_key="r3") == (True, "assumido")
+
+
+def test_lost_lease_stops_job_before_sending(lease_config, tmp_path):
+    submitted = []
+
+    def job():
+        # Outra réplica assume o lease (o de replica-a expirou)
+        with leases.LeaseStore() as store:
+            store.renew("teste_leases:job:r4", ttl=-1)
+        with leases.LeaseStore(replica_id="replica-b") as other:
+            assert other.try_acquire("teste_leases:job:r4") == leases.STATE_HELD
+        # A renovação (a cada LEASE_TTL_SECONDS/3 do tenant) percebe a perda
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                leases.check_lease()
+            except leases.LeaseLost:
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail("perda do lease não detectada")
+        with Outbox(str(tmp_path / "outbox.db")) as outbox:
+            emit = OutboxEmitter(outbox, "2024-03-10", submitted.append)
+            emit({"phone": "11911110000", "flow_id": 1, "cliente_id": 1, "conta_id": 10})
+        return "enviado"
+
+    with config.overrides(dict(lease_config, LEASE_TTL_SECONDS=3)):
+        assert leases.run_once("job", job, run_key="r4") == (False, None)
+    assert submitted == []
+    leases.check_lease()
+
+
+def test_shard_split_covers_every_phone_once():
+    replicas = ["replica-a", "replica-b", "replica-c"]
+    shards = [leases.ShardAssignment(replica, replicas) for replica in replicas]
+    phones = [f"119{n:08d}" for n in range(1000)]
+    owners = [[shard.owns(phone) for shard in shards].count(True) for phone in phones]
+    assert owners == [1] * len(phones)
+    assert all(any(shard.owns(phone) for phone in phones) for shard in shards)
+    # Formatos diferentes do mesmo telefone caem no mesmo shard
+    assert [s.owns("(11) 90000-0001") for s in shards] == [s.owns("11900000001") for s in shards]
+
+
+def test_single_replica_owns_everything():
+    shard = leases.ShardAssignment("replica-a", [])
+    assert shard.owns("11900000001") and shard.owns("")
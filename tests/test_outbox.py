@@ -0,0 +1,120 @@
+from datetime import date, timedelta
+
+import pytest
+
+from scripts import send_messages
+from scripts.coalesce import Coalescer
+from scripts.outbox import Outbox, OutboxEmitter, drain_outbox
+from scripts.send_messages import SendResult
+
+RUN_DATE = "2024-03-10"
+
+
+@pytest.fixture
+def box(tmp_path):
+    with Outbox(str(tmp_path / "outbox.db"), max_attempts=3) as outbox:
+        yield outbox
+
+
+def message(cliente_id, conta_id, phone="(11) 99999-0000", valor="10,00"):
+    return {
+        "phone": phone,
+        "first_name": "Ana",
+        "flow_id": 1,
+        "message_type": "boleto_vencendo_hoje",
+        "cliente_id": cliente_id,
+        "conta_id": conta_id,
+        "field_mappings": {"valor": valor},
+    }
+
+
+def run(box, messages, deliver=lambda msg: True, coalesce=False):
+    """Uma execução do job: registra as mensagens e marca o resultado de cada envio"""
+    submitted = []
+    emitter = OutboxEmitter(box, RUN_DATE, submitted.append)
+    coalescer = Coalescer(emitter, enabled=coalesce)
+    for msg in messages:
+        coalescer.add(dict(msg))
+    coalescer.flush()
+    for msg in submitted:
+        delivered = deliver(msg)
+        box.mark(msg["outbox_key"], delivered, None if delivered else "erro")
+    return submitted, emitter
+
+
+def test_rerun_sends_only_what_was_not_delivered(box):
+    messages = [message(1, 10, phone="11911110000"), message(2, 20, phone="11922220000")]
+    first, _ = run(box, messages, deliver=lambda msg: msg["cliente_id"] == 1)
+    assert len(first) == 2
+
+    second, emitter = run(box, messages)
+    assert [msg["cliente_id"] for msg in second] == [2]
+    assert emitter.skipped == 1
+
+    third, emitter = run(box, messages)
+    assert third == []
+    assert box.counts(RUN_DATE)["sent"] == 2
+
+
+def test_drain_after_crash_sends_pending_once(tmp_path, monkeypatch):
+    delivered = []
+
+    def deliver(phone, first_name, field_mappings, flow_id, session=None):
+        delivered.append(phone)
+        return SendResult(phone=phone, flow_id=flow_id, success=True)
+
+    monkeypatch.setattr(send_messages, "deliver_message", deliver)
+    path = str(tmp_path / "outbox.db")
+    # Queda depois de registrar as mensagens e antes de enviá-las
+    with Outbox(path) as outbox:
+        outbox.enqueue(RUN_DATE, message(1, 10, phone="11911110000"))
+        outbox.enqueue(RUN_DATE, message(2, 20, phone="11922220000"))
+
+    with Outbox(path) as outbox:
+        assert drain_outbox(RUN_DATE, outbox=outbox, max_workers=2)["sent"] == 2
+        assert drain_outbox(RUN_DATE, outbox=outbox, max_workers=2)["total"] == 0
+        assert outbox.counts(RUN_DATE)["sent"] == 2
+    assert sorted(delivered) == ["11911110000", "11922220000"]
+
+
+def test_purge_keeps_retention_window(box):
+    old = (date.today() - timedelta(days=10)).isoformat()
+    recent = (date.today() - timedelta(days=2)).isoformat()
+    box.enqueue(old, message(1, 10))
+    box.enqueue(recent, message(1, 10))
+    assert box.purge(retention_days=7) == 1
+    assert box.counts(old)["pending"] == 0
+    assert box.counts(recent)["pending"] == 1
+
+
+def test_purge_counts_retention_from_reference_date(box):
+    box.enqueue("2024-03-01", message(1, 10))
+    box.enqueue("2024-03-10", message(1, 10))
+    assert box.purge(retention_days=7, reference_date=date(2024, 3, 10)) == 1
+    assert box.counts("2024-03-10")["pending"] == 1
+
+
+def test_failed_message_stops_after_max_attempts(box):
+    messages = [message(1, 10)]
+    for _ in range(3):
+        submitted, _ = run(box, messages, deliver=lambda msg: False)
+        assert len(submitted) == 1
+    submitted, _ = run(box, messages)
+    assert submitted == []
+
+
+def test_claim_blocks_other_owner_until_released(box):
+    key = box.enqueue(RUN_DATE, message(1, 10))
+    assert box.claim(key, "replica-a")
+    assert box.claim(key, "replica-a")
+    assert not box.claim(key, "replica-b")
+    box.mark(key, False, "erro")
+    assert box.claim(key, "replica-b")
+
+
+def test_expired_claim_can_be_taken(box):
+    key = box.enqueue(RUN_DATE, message(1, 10))
+    assert box.claim(key, "replica-a", ttl=-1)
+    assert box.claim(key, "replica-b")
+    box.mark(key, True)
+    assert not box.claim(key, "replica-a")
@@ -0,0 +1,68 @@
+import pytest
+import requests
+
+import config.config as config
+from scripts import http_client, rate_limiter
+from scripts.rate_limiter import TokenBucket
+
+
+@pytest.mark.parametrize("field", ["rate", "min_rate", "max_rate"])
+@pytest.mark.parametrize("value", [0, -1])
+def test_non_positive_rates_rejected(field, value):
+    settings = {"rate": 2, "burst": 1, "min_rate": 0.5, "max_rate": 4}
+    settings[field] = value
+    with pytest.raises(ValueError, match=field):
+        TokenBucket("nextfit", **settings)
+
+
+def test_get_limiter_rejects_zero_rate():
+    rate_limits = {"zero": {"rate": 0, "max_rate": 1, "min_rate": 0.1, "burst": 1}}
+    with config.overrides({"TENANT_ID": "teste_rate_zero", "RATE_LIMITS": rate_limits}):
+        with pytest.raises(ValueError, match="zero"):
+            rate_limiter.get_limiter("zero")
+
+
+def test_throttle_keeps_rate_above_minimum():
+    bucket = TokenBucket("nextfit", rate=1, burst=1, min_rate=0.5, max_rate=2)
+    for _ in range(5):
+        bucket.on_throttle(retry_after=0)
+    assert bucket.rate == 0.5
+
+
+def test_success_increases_rate_up_to_maximum():
+    bucket = TokenBucket("nextfit", rate=1, burst=1, min_rate=0.5, max_rate=2)
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 2
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response._content = b""
+        return response
+
+
+@pytest.mark.parametrize("status, increases", [(200, True), (304, True), (404, False), (500, False), (503, False)])
+def test_only_successful_responses_increase_rate(status, increases):
+    rate_limits = {"aimd": {"rate": 50, "max_rate": 100, "min_rate": 1, "burst": 100}}
+    with config.overrides({"TENANT_ID": f"teste_aimd_{status}", "RATE_LIMITS": rate_limits}):
+        limiter = rate_limiter.get_limiter("aimd")
+        for _ in range(5):
+            response = http_client.request("aimd", "GET", "http://api.test/x", session=FakeSession([status]))
+            assert response.status_code == status
+    assert (limiter.rate > 50) is increases
+
+
+def test_transport_never_retries_429():
+    with config.overrides({"TENANT_ID": "teste_transport_429"}):
+        session = http_client.create_session("nextfit")
+    retry = session.get_adapter("https://api.test").max_retries
+    assert not retry.respect_retry_after_header
+    assert 429 not in retry.status_forcelist
+    assert not retry.is_retry("GET", 429, has_retry_after=True)
+    assert retry.is_retry("GET", 503, has_retry_after=True)
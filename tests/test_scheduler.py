@@ -0,0 +1,99 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import config.config as config
+from scripts import tenants
+
+
+@pytest.fixture(scope="module")
+def main_module(tmp_path_factory):
+    # main.py recria o processo dentro do venv ao ser importado; nos testes o ambiente já está pronto
+    import setup_venv
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(setup_venv, "ensure_venv", lambda: True)
+        patch.setenv("LOG_DIR", str(tmp_path_factory.mktemp("logs")))
+        import main
+    return main
+
+
+@pytest.fixture
+def scheduler(main_module, monkeypatch):
+    scheduler = main_module.create_scheduler(BackgroundScheduler, max_workers=2)
+    monkeypatch.setattr(main_module, "scheduler", scheduler)
+    yield scheduler
+    if scheduler.running:
+        scheduler.shutdown(wait=True)
+
+
+def make_tenants(tmp_path, count):
+    return [tenants.build_tenant({"id": f"academia{i}", "data_dir": str(tmp_path / f"academia{i}"),
+                                  "settings": {"LEASES_ENABLED": False}})
+            for i in range(count)]
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_every_tenant_check_runs_when_pool_is_saturated(main_module, scheduler, monkeypatch, tmp_path):
+    ran = []
+    lock = threading.Lock()
+
+    def fake_check():
+        time.sleep(0.5)
+        with lock:
+            ran.append(config.TENANT_ID)
+
+    monkeypatch.setattr(main_module.check_accounts, "check_accounts_and_birthdays", fake_check)
+    tenant_list = make_tenants(tmp_path, 8)
+    for tenant in tenant_list:
+        main_module.schedule_tenant(tenant)
+
+    # Todas as verificações vencem juntas com 2 threads: as últimas esperam bem mais que 1s na fila
+    scheduler.start(paused=True)
+    now = datetime.now(main_module.TZ_BRASILIA)
+    for tenant in tenant_list:
+        scheduler.modify_job(tenant.job_id("check_accounts"), next_run_time=now)
+    scheduler.resume()
+
+    assert wait_for(lambda: len(ran) == len(tenant_list))
+    assert sorted(ran) == sorted(tenant.id for tenant in tenant_list)
+
+
+def test_busy_tenant_is_rescheduled_without_holding_a_worker(main_module, scheduler, monkeypatch, tmp_path):
+    ran = []
+    monkeypatch.setattr(main_module.check_accounts, "check_accounts_and_birthdays", lambda: ran.append(1))
+    tenant = tenants.Tenant("academia_ocupada", {"LEASES_ENABLED": False})
+
+    with tenant.job_slot(tenants.SLOT_SEND) as acquired:
+        assert acquired
+        started = time.monotonic()
+        main_module.job_check_accounts(tenant)
+        assert time.monotonic() - started < 1
+    assert ran == []
+    retry = scheduler.get_job(tenant.job_id("check_accounts_retry"))
+    assert retry is not None and retry.args == (tenant,)
+
+    main_module.job_check_accounts(tenant)
+    assert ran == [1]
+
+
+def test_check_runs_while_collection_is_running(main_module, scheduler, monkeypatch):
+    ran = []
+    monkeypatch.setattr(main_module.check_accounts, "check_accounts_and_birthdays", lambda: ran.append(1))
+    tenant = tenants.Tenant(config.TENANT_ID, {"LEASES_ENABLED": False}, scoped=False)
+
+    with tenant.job_slot(tenants.SLOT_COLLECT) as acquired:
+        assert acquired
+        main_module.job_check_accounts(tenant)
+    assert ran == [1]
+    assert scheduler.get_job(tenant.job_id("check_accounts_retry")) is None
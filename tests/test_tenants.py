@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import config.config as config
+from scripts import tenants, tracing
+from scripts.pagination import iter_pages
+
+
+@pytest.fixture
+def tenant(tmp_path):
+    return tenants.build_tenant({
+        "id": "academia_centro",
+        "api_key": "chave-centro",
+        "data_dir": str(tmp_path / "centro"),
+        "flow_ids": {"aniversariante": 999},
+        "settings": {"SEND_MESSAGES": False},
+    })
+
+
+def test_activate_overrides_and_restores(tenant, tmp_path):
+    global_key = config.API_KEY
+    with tenant.activate():
+        assert config.TENANT_ID == "academia_centro"
+        assert config.API_KEY == "chave-centro"
+        assert config.OUTBOX_DB_PATH == str(tmp_path / "centro" / "outbox.db")
+        assert config.FLOW_IDS["aniversariante"] == 999
+        assert config.SEND_MESSAGES is False
+    assert config.API_KEY == global_key
+    assert config.TENANT_ID != "academia_centro"
+
+
+def test_worker_thread_sees_tenant_values(tenant):
+    with tenant.activate():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            propagated = executor.submit(tracing.propagate(lambda: (config.TENANT_ID, config.API_KEY))).result()
+            bare = executor.submit(lambda: config.TENANT_ID).result()
+    assert propagated == ("academia_centro", "chave-centro")
+    # Sem tracing.propagate a thread lê a configuração global
+    assert bare != "academia_centro"
+
+
+def test_page_prefetch_threads_see_tenant_values(tenant):
+    def fetch_page(skip):
+        return {"tenant": config.TENANT_ID, "items": [skip] if skip < 3 else []}
+
+    with tenant.activate():
+        pages = list(iter_pages(fetch_page, take=1, prefetch=3,
+                                is_last=lambda page: not page["items"]))
+    assert pages
+    assert {page["tenant"] for _, page in pages} == {"academia_centro"}
+
+
+def test_overrides_are_per_thread(tenant):
+    seen = {}
+
+    def other():
+        seen["tenant"] = config.TENANT_ID
+
+    with tenant.activate():
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+    assert seen["tenant"] != "academia_centro"
+
+
+def test_unknown_settings_rejected():
+    with pytest.raises(ValueError):
+        tenants.build_tenant({"id": "x", "settings": {"NAO_EXISTE": 1}})
+    with pytest.raises(ValueError):
+        with config.overrides({"NAO_EXISTE": 1}):
+            pass
+
+
+def test_invalid_tenant_id_rejected():
+    with pytest.raises(ValueError):
+        tenants.build_tenant({"id": "../fora"})
+
+
+def test_get_tenant_by_id(tmp_path):
+    path = tmp_path / "tenants.json"
+    path.write_text(
+        '{"tenants": [{"id": "a", "data_dir": "%s"}, {"id": "b", "data_dir": "%s"}]}'
+        % (tmp_path / "a", tmp_path / "b"), encoding="utf-8")
+    assert tenants.get_tenant("b", path=str(path)).id == "b"
+    with pytest.raises(ValueError):
+        tenants.get_tenant(None, path=str(path))
+    with pytest.raises(ValueError):
+        tenants.get_tenant("c", path=str(path))
+
+
+def test_get_tenant_single(monkeypatch):
+    monkeypatch.setattr(config, "TENANTS_FILE", "")
+    assert tenants.get_tenant().id == config.TENANT_ID
+
+
+def test_job_slots_by_kind():
+    tenant = tenants.Tenant("academia_slots")
+    with tenant.job_slot(tenants.SLOT_COLLECT) as collect:
+        with tenant.job_slot(tenants.SLOT_SEND) as send:
+            assert collect and send
+        with tenant.job_slot(tenants.SLOT_COLLECT) as again:
+            assert not again
+    # Coleta exclusiva: segura os dois tipos; um tipo ocupado libera o que já tinha reservado
+    with tenant.job_slot(tenants.SLOT_SEND):
+        with tenant.job_slot(tenants.SLOT_COLLECT, tenants.SLOT_SEND) as both:
+            assert not both
+        with tenant.job_slot(tenants.SLOT_COLLECT) as collect:
+            assert collect
+
+
+def test_single_job_slot_serializes_kinds():
+    tenant = tenants.Tenant("academia_serial", max_concurrent_jobs=1)
+    with tenant.job_slot(tenants.SLOT_COLLECT):
+        with tenant.job_slot(tenants.SLOT_SEND) as send:
+            assert not send
+    with tenant.job_slot(tenants.SLOT_SEND) as send:
+        assert send